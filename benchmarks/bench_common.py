@@ -0,0 +1,102 @@
+"""
+Microbenchmarks of catalog.common.
+
+Compares diff_offers with the former nested loop implementation of compute_prices_to_insert
+and times the other helpers on the hot paths of the updater and of the endpoints.
+Run from the repository root:
+
+    $ python benchmarks/bench_common.py
+    $ python benchmarks/bench_common.py --sizes 10 1000 100000 --legacy-max 10000
+"""
+import os
+import sys
+import random
+import datetime
+import timeit
+import argparse
+from pathlib import Path
+
+sys.path.append(str(Path(os.path.dirname(__file__)).parent))
+
+from catalog.common import diff_offers, offers_digest, calculate_growth, next_cursor, to_ndjson
+
+
+def legacy_compute_prices_to_insert(api_offers: list[dict], db_offers: list[dict]) -> list[dict]:
+    """
+    The original O(n*m) implementation kept as a baseline.
+    """
+    prices_to_insert = []
+    for api_offer in api_offers:
+        for db_offer in db_offers:
+            if api_offer["id"] == db_offer["foreign_id"]:
+                if api_offer["price"] != db_offer["price"]:
+                    prices_to_insert.append(dict(offer_id=db_offer["offer_id"], price=api_offer["price"]))
+                break
+    return prices_to_insert
+
+
+def make_offers(size: int, churn: float = 0.1) -> tuple[list[dict], list[dict]]:
+    """
+    Generates API and DB offers of one product. A churn fraction of prices differs.
+    """
+    rnd = random.Random(size)
+    db_offers = [dict(offer_id=i + 1000, foreign_id=i, price=rnd.randint(1, 1000), items_in_stock=rnd.randint(0, 9))
+                 for i in range(size)]
+    api_offers = [dict(id=o["foreign_id"],
+                       price=o["price"] + 1 if rnd.random() < churn else o["price"],
+                       items_in_stock=o["items_in_stock"])
+                  for o in db_offers]
+    rnd.shuffle(api_offers)
+    return api_offers, db_offers
+
+
+def make_prices(size: int) -> list[dict]:
+    """
+    Generates price history records as returned by the prices endpoint query.
+    """
+    start = datetime.datetime(2022, 1, 1)
+    return [dict(id=i, price=1000 + i % 100, valid_from=start + datetime.timedelta(minutes=i)) for i in range(size)]
+
+
+def bench(func, *args) -> float:
+    """
+    Returns the best time of one call in seconds.
+    """
+    timer = timeit.Timer(lambda: func(*args))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000], help="offers per product")
+    parser.add_argument("--legacy-max", type=int, default=10000,
+                        help="largest size the quadratic implementation is run for")
+    args = parser.parse_args()
+
+    print(f"{'offers':>8} {'diff_offers':>14} {'per offer':>10} {'legacy':>14} {'speedup':>9}")
+    for size in args.sizes:
+        api_offers, db_offers = make_offers(size)
+        new = bench(diff_offers, api_offers, db_offers)
+        if size <= args.legacy_max:
+            old = bench(legacy_compute_prices_to_insert, api_offers, db_offers)
+            legacy, speedup = f"{old * 1e3:11.3f} ms", f"{old / new:8.1f}x"
+        else:
+            legacy, speedup = "skipped", "-"
+        print(f"{size:>8} {new * 1e3:11.3f} ms {new / size * 1e9:7.0f} ns {legacy:>14} {speedup:>9}")
+
+    helpers = dict(offers_digest=lambda size: (offers_digest, make_offers(size)[0]),
+                   calculate_growth=lambda size: (calculate_growth, make_prices(size)),
+                   next_cursor=lambda size: (lambda prices: next_cursor(prices, size, ("valid_from", "id")),
+                                             make_prices(size)),
+                   to_ndjson=lambda size: (to_ndjson, make_prices(size)))
+    print(f"\n{'helper':>16} {'records':>8} {'time':>14} {'per record':>11}")
+    for name, make in helpers.items():
+        for size in args.sizes:
+            func, records = make(size)
+            took = bench(func, records)
+            print(f"{name:>16} {size:>8} {took * 1e3:11.3f} ms {took / size * 1e9:8.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+CPU time per request of the product, offers and prices endpoints: the generic FastAPI response path
+(response_model validation, jsonable_encoder and json.dumps of dict rows) against FastJSONResponse
+(orjson of trusted records, prices straight from cursor tuples).
+
+The endpoints are served in process through httpx ASGI transport from in-memory records, so the numbers
+include routing and the HTTP framing but no network or DB. Run from the repository root:
+
+    $ python benchmarks/bench_serialization.py
+    $ python benchmarks/bench_serialization.py --sizes 10 1000 100000 --time 2
+"""
+import os
+import sys
+import time
+import asyncio
+import datetime
+import argparse
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI
+
+sys.path.append(str(Path(os.path.dirname(__file__)).parent))
+
+from catalog.common import FastJSONResponse, calculate_growth, cleanup_prices
+from catalog.models import Product
+from catalog.snapshot import ProductOffers
+
+
+PRICE_COLUMNS = ("id", "price", "valid_from")
+
+
+def make_offers(size: int) -> ProductOffers:
+    return ProductOffers(42, [dict(offer_id=i, price=1000 + i % 100, items_in_stock=i % 10) for i in range(size)])
+
+
+def make_price_rows(size: int) -> list[tuple]:
+    """
+    Generates price history rows as the plain cursor returns them.
+    """
+    start = datetime.datetime(2022, 1, 1)
+    return [(i, 1000 + i % 100, start + datetime.timedelta(minutes=i)) for i in range(size)]
+
+
+def make_app(offers: ProductOffers, price_rows: list[tuple]) -> FastAPI:
+    """
+    Serves the same records by the former generic path under /legacy and by the fast path under /fast.
+    """
+    app = FastAPI()
+    product = dict(id=42, name="Benzinová sekačka Dosquarna", description="Nejlepší sekačka na trhu. TLDR")
+
+    @app.get("/legacy/product", response_model=Product)
+    async def legacy_product() -> dict:
+        return dict(product)
+
+    @app.get("/fast/product", response_model=Product)
+    async def fast_product() -> FastJSONResponse:
+        return FastJSONResponse(dict(product))
+
+    @app.get("/legacy/offers")
+    async def legacy_offers():
+        return offers.select(False)
+
+    @app.get("/fast/offers")
+    async def fast_offers():
+        return FastJSONResponse(offers.select(False))
+
+    @app.get("/legacy/prices")
+    async def legacy_prices():
+        # dict cursor rows, as pymysql DictCursor builds them
+        prices = cleanup_prices([dict(zip(PRICE_COLUMNS, row)) for row in price_rows])
+        return dict(prices=prices, growth=calculate_growth(prices))
+
+    @app.get("/fast/prices")
+    async def fast_prices():
+        prices = [dict(price=price, valid_from=valid_from) for _, price, valid_from in price_rows]
+        return FastJSONResponse(dict(prices=prices, growth=calculate_growth(price_rows, 1, 1)))
+
+    return app
+
+
+async def cpu_per_request(client: httpx.AsyncClient, path: str, min_time: float) -> tuple[float, bytes]:
+    """
+    Returns CPU seconds of one request, averaged over requests run for at least min_time seconds,
+    and body of the response.
+    """
+    body = (await client.get(path)).content
+    requests, start = 0, time.process_time()
+    while (took := time.process_time() - start) < min_time or requests < 3:
+        response = await client.get(path)
+        response.raise_for_status()
+        requests += 1
+    return took / requests, body
+
+
+async def run(sizes: list[int], min_time: float) -> None:
+    print(f"{'endpoint':>8} {'records':>8} {'legacy':>12} {'fast':>12} {'speedup':>8}")
+    for size in sizes:
+        app = make_app(make_offers(size), make_price_rows(size))
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            for endpoint in ("product", "offers", "prices"):
+                if endpoint == "product" and size != sizes[0]:
+                    continue
+                legacy, legacy_body = await cpu_per_request(client, f"/legacy/{endpoint}", min_time)
+                fast, fast_body = await cpu_per_request(client, f"/fast/{endpoint}", min_time)
+                # the fast path has to send the same JSON, only without spaces
+                assert httpx.Response(200, content=legacy_body).json() == httpx.Response(200, content=fast_body).json()
+                records = 1 if endpoint == "product" else size
+                print(f"{endpoint:>8} {records:>8} {legacy * 1e3:9.3f} ms {fast * 1e3:9.3f} ms {legacy / fast:7.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000],
+                        help="offers and prices per response")
+    parser.add_argument("--time", type=float, default=1, help="min CPU seconds spent on each measurement")
+    args = parser.parse_args()
+    asyncio.run(run(args.sizes, args.time))
+
+
+if __name__ == "__main__":
+    main()
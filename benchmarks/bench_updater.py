@@ -0,0 +1,103 @@
+"""
+Benchmark of the periodic offers update sweep against local MySQL and the local fake offers service.
+
+For each size the given number of products is created and three sweeps are timed:
+    - new:       offers of all products are inserted
+    - churn:     a churn fraction of prices changed since the previous sweep
+    - unchanged: no price changed, payloads are skipped by their digest
+The products are deleted afterwards. Use a dedicated benchmark database, the fake offers service gets registered
+in it and every due product in it is updated. Run from the repository root with the usual MYSQL_* env vars:
+
+    $ docker-compose up -d db
+    $ MYSQL_HOST=127.0.0.1 MYSQL_DB=product_catalog_db MYSQL_USER=root MYSQL_PASSWORD=secret \\
+      python benchmarks/bench_updater.py --sizes 1000 10000 100000 --offers 10 --latency 20
+
+Updater settings are taken from its env vars, e.g. UPDATER_CONCURRENCY or UPDATER_BATCH_SIZE.
+"""
+import os
+import sys
+import uuid
+import argparse
+from time import perf_counter
+from pathlib import Path
+
+sys.path.append(str(Path(os.path.dirname(__file__)).parent))
+
+from fake_offers_api import FakeOffersApi
+from catalog.db import ProductCatalogDB, chunks, places, row_places
+from catalog.offers import OffersApi
+from catalog.updater import OffersUpdater
+
+
+def create_products(db, count: int) -> list[int]:
+    """
+    Inserts count products of the service and returns their ids.
+    """
+    prefix = uuid.uuid4().hex[:8]
+    names = [f"bench-{prefix}-{i}" for i in range(count)]
+    for chunk in chunks(names, 1000):
+        db._execute(f"INSERT INTO product (service_id, name, description) VALUES {row_places(chunk, 3)}",
+                    [arg for name in chunk for arg in (db.service_id, name, "updater benchmark product")])
+    return [row["id"] for row in db._select_all("SELECT id FROM product WHERE name LIKE %s", [f"bench-{prefix}-%"])]
+
+
+def make_due(db, product_ids: list[int]) -> None:
+    for chunk in chunks(product_ids, 1000):
+        db._execute(f"UPDATE product_refresh SET next_refresh_at=NOW() WHERE product_id IN ({places(chunk)})", chunk)
+
+
+def delete_products(db, product_ids: list[int]) -> None:
+    for chunk in chunks(product_ids, 1000):
+        db._execute(f"DELETE FROM product WHERE id IN ({places(chunk)})", chunk)
+
+
+def sweep(updater) -> tuple[float, dict]:
+    """
+    Runs one sweep and returns its duration and the updater counters of the sweep.
+    """
+    before = updater.stats()
+    start = perf_counter()
+    updater.update_due()
+    took = perf_counter() - start
+    after = updater.stats()
+    return took, {name: after[name] - before[name] for name in ("fetched", "skipped", "synced", "failed")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="products per run")
+    parser.add_argument("--offers", type=int, default=10, help="offers of each product")
+    parser.add_argument("--churn", type=float, default=0.1, help="fraction of prices changed between sweeps")
+    parser.add_argument("--latency", type=float, default=0, help="mean offers service latency in ms")
+    parser.add_argument("--port", type=int, default=8001,
+                        help="port of the fake offers service, keep it the same, the service url is stored in DB")
+    args = parser.parse_args()
+
+    server = FakeOffersApi(args.port, latency=args.latency / 1000, offers=args.offers, churn=args.churn).start()
+    os.environ["OFFERS_API_BASE_URL"] = server.base_url
+    # updater and offers API client read their settings when created
+    os.environ["UPDATER_MAX_DUE"] = str(max(args.sizes))
+    # rate limit would measure itself instead of the sweep
+    os.environ.setdefault("OFFERS_API_RATE", "0")
+
+    db = ProductCatalogDB()
+    updater = OffersUpdater(db, OffersApi(db.access_token, pool_size=int(os.environ.get("UPDATER_CONCURRENCY", 8))))
+
+    print(f"{'products':>9} {'sweep':>10} {'time':>10} {'products/s':>11} {'synced':>7} {'skipped':>8} {'failed':>7}")
+    for size in args.sizes:
+        product_ids = create_products(db, size)
+        try:
+            for name, advance in (("new", False), ("churn", True), ("unchanged", False)):
+                if advance:
+                    server.advance()
+                make_due(db, product_ids)
+                took, counts = sweep(updater)
+                print(f"{size:>9} {name:>10} {took:>8.2f} s {size / took:>11.0f} "
+                      f"{counts['synced']:>7} {counts['skipped']:>8} {counts['failed']:>7}")
+        finally:
+            delete_products(db, product_ids)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
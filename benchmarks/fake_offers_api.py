@@ -0,0 +1,164 @@
+"""
+Local fake of the external offers service, so benchmarks do not depend on the hosted one.
+
+Every product has a stable set of offers, a churn fraction of their prices changes in each round.
+Rounds advance every --churn-every seconds, within a round the same product gets the same offers.
+Run from the repository root and point OFFERS_API_BASE_URL to it:
+
+    $ python benchmarks/fake_offers_api.py --port 8001 --latency 50 --offers 20 --churn 0.1 --churn-every 60
+    $ export OFFERS_API_BASE_URL=http://127.0.0.1:8001/api/v1
+"""
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+OFFERS_PATH = re.compile(r"/api/v1/products/(\d+)/offers")
+
+
+class FakeOffersApi(ThreadingHTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port: int, latency: float = 0.0, jitter: float = 0.0, offers: int = 10,
+                 churn: float = 0.1, error_rate: float = 0.0):
+        """
+        Args:
+            port          (int): port to listen on, 0 picks a free one
+            latency     (float): mean response latency in seconds
+            jitter      (float): max random deviation of the latency in seconds
+            offers        (int): number of offers of each product
+            churn       (float): fraction of offer prices changed in each round, see advance
+            error_rate  (float): fraction of requests answered by 503
+        """
+        super().__init__(("127.0.0.1", port), FakeOffersHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.offers = offers
+        self.churn = churn
+        self.error_rate = error_rate
+        self.requests = 0
+        self.round = 0
+        self._products = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/api/v1"
+
+    def advance(self) -> None:
+        """
+        Starts a new round, the next request of each product changes a churn fraction of its prices.
+        """
+        with self._lock:
+            self.round += 1
+
+    def product_offers(self, product_id: int) -> list[dict]:
+        """
+        Returns offers of the product. Prices are changed once per round.
+        """
+        with self._lock:
+            round, offers = self._products.get(product_id, (None, None))
+            if offers is None:
+                rnd = random.Random(product_id)
+                offers = [dict(id=product_id * 1000 + i, price=rnd.randint(100, 10000),
+                               items_in_stock=rnd.randint(0, 50))
+                          for i in range(self.offers)]
+            elif round < self.round:
+                offers = [dict(offer, price=offer["price"] + random.randint(1, 100))
+                          if random.random() < self.churn else offer
+                          for offer in offers]
+            self._products[product_id] = (self.round, offers)
+            return offers
+
+    def start(self) -> "FakeOffersApi":
+        """
+        Serves requests in a daemon thread, handy for benchmarks running in the same process.
+        """
+        threading.Thread(target=self.serve_forever, name="fake-offers-api", daemon=True).start()
+        return self
+
+    def advance_every(self, seconds: float) -> None:
+        """
+        Advances rounds every given seconds in a daemon thread.
+        """
+        def advance():
+            while not self._stop.wait(seconds):
+                self.advance()
+
+        threading.Thread(target=advance, name="fake-offers-churn", daemon=True).start()
+
+
+class FakeOffersHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self._read_body()
+        if self.path == "/api/v1/auth":
+            self._respond(201, dict(access_token=str(uuid.uuid4())))
+        elif self.path == "/api/v1/products/register":
+            self._respond(201, dict(id=0))
+        else:
+            self._respond(404, dict(msg="Not found"))
+
+    def do_GET(self):
+        match = OFFERS_PATH.fullmatch(self.path)
+        if match:
+            self._respond(200, self.server.product_offers(int(match[1])))
+        else:
+            self._respond(404, dict(msg="Not found"))
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _respond(self, status: int, body) -> None:
+        server = self.server
+        with server._lock:
+            server.requests += 1
+        delay = server.latency + random.uniform(-server.jitter, server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if random.random() < server.error_rate:
+            status, body = 503, dict(msg="Service unavailable")
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0, help="mean response latency in ms")
+    parser.add_argument("--jitter", type=float, default=0, help="max random deviation of the latency in ms")
+    parser.add_argument("--offers", type=int, default=10, help="offers of each product")
+    parser.add_argument("--churn", type=float, default=0.1, help="fraction of prices changed in each round")
+    parser.add_argument("--churn-every", type=float, default=60, help="seconds of one round")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered by 503")
+    args = parser.parse_args()
+
+    server = FakeOffersApi(args.port, args.latency / 1000, args.jitter / 1000, args.offers, args.churn,
+                           args.error_rate)
+    server.advance_every(args.churn_every)
+    print(f"Fake offers API listening at {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server._stop.set()
+
+
+if __name__ == "__main__":
+    main()
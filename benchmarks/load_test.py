@@ -0,0 +1,175 @@
+"""
+Load generator driving the endpoints of a running product catalog.
+
+Keeps a fixed number of concurrent clients sending a mix of requests for a given time
+and reports throughput and p50/p99 latency of each scenario. Products are created through
+POST /products/batch first, their offers and prices are read once the updater has fetched them.
+Run from the repository root against a running application, e.g. started by docker-compose:
+
+    $ python benchmarks/load_test.py --url http://127.0.0.1 --products 100 --concurrency 50 --duration 30
+    $ python benchmarks/load_test.py --save baseline.json
+    $ python benchmarks/load_test.py --baseline baseline.json --max-regression 0.2
+
+With --baseline the exit code is 1 when p99 latency or throughput of any scenario is worse than the baseline
+by more than the allowed fraction, so it can guard a CI pipeline.
+"""
+import sys
+import json
+import uuid
+import random
+import asyncio
+import argparse
+from time import perf_counter
+
+import httpx
+
+
+def percentile(latencies: list[float], q: float) -> float:
+    """
+    Returns q-th percentile (0 - 1) of given latencies by the nearest rank.
+    """
+    if not latencies:
+        return 0.0
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def seed_products(client: httpx.AsyncClient, count: int) -> list[int]:
+    """
+    Creates count products and returns their ids.
+    """
+    prefix = uuid.uuid4().hex[:8]
+    products = [dict(name=f"load-{prefix}-{i}", description="load test product") for i in range(count)]
+    ids = []
+    for i in range(0, count, 1000):
+        response = await client.post("/products/batch", json=products[i:i + 1000])
+        response.raise_for_status()
+        ids += [item["product"]["id"] for item in response.json() if item["product"]]
+    return ids
+
+
+async def delete_products(client: httpx.AsyncClient, ids: list[int]) -> None:
+    await asyncio.gather(*(client.delete(f"/product/{id}") for id in ids))
+
+
+async def find_offer_ids(client: httpx.AsyncClient, product_ids: list[int]) -> list[int]:
+    """
+    Returns ids of offers already fetched for given products.
+    """
+    responses = await asyncio.gather(*(client.get(f"/product/{id}/offers") for id in product_ids[:100]))
+    return [offer["id"] for response in responses if response.status_code == 200 for offer in response.json()]
+
+
+def scenarios(product_ids: list[int], offer_ids: list[int]) -> dict:
+    """
+    Returns scenario name mapped to function returning url of the next request.
+    """
+    result = dict(product=lambda: f"/product/{random.choice(product_ids)}",
+                  products=lambda: "/products?ids=" + ",".join(map(str, random.sample(product_ids,
+                                                                                      min(20, len(product_ids))))),
+                  offers=lambda: f"/product/{random.choice(product_ids)}/offers")
+    if offer_ids:
+        result["prices"] = lambda: f"/offer/{random.choice(offer_ids)}/prices"
+        result["prices_hour"] = lambda: f"/offer/{random.choice(offer_ids)}/prices?bucket=hour"
+    return result
+
+
+async def run(client: httpx.AsyncClient, urls: dict, concurrency: int, duration: float) -> dict:
+    """
+    Sends requests of randomly chosen scenarios from concurrency clients for duration seconds.
+
+    Returns:
+        dict: scenario name mapped to dict of latencies and number of errors
+    """
+    results = {name: dict(latencies=[], errors=0) for name in urls}
+    names = list(urls)
+    deadline = perf_counter() + duration
+
+    async def client_loop():
+        while perf_counter() < deadline:
+            name = random.choice(names)
+            start = perf_counter()
+            try:
+                response = await client.get(urls[name]())
+                failed = response.status_code >= 500
+            except httpx.HTTPError:
+                failed = True
+            results[name]["latencies"].append(perf_counter() - start)
+            results[name]["errors"] += failed
+
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    return results
+
+
+def summarize(results: dict, duration: float) -> dict:
+    return {name: dict(requests=len(result["latencies"]),
+                       errors=result["errors"],
+                       rps=len(result["latencies"]) / duration,
+                       p50=percentile(result["latencies"], 0.5),
+                       p99=percentile(result["latencies"], 0.99))
+            for name, result in results.items()}
+
+
+def regressions(summary: dict, baseline: dict, max_regression: float) -> list[str]:
+    """
+    Returns descriptions of scenarios whose p99 or throughput got worse than the baseline by more than allowed.
+    """
+    found = []
+    for name, current in summary.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if base["p99"] and current["p99"] > base["p99"] * (1 + max_regression):
+            found.append(f"{name}: p99 {current['p99'] * 1e3:.1f} ms, baseline {base['p99'] * 1e3:.1f} ms")
+        if base["rps"] and current["rps"] < base["rps"] * (1 - max_regression):
+            found.append(f"{name}: {current['rps']:.0f} req/s, baseline {base['rps']:.0f} req/s")
+    return found
+
+
+async def main_async(args) -> int:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+        product_ids = await seed_products(client, args.products)
+        try:
+            if args.wait:
+                print(f"Waiting {args.wait} s for the updater to fetch offers")
+                await asyncio.sleep(args.wait)
+            offer_ids = await find_offer_ids(client, product_ids)
+            await run(client, scenarios(product_ids, offer_ids), args.concurrency, min(args.duration, 3))  # warm up
+            results = await run(client, scenarios(product_ids, offer_ids), args.concurrency, args.duration)
+        finally:
+            await delete_products(client, product_ids)
+
+    summary = summarize(results, args.duration)
+    print(f"{'scenario':>12} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50':>10} {'p99':>10}")
+    for name, s in summary.items():
+        print(f"{name:>12} {s['requests']:>9} {s['errors']:>7} {s['rps']:>9.1f} "
+              f"{s['p50'] * 1e3:>7.1f} ms {s['p99'] * 1e3:>7.1f} ms")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(summary, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(summary, json.load(f), args.max_regression)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        return 1 if found else 0
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1", help="base url of the application")
+    parser.add_argument("--products", type=int, default=100, help="number of products created for the test")
+    parser.add_argument("--concurrency", type=int, default=50, help="number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of the measured run")
+    parser.add_argument("--wait", type=float, default=0, help="seconds to wait for the updater before the run")
+    parser.add_argument("--save", help="file to save the summary into, e.g. as a baseline")
+    parser.add_argument("--baseline", help="summary file to compare the results with")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed fraction of regression")
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
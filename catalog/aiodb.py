@@ -0,0 +1,793 @@
+import logging
+import datetime
+import time
+from contextlib import asynccontextmanager
+from time import perf_counter
+from os import environ
+from typing import Iterable
+
+import aiomysql
+import pymysql
+from pymysql.constants import CLIENT
+from fastapi import HTTPException
+
+from catalog.models import ProductNoId, Bucket, bucket_seconds
+from catalog.cache import LRUCache
+from catalog.snapshot import OffersSnapshot, ProductOffers
+from catalog.pool import AsyncBoundedPool, PoolStats
+from catalog.db import places, row_places, chunks
+from catalog.metrics import caller_name, observe_query
+from catalog.profiling import SlowQueryLog
+
+
+log = logging.getLogger()
+
+
+ROWS_PER_STATEMENT = 1000
+# boundaries of price history resolutions, see catalog.retention
+RAW_SINCE = "(SELECT raw_since FROM price_retention WHERE id=1)"
+HOURLY_SINCE = "(SELECT hourly_since FROM price_retention WHERE id=1)"
+
+
+class AsyncDB:
+    def __init__(self):
+        """
+        The pools can be created only inside of a running event loop, see connect.
+
+        Reads go to read replicas listed in comma separated MYSQL_REPLICA_HOST env var, round robin.
+        Each replica has its own pool of MYSQL_REPLICA_POOL_SIZE connections, so read capacity grows
+        with every replica added. Replica lagging behind the primary by more than MYSQL_REPLICA_MAX_LAG seconds,
+        with stopped replication or unreachable is left out until it catches up, its lag is checked at most
+        once per MYSQL_REPLICA_LAG_CHECK seconds. With no healthy replica the reads go to the primary.
+        Queries of the primitives running longer than SLOW_QUERY_THRESHOLD are kept, see SlowQueryLog,
+        streamed ones are left out as their duration depends on the client.
+        """
+        self._pool = None
+        self._slow_queries = SlowQueryLog("api")
+        self._replica_hosts = [host for host in environ.get("MYSQL_REPLICA_HOST", "").split(",") if host]
+        self._replicas = []
+        self._replica_healthy = []
+        self._replica_max_lag = float(environ.get("MYSQL_REPLICA_MAX_LAG", 5))
+        self._replica_lag_check = float(environ.get("MYSQL_REPLICA_LAG_CHECK", 5))
+        self._replica_checked_at = 0.0
+        self._next_replica = 0
+
+    async def connect(self) -> None:
+        """
+        Creates the connection pools. Pool size is taken from MYSQL_ASYNC_POOL_SIZE env var,
+        waiting for a free connection is bounded the same way as in DB, see catalog.pool.AsyncBoundedPool.
+        Rowcount of UPDATE counts matched rows as mysql.connector does by default.
+        """
+        pool_size = int(environ.get("MYSQL_ASYNC_POOL_SIZE", 20))
+        self._pool = await self._create_pool(environ["MYSQL_HOST"], pool_size, "api")
+        replica_pool_size = int(environ.get("MYSQL_REPLICA_POOL_SIZE", pool_size))
+        self._replicas = [await self._create_pool(host, replica_pool_size, f"replica:{host}")
+                          for host in self._replica_hosts]
+        self._replica_healthy = [True] * len(self._replicas)
+
+    @staticmethod
+    async def _create_pool(host: str, size: int, name: str) -> AsyncBoundedPool:
+        pool = await aiomysql.create_pool(minsize=1,
+                                          maxsize=size,
+                                          host=host,
+                                          db=environ["MYSQL_DB"],
+                                          user=environ["MYSQL_USER"],
+                                          password=environ["MYSQL_PASSWORD"],
+                                          autocommit=True,
+                                          client_flag=CLIENT.FOUND_ROWS,
+                                          )
+        return AsyncBoundedPool(pool,
+                                size=size,
+                                timeout=float(environ.get("MYSQL_POOL_TIMEOUT", 5)),
+                                max_waiting=int(environ.get("MYSQL_POOL_MAX_WAITING", 100)),
+                                retry_after=int(environ.get("MYSQL_POOL_RETRY_AFTER", 1)),
+                                name=name,
+                                )
+
+    @property
+    def pool_stats(self) -> PoolStats:
+        return self._pool.stats
+
+    @property
+    def replica_pool_stats(self) -> dict[str, PoolStats]:
+        return {host: replica.stats for host, replica in zip(self._replica_hosts, self._replicas)}
+
+    @property
+    def slow_queries(self) -> SlowQueryLog:
+        return self._slow_queries
+
+    async def close(self) -> None:
+        """
+        Closes all connections of the pools.
+        """
+        for pool in [self._pool, *self._replicas]:
+            await pool.close()
+
+    async def _read_pool(self, primary: bool) -> AsyncBoundedPool:
+        """
+        Returns pool of the next healthy replica, or the primary pool when asked for it or no replica is healthy.
+        """
+        if primary or not self._replicas:
+            return self._pool
+        await self._check_replica_lag()
+        healthy = [replica for replica, ok in zip(self._replicas, self._replica_healthy) if ok]
+        if not healthy:
+            return self._pool
+        self._next_replica += 1
+        return healthy[self._next_replica % len(healthy)]
+
+    async def _check_replica_lag(self) -> None:
+        """
+        Marks replicas healthy or not by their replication lag, at most once per MYSQL_REPLICA_LAG_CHECK seconds.
+        Server which is no replica at all has no lag.
+        """
+        now = time.monotonic()
+        if now - self._replica_checked_at < self._replica_lag_check:
+            return
+        self._replica_checked_at = now
+        for i, (host, replica) in enumerate(zip(self._replica_hosts, self._replicas)):
+            try:
+                async with replica.connection() as cnx, cnx.cursor(aiomysql.DictCursor) as cur:
+                    await cur.execute("SHOW REPLICA STATUS")
+                    status = await cur.fetchone()
+                lag = status["Seconds_Behind_Source"] if status else 0
+            except pymysql.err.Error as err:
+                log.warning("Can not check lag of replica %s: %r", host, err)
+                lag = None
+            healthy = lag is not None and lag <= self._replica_max_lag
+            if healthy != self._replica_healthy[i]:
+                log.warning("Replica %s %s, lag %s s", host, "back in use" if healthy else "left out", lag)
+            self._replica_healthy[i] = healthy
+
+    async def _read(self, query: str, args: Iterable, primary: bool, fetch,
+                    cursor_class: type = aiomysql.DictCursor) -> list[dict] | list[tuple] | dict | None:
+        """
+        Runs select on a replica or on the primary and returns result of fetch(cursor) of given cursor class.
+        Select failed for unreachable replica is repeated on the primary and the replica is left out
+        until the next lag check.
+        """
+        pool = await self._read_pool(primary)
+        try:
+            async with pool.connection() as cnx, cnx.cursor(cursor_class) as cur:
+                await cur.execute(query, args)
+                return await fetch(cur)
+        except pymysql.err.OperationalError as err:
+            if pool is self._pool:
+                raise
+            i = self._replicas.index(pool)
+            log.warning("Replica %s failed, reading from primary: %r", self._replica_hosts[i], err)
+            self._replica_healthy[i] = False
+        return await self._read(query, args, True, fetch, cursor_class)
+
+    async def _select_all(self, query: str, args: Iterable = (), primary: bool = False) -> list[dict]:
+        """
+        Runs select in separated connection and fetches all result.
+        Runs on a replica unless primary is set, set it when the select has to see preceding writes.
+
+        Args:
+            query      (str): query string
+            args  (Iterable): query arguments
+            primary   (bool): run on the primary
+
+        Returns:
+            list of dict: each dict represents one selected record
+
+        Raises:
+            pymysql.err.Error
+            catalog.pool.PoolExhausted
+        """
+        name, start = caller_name(), perf_counter()
+        res = await self._read(query, args, primary, lambda cur: cur.fetchall())
+        elapsed = observe_query("api", name, start, len(res))
+        if self._slow_queries.is_slow(elapsed):
+            await self._log_slow_query(name, query, args, len(res), elapsed)
+        return res
+
+    async def _select_rows(self, query: str, args: Iterable = (), primary: bool = False) -> list[tuple]:
+        """
+        Same as _select_all but returns each record as a tuple of the selected columns,
+        so no dict is built per row when the result is serialized right away.
+
+        Returns:
+            list of tuple: each tuple represents one selected record
+
+        Raises:
+            pymysql.err.Error
+            catalog.pool.PoolExhausted
+        """
+        name, start = caller_name(), perf_counter()
+        res = await self._read(query, args, primary, lambda cur: cur.fetchall(), aiomysql.Cursor)
+        elapsed = observe_query("api", name, start, len(res))
+        if self._slow_queries.is_slow(elapsed):
+            await self._log_slow_query(name, query, args, len(res), elapsed)
+        return res
+
+    async def _select_one(self, query: str, args: Iterable = (), primary: bool = False) -> dict | None:
+        """
+        Runs select in separated connection and fetches one result.
+        Runs on a replica unless primary is set, set it when the select has to see preceding writes.
+
+        Args:
+            query      (str): query string
+            args  (Iterable): query arguments
+            primary   (bool): run on the primary
+
+        Returns:
+            dict/None
+
+        Raises:
+            pymysql.err.Error
+            catalog.pool.PoolExhausted
+        """
+        name, start = caller_name(), perf_counter()
+        res = await self._read(query, args, primary, lambda cur: cur.fetchone())
+        elapsed = observe_query("api", name, start, res is not None)
+        if self._slow_queries.is_slow(elapsed):
+            await self._log_slow_query(name, query, args, res is not None, elapsed)
+        return res
+
+    async def _stream(self, query: str, args: Iterable = (), chunk_size: int = 1000, primary: bool = False):
+        """
+        Runs select in separated connection and yields the result in chunks read from server side cursor,
+        so the whole result is never held in memory. The connection is held until the generator is exhausted or closed.
+        Runs on a replica unless primary is set.
+
+        Args:
+            query      (str): query string
+            args  (Iterable): query arguments
+            chunk_size (int): max number of records in one chunk
+            primary   (bool): run on the primary
+
+        Yields:
+            list of dict: each dict represents one selected record
+
+        Raises:
+            pymysql.err.Error
+            catalog.pool.PoolExhausted
+        """
+        name, start, count = caller_name(), perf_counter(), 0
+        pool = await self._read_pool(primary)
+        async with pool.connection() as cnx, cnx.cursor(aiomysql.SSDictCursor) as cur:
+            await cur.execute(query, args)
+            while rows := await cur.fetchmany(chunk_size):
+                count += len(rows)
+                yield rows
+        observe_query("api", name, start, count)
+
+    async def _execute(self, query: str, args: Iterable = ()) -> int:
+        """
+        Runs query in separated connection and returns a number of affected rows
+
+        Args:
+            query      (str): query string
+            args  (Iterable): query arguments
+
+        Raises:
+            pymysql.err.Error
+            catalog.pool.PoolExhausted
+
+        Returns:
+            int: number of affected rows
+        """
+        name, start = caller_name(), perf_counter()
+        async with self._pool.connection() as cnx, cnx.cursor() as cur:
+            await cur.execute(query, args)
+            rowcount = cur.rowcount
+        elapsed = observe_query("api", name, start, rowcount)
+        if self._slow_queries.is_slow(elapsed):
+            await self._log_slow_query(name, query, args, rowcount, elapsed)
+        return rowcount
+
+    async def _insert(self, query: str, args: Iterable = ()) -> int:
+        """
+        Runs insert in separated connection and returns id of the inserted row, LAST_INSERT_ID of the statement
+
+        Args:
+            query      (str): query string
+            args  (Iterable): query arguments
+
+        Raises:
+            pymysql.err.Error
+            catalog.pool.PoolExhausted
+
+        Returns:
+            int: id of the inserted row, 0 when the statement has inserted no row
+        """
+        name, start = caller_name(), perf_counter()
+        async with self._pool.connection() as cnx, cnx.cursor() as cur:
+            await cur.execute(query, args)
+            lastrowid = cur.lastrowid
+        elapsed = observe_query("api", name, start, cur.rowcount)
+        if self._slow_queries.is_slow(elapsed):
+            await self._log_slow_query(name, query, args, cur.rowcount, elapsed)
+        return lastrowid
+
+    async def _insert_many(self, query: str, seq_of_params: Iterable) -> int:
+        """
+        Runs insert query in separated connection. Accepts iterable of multiple query params
+
+        Args:
+            query              (str): query string
+            seq_of_params (Iterable): sequence of query arguments
+
+        Raises:
+            pymysql.err.Error
+            catalog.pool.PoolExhausted
+
+        Returns:
+            int: number of affected rows
+        """
+        name, start = caller_name(), perf_counter()
+        seq_of_params = list(seq_of_params)
+        async with self._pool.connection() as cnx, cnx.cursor() as cur:
+            await cur.executemany(query, seq_of_params)
+            rowcount = cur.rowcount
+        elapsed = observe_query("api", name, start, rowcount)
+        if self._slow_queries.is_slow(elapsed):
+            # executemany sends one multi-row insert, its plan tells nothing
+            self._slow_queries.record(name, query, len(seq_of_params), rowcount, elapsed)
+        return rowcount
+
+    @asynccontextmanager
+    async def _transaction(self):
+        """
+        Runs a block of queries in one transaction in separated connection of the primary.
+        The transaction is committed at the end of the block and rolled back on any error.
+        The whole transaction is timed as one query named after the calling method.
+
+        Yields:
+            cursor of the transaction connection
+
+        Raises:
+            pymysql.err.Error
+            catalog.pool.PoolExhausted
+        """
+        # frames: _transaction, contextlib __aenter__, calling method
+        name, start = caller_name(3), perf_counter()
+        async with self._pool.connection() as cnx, cnx.cursor() as cur:
+            await cnx.begin()
+            try:
+                yield cur
+            except BaseException:
+                await cnx.rollback()
+                raise
+            await cnx.commit()
+        observe_query("api", name, start, 0)
+
+    async def _log_slow_query(self, name: str, query: str, args: Iterable, rows: int, elapsed: float) -> None:
+        """
+        Keeps the slow query run by DB method name together with its plan when it should be explained,
+        see SlowQueryLog. The plan is read from the primary and failure to read it is kept instead.
+        """
+        plan = None
+        if self._slow_queries.should_explain(name, query):
+            try:
+                plan = await self._read(f"EXPLAIN {query}", args, True, lambda cur: cur.fetchall())
+            except Exception as err:
+                plan = repr(err)
+        self._slow_queries.record(name, query, len(args), rows, elapsed, plan)
+
+
+class AsyncProductCatalogDB(AsyncDB):
+    def __init__(self, service_id: int, offers_snapshot: OffersSnapshot = None):
+        """
+        Asyncio counterpart of ProductCatalogDB used by the endpoints.
+        The service id has to be taken from ProductCatalogDB which does the access token check.
+        Offers snapshot should be shared with the updater of this process, so it is written through.
+        Removals of offers of deleted products are logged into change_log unless CHANGE_LOG_RETENTION is 0.
+        """
+        super().__init__()
+        self._service_id = service_id
+        self._offers_snapshot = offers_snapshot if offers_snapshot is not None else OffersSnapshot()
+        # product id -> monotonic time the change feed invalidated its offers, oldest first
+        self._offers_invalidated = {}
+        self._change_log = int(environ.get("CHANGE_LOG_RETENTION", 3600)) > 0
+
+        self._product_cache = LRUCache(maxsize=int(environ.get("PRODUCT_CACHE_SIZE", 10000)),
+                                       ttl=float(environ.get("PRODUCT_CACHE_TTL", 300)))
+        self._product_cache_version_check = float(environ.get("PRODUCT_CACHE_VERSION_CHECK", 1))
+        self._product_cache_version = None
+        self._product_cache_checked_at = 0.0
+        self._product_primary_until = 0.0
+
+    @property
+    def product_cache(self) -> LRUCache:
+        return self._product_cache
+
+    @property
+    def offers_snapshot(self) -> OffersSnapshot:
+        return self._offers_snapshot
+
+    async def insert_product(self, product: ProductNoId) -> int:
+        """
+        Inserts given product into product table in one round trip. Product which already exists with the same
+        description is not inserted again, the statement reports its id through LAST_INSERT_ID instead.
+        Product of a name already used with different description is left as it is with LAST_INSERT_ID set to 0.
+        Name and description are compared by the column collation, so the existing product may differ from the given
+        one in case or accents. The statement can not tell it from an inserted product, both count as one found row,
+        so the product is not cached from the request, the next select reads the stored one.
+
+        raises:
+            HTTPException: Product of this name already exists
+        """
+        params = dict(product)
+        params |= dict(service_id=self._service_id)
+        insert = """INSERT INTO product (service_id, name, description) 
+                    VALUES (%(service_id)s, %(name)s, %(description)s)
+                    ON DUPLICATE KEY UPDATE id=IF(description=VALUES(description), LAST_INSERT_ID(id),
+                                                  id + LAST_INSERT_ID(0))"""
+        id = await self._insert(insert, params)
+        if id:
+            log.info("Product %s successfully inserted under id %d", params, id)
+            self._product_cache.invalidate(id)
+            return id
+        else:
+            log.error("Product with name %s already exists with different description", product.name)
+            raise HTTPException(status_code=409, detail="Product of this name already exists")
+
+    async def select_product(self, id: int) -> dict:
+        """
+        Selects product of given id from product cache or from DB on cache miss.
+
+        raises:
+            HTTPException: Product not found
+        """
+        await self._check_product_cache_version()
+        product = self._product_cache.get(id)
+        if product:
+            return dict(product)
+
+        select = "SELECT id, name, description FROM product WHERE id=%(id)s"
+        product = await self._select_one(select, dict(id=id), primary=time.monotonic() < self._product_primary_until)
+        if product:
+            log.info("Selected product %s", product)
+            self._product_cache.set(id, dict(product))
+            return product
+        else:
+            log.warning("Product %d not found", id)
+            raise HTTPException(status_code=404, detail="Product not found")
+
+    async def update_product(self, id: int, product: ProductNoId) -> dict:
+        """
+        Update product of given id.
+
+        raises:
+            HTTPException: Product not found
+        """
+        update = "UPDATE product SET name=%(name)s, description=%(description)s WHERE id=%(id)s"
+        params = dict(id=id, name=product.name, description=product.description)
+        rowcount = await self._execute(update, params)
+        if rowcount == 1:
+            log.info("Product %d successfully updated", id)
+        else:
+            log.warning("Product %d not found", id)
+            self._product_cache.invalidate(id)
+            raise HTTPException(status_code=404, detail="Product not found")
+        self._product_cache.set(id, dict(params))
+        return params
+
+    async def insert_products(self, products: list[ProductNoId]) -> list[dict]:
+        """
+        Inserts given products into product table by multi-row inserts and selects them back by name.
+        Returns result of each given product in the same order. Product which has been inserted or which already
+        exists with the same description gets status 201. Product of a name already used with different
+        description gets status 409. Names and descriptions are compared by the DB with the column collation,
+        the same way insert_product does, and the stored products are returned.
+        """
+        rows = [(self._service_id, product.name, product.description) for product in products]
+        for chunk in chunks(rows, ROWS_PER_STATEMENT):
+            insert = f"""INSERT INTO product (service_id, name, description) 
+                         VALUES {row_places(chunk, 3)} ON DUPLICATE KEY UPDATE id=id"""
+            await self._execute(insert, [arg for row in chunk for arg in row])
+
+        # one lookup of the unique name per given product, read after write goes to the primary
+        selected = {}
+        for chunk in chunks(list(enumerate(products)), ROWS_PER_STATEMENT):
+            select = " UNION ALL ".join(["""SELECT %s AS i, id, name, description, description=%s AS same
+                                            FROM product WHERE name=%s"""] * len(chunk))
+            args = [arg for i, product in chunk for arg in (i, product.description, product.name)]
+            for row in await self._select_all(select, args, primary=True):
+                selected[row.pop("i")] = row
+
+        results = []
+        for i, product in enumerate(products):
+            row = selected.get(i)
+            if row and row.pop("same"):
+                self._product_cache.set(row["id"], dict(row))
+                results.append(dict(status=201, product=row))
+            else:
+                log.error("Product with name %s already exists with different description", product.name)
+                results.append(dict(status=409, detail="Product of this name already exists"))
+        log.info("%d of %d products successfully inserted", sum(r["status"] == 201 for r in results), len(results))
+        return results
+
+    async def select_products(self, ids: list[int]) -> list[dict]:
+        """
+        Selects products of given ids from product cache or by multi-row select from DB on cache miss.
+        Returns result of each given id in the same order, status 200 with the product or status 404.
+        """
+        await self._check_product_cache_version()
+        products = {}
+        for id in ids:
+            if product := self._product_cache.get(id):
+                products[id] = dict(product)
+
+        missing = list({id for id in ids if id not in products})
+        for chunk in chunks(missing, ROWS_PER_STATEMENT):
+            select = f"SELECT id, name, description FROM product WHERE id IN ({places(chunk)})"
+            primary = time.monotonic() < self._product_primary_until
+            for product in await self._select_all(select, chunk, primary):
+                self._product_cache.set(product["id"], dict(product))
+                products[product["id"]] = product
+
+        return [dict(status=200, product=products[id]) if id in products
+                else dict(status=404, detail="Product not found") for id in ids]
+
+    async def delete_product(self, id: int) -> None:
+        """
+        Deletes product of given id from DB, its offers are deleted by the foreign key. Removal of each offer
+        is logged into change_log in the same transaction, so subscribers of the product learn about it
+        and the other processes drop the product from their offers snapshot, see invalidate_product_offers.
+        The offers are locked before the product, in the same order as the updater locks them.
+
+        raises:
+            HTTPException: Product not found
+        """
+        async with self._transaction() as cur:
+            await cur.execute("SELECT id FROM offer WHERE product_id=%s ORDER BY id FOR UPDATE", [id])
+            offer_ids = [offer_id for offer_id, in await cur.fetchall()]
+            rowcount = await cur.execute("DELETE FROM product WHERE id=%s", [id])
+            if offer_ids and self._change_log:
+                await self._log_removed_offers(cur, id, offer_ids)
+        self._product_cache.invalidate(id)
+        self._offers_snapshot.invalidate(id)
+        if rowcount == 1:
+            log.info("Product %d successfully deleted", id)
+        else:
+            log.warning("Product %d not found", id)
+            raise HTTPException(status_code=404, detail="Product not found")
+
+    @staticmethod
+    async def _log_removed_offers(cur, product_id: int, offer_ids: list[int]) -> None:
+        """
+        Appends removals of the offers to change_log within the transaction deleting them,
+        with sequence numbers taken from change_sequence, see ProductCatalogDB._log_changes.
+        """
+        await cur.execute("UPDATE change_sequence SET seq=LAST_INSERT_ID(seq + %s) WHERE id=1", [len(offer_ids)])
+        first = cur.lastrowid - len(offer_ids) + 1
+        rows = [(first + i, product_id, offer_id, "removed") for i, offer_id in enumerate(offer_ids)]
+        for chunk in chunks(rows, ROWS_PER_STATEMENT):
+            insert = f"INSERT INTO change_log (id, product_id, offer_id, kind) VALUES {row_places(chunk, 4)}"
+            await cur.execute(insert, [arg for row in chunk for arg in row])
+
+    async def _check_product_cache_version(self) -> None:
+        """
+        Clears the product cache when another process changed any product.
+        Products are changed by all application processes so product_after_update and product_after_delete
+        triggers bump shared version counter in cache_version table on every product change,
+        in the same statement as the change. The counter is checked at most once
+        per PRODUCT_CACHE_VERSION_CHECK seconds, zero disables the check.
+        The version is read from the primary, a replica could be behind the change.
+        The change may not have reached the replicas yet either, so for MYSQL_REPLICA_MAX_LAG seconds
+        after the clear products are reloaded from the primary too, otherwise a stale product from a lagging
+        replica would be cached again until PRODUCT_CACHE_TTL.
+        """
+        if not self._product_cache_version_check:
+            return
+        now = time.monotonic()
+        if now - self._product_cache_checked_at < self._product_cache_version_check:
+            return
+        self._product_cache_checked_at = now
+        select = "SELECT version FROM cache_version WHERE name='product'"
+        version = (await self._select_one(select, primary=True))["version"]
+        if version != self._product_cache_version:
+            if self._product_cache_version is not None:
+                log.debug("Product cache version changed to %d, clearing cache", version)
+            self._product_cache.clear()
+            self._product_cache_version = version
+            self._product_primary_until = now + self._replica_max_lag
+
+    async def select_product_offers(self, product_id: int, on_stock: bool = True,
+                                    after: list = None, limit: int = None) -> list[dict]:
+        """
+        Returns priced offers of specified product from the offers snapshot. On a snapshot miss all offers
+        of the product are selected with the latest known price from offer_current_price and stored into the snapshot,
+        unless the updater has stored newer ones meanwhile, the change feed has invalidated them meanwhile
+        or the product has no priced offer. Offers invalidated by the change feed less than MYSQL_REPLICA_MAX_LAG
+        seconds ago are selected from the primary, the change may not have reached all replicas yet.
+        Offers are ordered by id. With limit set at most limit offers following the offer id in after key are returned.
+        """
+        offers = self._offers_snapshot.get(product_id)
+        if offers is None:
+            loaded_at = time.monotonic()
+            invalidated_at = self._offers_invalidated.get(product_id)
+            primary = invalidated_at is not None and loaded_at - invalidated_at < self._replica_max_lag
+            select, params = self._product_offers_query(product_id, False, None, None)
+            offers = ProductOffers(product_id, await self._select_all(select, params, primary))
+            # products with no offers yet get them from the updater, unknown ids must not fill the snapshot
+            if offers and self._offers_invalidated.get(product_id, loaded_at) <= loaded_at:
+                offers = self._offers_snapshot.add(product_id, offers)
+        return offers.select(on_stock, after, limit)
+
+    def invalidate_product_offers(self, product_ids: Iterable[int]) -> None:
+        """
+        Drops offers of the products changed by any process from the offers snapshot, so they are read again
+        from DB, see catalog.changes.ChangeFeed. Offers written through by the updater of this process are
+        dropped as well, their change is logged the same way. Invalidation times are kept
+        for MYSQL_REPLICA_MAX_LAG seconds, see select_product_offers.
+        """
+        now = time.monotonic()
+        while self._offers_invalidated:
+            product_id, invalidated_at = next(iter(self._offers_invalidated.items()))
+            if now - invalidated_at < self._replica_max_lag:
+                break
+            del self._offers_invalidated[product_id]
+        for product_id in product_ids:
+            self._offers_snapshot.invalidate(product_id)
+            # moved to the end, so the oldest invalidation stays first
+            self._offers_invalidated.pop(product_id, None)
+            self._offers_invalidated[product_id] = now
+
+    async def stream_product_offers(self, product_id: int, on_stock: bool = True, after: list = None):
+        """
+        Same as select_product_offers but yields the offers in chunks read from server side cursor.
+        """
+        select, params = self._product_offers_query(product_id, on_stock, after, None)
+        async for rows in self._stream(select, params):
+            yield rows
+
+    @staticmethod
+    def _product_offers_query(product_id: int, on_stock: bool, after: list | None, limit: int | None) -> tuple:
+        min_stock = 1 if on_stock else 0
+        select = """SELECT 
+                        o.id AS offer_id,
+                        o.product_id AS product_id,
+                        o.foreign_id AS foreign_id,
+                        cp.price AS price,
+                        o.items_in_stock AS items_in_stock 
+                    FROM offer AS o LEFT JOIN offer_current_price AS cp ON o.id=cp.offer_id
+                    WHERE o.product_id=%(product_id)s AND o.items_in_stock >= %(min_stock)s"""
+        params = dict(product_id=product_id, min_stock=min_stock)
+        if after:
+            select += " AND o.id > %(after_id)s"
+            params |= dict(after_id=after[0])
+        select += " ORDER BY o.id"
+        if limit:
+            select += " LIMIT %(limit)s"
+            params |= dict(limit=limit)
+        return select, params
+
+    async def select_offer_prices(self, offer_id: int, start: datetime.datetime, end: datetime.datetime,
+                                  after: list = None, limit: int = None) -> list[tuple]:
+        """
+        Select prices for specified offer with times when they were applied as (id, price, valid_from) tuples.
+        Prices are ordered by (created_at, id), the price id is returned too for pagination.
+        With limit set at most limit prices following the (created_at, id) after key are returned.
+        """
+        select, params = self._offer_prices_query(offer_id, start, end, after, limit)
+        return await self._select_rows(select, params)
+
+    async def stream_offer_prices(self, offer_id: int, start: datetime.datetime, end: datetime.datetime,
+                                  after: list = None):
+        """
+        Same as select_offer_prices but yields the prices in chunks read from server side cursor.
+        """
+        select, params = self._offer_prices_query(offer_id, start, end, after, None)
+        async for rows in self._stream(select, params):
+            yield rows
+
+    @staticmethod
+    def _offer_prices_query(offer_id: int, start: datetime.datetime, end: datetime.datetime,
+                            after: list | None, limit: int | None) -> tuple:
+        """
+        Prices older than the raw price retention window are read from hourly and daily rollups,
+        one price per hour or day, the opening one. Rollup prices have id 0. See catalog.retention.
+        Each part of the union is filtered, ordered and limited on its own, so only the matching index range
+        of each table is read.
+        """
+        start = datetime.date(year=2000, month=1, day=1).isoformat() if start is None else start
+        end = datetime.datetime.now().isoformat() if end is None else end
+        params = dict(offer_id=offer_id, start=start, end=end)
+        keyset = ""
+        if after:
+            keyset = """ AND ({time} > %(after_created_at)s
+                              OR ({time} = %(after_created_at)s AND {id} > %(after_id)s))"""
+            params |= dict(after_created_at=after[0], after_id=after[1])
+        limit_clause = ""
+        if limit:
+            limit_clause = " LIMIT %(limit)s"
+            params |= dict(limit=limit)
+        select = f"""SELECT id, price, created_at AS valid_from FROM (
+                         (SELECT 0 AS id, open AS price, day AS created_at FROM price_daily
+                          WHERE offer_id=%(offer_id)s AND day > %(start)s AND day < %(end)s
+                              AND day < {HOURLY_SINCE}{keyset.format(time="day", id="0")}
+                          ORDER BY day{limit_clause})
+                         UNION ALL
+                         (SELECT 0, open, hour FROM price_hourly
+                          WHERE offer_id=%(offer_id)s AND hour > %(start)s AND hour < %(end)s
+                              AND hour >= {HOURLY_SINCE} AND hour < {RAW_SINCE}{keyset.format(time="hour", id="0")}
+                          ORDER BY hour{limit_clause})
+                         UNION ALL
+                         (SELECT id, price, created_at FROM price
+                          WHERE offer_id=%(offer_id)s AND created_at > %(start)s AND created_at < %(end)s
+                              AND created_at >= {RAW_SINCE}{keyset.format(time="created_at", id="id")}
+                              AND EXISTS (SELECT 1 FROM offer WHERE id=%(offer_id)s)
+                          ORDER BY created_at, id{limit_clause})
+                     ) AS p
+                     ORDER BY created_at, id{limit_clause}"""
+        return select, params
+
+    async def select_offer_price_buckets(self, offer_id: int, start: datetime.datetime, end: datetime.datetime,
+                                         bucket: Bucket) -> list[dict]:
+        """
+        Aggregates prices of specified offer into time buckets of given length.
+        Each bucket contains time of its start, open/high/low/close/avg price and number of prices.
+        Buckets are aligned to UTC, weeks start on Monday. Buckets with no price are omitted.
+        Open and close prices are the first items of price lists ordered by time, so the truncation
+        of long lists by group_concat_max_len does not matter.
+        Prices older than the raw price retention window are aggregated from hourly and daily rollups,
+        buckets shorter than the rollups then hold one rollup each.
+        """
+        start = datetime.date(year=2000, month=1, day=1).isoformat() if start is None else start
+        end = datetime.datetime.now().isoformat() if end is None else end
+        seconds, offset = bucket_seconds[bucket]
+        select = f"""SELECT
+                         FROM_UNIXTIME((UNIX_TIMESTAMP(t) - %(offset)s) DIV %(seconds)s * %(seconds)s
+                                       + %(offset)s) AS valid_from,
+                         CAST(SUBSTRING_INDEX(GROUP_CONCAT(open ORDER BY t, id), ',', 1) AS SIGNED) AS open,
+                         max(high) AS high,
+                         min(low) AS low,
+                         CAST(SUBSTRING_INDEX(GROUP_CONCAT(close ORDER BY t DESC, id DESC), ',', 1)
+                              AS SIGNED) AS close,
+                         CAST(sum(total) AS DOUBLE) / sum(count) AS avg,
+                         CAST(sum(count) AS SIGNED) AS count
+                     FROM (
+                         SELECT day AS t, 0 AS id, open, high, low, close, avg * count AS total, count
+                         FROM price_daily
+                         WHERE offer_id=%(offer_id)s AND day > %(start)s AND day < %(end)s AND day < {HOURLY_SINCE}
+                         UNION ALL
+                         SELECT hour, 0, open, high, low, close, avg * count, count
+                         FROM price_hourly
+                         WHERE offer_id=%(offer_id)s AND hour > %(start)s AND hour < %(end)s
+                             AND hour >= {HOURLY_SINCE} AND hour < {RAW_SINCE}
+                         UNION ALL
+                         SELECT created_at, id, price, price, price, price, price, 1
+                         FROM price
+                         WHERE offer_id=%(offer_id)s AND created_at > %(start)s AND created_at < %(end)s
+                             AND created_at >= {RAW_SINCE} AND EXISTS (SELECT 1 FROM offer WHERE id=%(offer_id)s)
+                     ) AS p
+                     GROUP BY valid_from
+                     ORDER BY valid_from"""
+        params = dict(offer_id=offer_id, start=start, end=end, seconds=seconds, offset=offset)
+        return await self._select_all(select, params)
+
+    async def select_changes(self, after: int, limit: int, product_ids: list[int] = None,
+                             primary: bool = False) -> list[dict]:
+        """
+        Returns up to limit offer changes following the after sequence number, ordered by it.
+        With product ids given only changes of these products are returned.
+        Set primary to see all changes the change feed has already seen.
+        """
+        select = """SELECT id, product_id, offer_id, kind, price, items_in_stock, created_at
+                    FROM change_log WHERE id > %s"""
+        args = [after]
+        if product_ids:
+            select += f" AND product_id IN ({places(product_ids)})"
+            args += product_ids
+        select += " ORDER BY id LIMIT %s"
+        return await self._select_all(select, [*args, limit], primary=primary)
+
+    async def select_change_bounds(self) -> dict:
+        """
+        Returns the oldest kept (first_id) and the last logged (last_id) change sequence numbers.
+        """
+        select = """SELECT (SELECT IFNULL(MIN(id), 0) FROM change_log) AS first_id,
+                           (SELECT seq FROM change_sequence WHERE id=1) AS last_id"""
+        return await self._select_one(select, primary=True)
+
+    async def delete_changes(self, retention: int, limit: int) -> int:
+        """
+        Deletes up to limit offer changes older than retention seconds and returns their number.
+        """
+        delete = "DELETE FROM change_log WHERE created_at < NOW() - INTERVAL %s SECOND ORDER BY id LIMIT %s"
+        return await self._execute(delete, [retention, limit])
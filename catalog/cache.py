@@ -0,0 +1,83 @@
+import threading
+from time import monotonic
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+
+    def __init__(self, maxsize: int, ttl: float):
+        """
+        Thread safe in-process cache which keeps up to maxsize least recently used entries
+        and each entry for at most ttl seconds. Zero maxsize disables the cache.
+        """
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any | None:
+        """
+        Returns cached value or None if the key is not cached or its entry has expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Stores value under the given key. The least recently used entry is evicted if the cache is full.
+        """
+        if self._maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, monotonic() + self._ttl)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def add(self, key: Hashable, value: Any) -> Any:
+        """
+        Stores value unless the key is already cached, so a value loaded from DB does not overwrite
+        a newer one stored meanwhile. Returns the cached value.
+        """
+        if self._maxsize <= 0:
+            return value
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] >= monotonic():
+                return entry[0]
+            self._entries[key] = (value, monotonic() + self._ttl)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+            return value
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        Removes entry of the given key if present.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Removes all entries.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns number of hits, misses and currently cached entries.
+        """
+        return dict(hits=self.hits, misses=self.misses, size=len(self._entries))
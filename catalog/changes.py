@@ -0,0 +1,185 @@
+import asyncio
+import logging
+from os import environ
+from time import monotonic
+from typing import AsyncIterator
+
+from catalog.aiodb import AsyncProductCatalogDB
+from catalog.common import to_sse
+
+
+log = logging.getLogger()
+
+
+class Subscription:
+
+    __slots__ = ("product_ids", "queue", "overflowed")
+
+    def __init__(self, product_ids: set[int] | None, size: int):
+        """
+        Changes of given products, all when None, waiting for one subscriber in a queue of at most size changes.
+        A subscriber falling behind by more than that is marked overflowed and gets no more changes.
+        """
+        self.product_ids = product_ids
+        self.queue = asyncio.Queue(maxsize=size)
+        self.overflowed = False
+
+    async def get(self, timeout: float) -> dict | None:
+        """
+        Returns the next change, None when the subscription has overflowed and its buffered changes are consumed.
+
+        raises:
+            asyncio.TimeoutError: no change within timeout seconds
+        """
+        if self.overflowed and self.queue.empty():
+            return None
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class ChangeBroadcaster:
+
+    def __init__(self, buffer: int):
+        """
+        Fans out offer changes to the subscriptions of this process, each with its own queue of buffer changes,
+        so a slow subscriber never blocks the others. Subscriptions are indexed by product, so a change
+        is offered only to the subscriptions interested in it.
+        """
+        self._buffer = buffer
+        self._all = set()
+        self._by_product = {}
+        self._stats = dict(published=0, overflowed=0)
+
+    def subscribe(self, product_ids: list[int] = None) -> Subscription:
+        subscription = Subscription(set(product_ids) if product_ids else None, self._buffer)
+        if subscription.product_ids is None:
+            self._all.add(subscription)
+        for product_id in subscription.product_ids or ():
+            self._by_product.setdefault(product_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._all.discard(subscription)
+        for product_id in subscription.product_ids or ():
+            subscriptions = self._by_product.get(product_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._by_product.pop(product_id, None)
+
+    def publish(self, changes: list[dict]) -> None:
+        """
+        Puts the changes into the queues of interested subscriptions, subscriptions with full queue overflow.
+        """
+        for change in changes:
+            for subscription in self._all | self._by_product.get(change["product_id"], set()):
+                if subscription.overflowed:
+                    continue
+                try:
+                    subscription.queue.put_nowait(change)
+                except asyncio.QueueFull:
+                    subscription.overflowed = True
+                    self._stats["overflowed"] += 1
+        self._stats["published"] += len(changes)
+
+    def stats(self) -> dict:
+        """
+        Returns number of subscriptions, of changes published and of subscriptions overflowed since start.
+        """
+        return dict(self._stats, subscriptions=len(self._all | set().union(*self._by_product.values())))
+
+
+class ChangeFeed:
+
+    def __init__(self, adb: AsyncProductCatalogDB):
+        """
+        Tails change_log, filled by the updaters of all processes, every CHANGE_FEED_POLL seconds
+        and publishes new changes to the subscribers of this process, each buffered up to CHANGE_FEED_BUFFER changes.
+        Offers of the changed products are dropped from the offers snapshot of this process before.
+        Changes older than CHANGE_LOG_RETENTION seconds are deleted, subscribers can resume only within that time.
+        """
+        self._adb = adb
+        self._poll = float(environ.get("CHANGE_FEED_POLL", 1))
+        self._retention = int(environ.get("CHANGE_LOG_RETENTION", 3600))
+        self._keepalive = float(environ.get("CHANGE_FEED_KEEPALIVE", 15))
+        self._batch_size = 1000
+        self._trim_every = 60
+        self._trimmed_at = 0.0
+        self._last_id = None
+        self.broadcaster = ChangeBroadcaster(int(environ.get("CHANGE_FEED_BUFFER", 1000)))
+
+    async def run(self) -> None:
+        """
+        Polls for new changes forever, errors are logged.
+        """
+        while True:
+            try:
+                await self.poll()
+                await self._trim()
+            except Exception as err:
+                log.error("Change feed failed: %r", err)
+            await asyncio.sleep(self._poll)
+
+    async def poll(self) -> None:
+        """
+        Publishes changes logged since the last poll, the first poll starts at the end of the log.
+        """
+        if self._last_id is None:
+            self._last_id = (await self._adb.select_change_bounds())["last_id"]
+        while changes := await self._adb.select_changes(self._last_id, self._batch_size):
+            # subscribers reading the offers on a change have to get them from DB
+            self._adb.invalidate_product_offers({change["product_id"] for change in changes})
+            self.broadcaster.publish(changes)
+            self._last_id = changes[-1]["id"]
+            if len(changes) < self._batch_size:
+                break
+
+    async def _trim(self) -> None:
+        if not self._retention or monotonic() - self._trimmed_at < self._trim_every:
+            return
+        self._trimmed_at = monotonic()
+        deleted = await self._adb.delete_changes(self._retention, 10000)
+        log.debug("%d changes deleted", deleted)
+
+    async def stream(self, product_ids: list[int] = None, last_id: int = None) -> AsyncIterator[str]:
+        """
+        Yields server-sent events of offer changes of given products, all when None.
+        With last_id given the changes logged after it are sent first, read from DB, and then the live ones,
+        so a reconnecting subscriber gets each change exactly once. Event reset is sent when the changes
+        following last_id are no longer kept, the subscriber has to read the offers again.
+        Event overflow ends the stream of a subscriber which has fallen behind, it should reconnect with the id
+        of the last event received. Comments are sent every CHANGE_FEED_KEEPALIVE seconds with no change.
+        """
+        subscription = self.broadcaster.subscribe(product_ids)
+        try:
+            if last_id is not None:
+                first_id = (await self._adb.select_change_bounds())["first_id"]
+                if first_id and last_id < first_id - 1:
+                    yield to_sse("reset", dict(first_id=first_id))
+                    last_id = first_id - 1
+                # the primary has all changes the live ones may follow
+                while changes := await self._adb.select_changes(last_id, self._batch_size, product_ids, primary=True):
+                    for change in changes:
+                        yield self._event(change)
+                    last_id = changes[-1]["id"]
+                    if len(changes) < self._batch_size:
+                        break
+
+            while True:
+                try:
+                    change = await subscription.get(self._keepalive)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if change is None:
+                    yield to_sse("overflow", dict(last_id=last_id))
+                    return
+                if last_id is not None and change["id"] <= last_id:
+                    continue
+                yield self._event(change)
+                last_id = change["id"]
+        finally:
+            self.broadcaster.unsubscribe(subscription)
+
+    @staticmethod
+    def _event(change: dict) -> bytes:
+        data = {key: value for key, value in change.items() if key not in ("id", "kind")}
+        return to_sse(change["kind"], data, change["id"])
@@ -1,9 +1,53 @@
+import json
+import base64
+import hashlib
 import logging
+import datetime
+from typing import Any, NamedTuple
+
+import orjson
+from fastapi.responses import JSONResponse
 
 
 log = logging.getLogger()
 
 
+class OffersDiff(NamedTuple):
+    """
+    Difference between offers from API and offers stored in DB.
+
+    prices   - prices to be inserted for existing offers, dict(offer_id, price)
+    stock    - API offers already in DB with changed number of items in stock
+    new      - API offers missing in DB
+    obsolete - DB offers no longer offered by API
+    """
+    prices: list[dict]
+    stock: list[dict]
+    new: list[dict]
+    obsolete: list[dict]
+
+
+def diff_offers(api_offers: list[dict], db_offers: list[dict]) -> OffersDiff:
+    """
+    Indexes DB offers by foreign_id and then goes through API offers once.
+    Runs in O(n + m) time.
+    If the prices are the same there is no need to insert new price.
+    If they are different or if the price in DB is missing new price record is created.
+    """
+    db_offers_index = {db_offer["foreign_id"]: db_offer for db_offer in db_offers}
+    prices, stock, new = [], [], []
+    for api_offer in api_offers:
+        db_offer = db_offers_index.pop(api_offer["id"], None)
+        if db_offer is None:
+            new.append(api_offer)
+            continue
+        if api_offer["price"] != db_offer["price"]:
+            prices.append(dict(offer_id=db_offer["offer_id"], price=api_offer["price"]))
+        if api_offer.get("items_in_stock") != db_offer.get("items_in_stock"):
+            stock.append(api_offer)
+    return OffersDiff(prices, stock, new, list(db_offers_index.values()))
+
+
 def compute_prices_to_insert(api_offers: list[dict], db_offers: list[dict]) -> list[dict]:
     """
     Goes through all api and db offers and search for match.
@@ -11,29 +55,44 @@ def compute_prices_to_insert(api_offers: list[dict], db_offers: list[dict]) -> l
     If they are different even or if the price in db is missing
     create new price record to be inserted into DB.
     """
-    prices_to_insert = []
-    for api_offer in api_offers:
-        for db_offer in db_offers:
-            if api_offer["id"] == db_offer["foreign_id"]:
-                if api_offer["price"] == db_offer["price"]:
-                    break
-                else:
-                    prices_to_insert.append(dict(offer_id=db_offer["offer_id"], price=api_offer["price"]))
-                    break
-        else:
-            log.error("Obsolete product offer found")
+    diff = diff_offers(api_offers, db_offers)
+    if diff.new:
+        log.error("Obsolete product offer found")
+    return diff.prices
 
-    return prices_to_insert
 
+def offers_digest(api_offers: list[dict]) -> bytes:
+    """
+    Returns digest of offers from API independent of the order of offers and of their keys,
+    so an unchanged offers payload can be recognized without touching DB.
+    """
+    normalized = json.dumps(sorted(api_offers, key=lambda offer: offer["id"]), sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(normalized.encode(), digest_size=16).digest()
 
-def calculate_growth(prices: list[dict]) -> float:
+
+def next_refresh_interval(interval: int, changed: bool, min_interval: int, max_interval: int) -> int:
+    """
+    Halves refresh interval of product whose prices have changed and prolongs it by half otherwise,
+    so volatile products are refreshed often and stable ones rarely.
+    Never refreshed product (zero interval) starts at min_interval.
+    """
+    if not interval:
+        return min_interval
+    interval = interval / 2 if changed else interval * 1.5
+    return int(min(max(interval, min_interval), max_interval))
+
+
+def calculate_growth(prices: list[dict] | list[tuple], first_key: str | int = "price",
+                     last_key: str | int = "price") -> float:
     """
     Takes first and last price and calculates rise/fall in percents.
+    For aggregated prices the keys select open price of the first bucket and close price of the last one.
+    Prices selected as tuples are indexed by column positions instead of names.
     """
     if len(prices) < 1:
         return None
-    first = prices[0]["price"]
-    last = prices[-1]["price"]
+    first = prices[0][first_key]
+    last = prices[-1][last_key]
     return round((last - first) / (first / 100), 2)
 
 
@@ -48,3 +107,84 @@ def cleanup_offers(offers: list[dict]) -> list[dict]:
             offer.pop('foreign_id')
             priced_offers.append(offer)
     return priced_offers
+
+
+def cleanup_prices(prices: list[dict]) -> list[dict]:
+    """
+    Goes through the given prices and removes 'id' key used only for pagination.
+    """
+    for price in prices:
+        price.pop('id')
+    return prices
+
+
+def encode_cursor(key: list) -> str:
+    """
+    Encodes pagination key of the last returned record into opaque cursor string.
+    """
+    return base64.urlsafe_b64encode(json.dumps(key, default=_json_default).encode()).decode()
+
+
+def decode_cursor(cursor: str, types: tuple) -> list:
+    """
+    Decodes cursor string created by encode_cursor back into pagination key, which has to consist
+    of exactly one value of each given type, e.g. (str, int) for valid_from and id.
+
+    raises:
+        ValueError: Invalid cursor
+    """
+    key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    # bool is an int too, but never a key value
+    if not isinstance(key, list) or len(key) != len(types) or any(type(v) is not t for v, t in zip(key, types)):
+        raise ValueError("Invalid cursor")
+    return key
+
+
+def next_cursor(records: list[dict] | list[tuple], limit: int | None, key: tuple) -> str | None:
+    """
+    Returns cursor of the next page or None if there is no next page.
+    A page shorter than limit is the last one. Key lists names, or positions of tuple records, of the key columns.
+    """
+    if limit is None or len(records) < limit:
+        return None
+    return encode_cursor([records[-1][name] for name in key])
+
+
+def to_ndjson(records: list[dict]) -> bytes:
+    """
+    Serializes records into newline delimited JSON, one record per line, by orjson as to_json does.
+    """
+    return b"".join(orjson.dumps(record, default=_json_default, option=orjson.OPT_APPEND_NEWLINE)
+                    for record in records)
+
+
+def to_sse(event: str, data: dict, id: int = None) -> bytes:
+    """
+    Serializes one server-sent event with JSON data by orjson, see the text/event-stream format.
+    """
+    message = b"id: %d\n" % id if id is not None else b""
+    return message + b"event: %s\ndata: %s\n\n" % (event.encode(), orjson.dumps(data, default=_json_default))
+
+
+def to_json(data: Any) -> bytes:
+    """
+    Serializes data by compiled orjson, datetimes natively into the same ISO format FastAPI uses.
+    """
+    return orjson.dumps(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered by to_json. Returned by the high-volume endpoints with records read from DB
+    or from the offers snapshot, which are trusted, so FastAPI neither validates them against the response model
+    nor runs them through its jsonable_encoder.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
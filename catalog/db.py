@@ -1,15 +1,18 @@
 import logging
-import json
 import datetime
-from contextlib import closing
+from contextlib import closing, contextmanager
+from time import perf_counter
 from os import environ
 from typing import Iterable
 
 import mysql.connector.pooling
-from fastapi import HTTPException
+from mysql.connector import errorcode
 
-from catalog.models import Product, ProductNoId
 from catalog.offers import get_access_token
+from catalog.common import diff_offers
+from catalog.pool import BoundedPool, PoolStats
+from catalog.metrics import UPDATER_PHASE, caller_name, observe_query, timed
+from catalog.profiling import SlowQueryLog
 
 
 log = logging.getLogger()
@@ -22,16 +25,53 @@ def places(arg_list: list) -> str:
     return ('%s,'*len(arg_list))[:-1]
 
 
+def row_places(row_list: list, row_len: int) -> str:
+    """
+    Generates string with row placeholders for multi-row statements, e.g. (%s,%s),(%s,%s)
+    """
+    return ','.join([f"({places(range(row_len))})"] * len(row_list))
+
+
+def chunks(seq: list, size: int) -> Iterable[list]:
+    """
+    Splits given list into lists of at most size items, so multi-row statements stay reasonably long.
+    """
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
 class DB:
     def __init__(self):
-        self.__cnxpool = mysql.connector.pooling.MySQLConnectionPool(pool_size=4,
-                                                                     host=environ["MYSQL_HOST"],
-                                                                     db=environ["MYSQL_DB"],
-                                                                     user=environ["MYSQL_USER"],
-                                                                     password=environ["MYSQL_PASSWORD"],
-                                                                     autocommit=True,
-                                                                     pool_name="mypool",
-                                                                     )
+        """
+        Pool size is taken from MYSQL_POOL_SIZE env var, waiting for a free connection is bounded
+        by MYSQL_POOL_TIMEOUT and MYSQL_POOL_MAX_WAITING, see catalog.pool.BoundedPool.
+        Queries of the primitives running longer than SLOW_QUERY_THRESHOLD are kept, see SlowQueryLog.
+        """
+        pool_size = int(environ.get("MYSQL_POOL_SIZE", 4))
+        self._slow_queries = SlowQueryLog("updater")
+        cnxpool = mysql.connector.pooling.MySQLConnectionPool(pool_size=pool_size,
+                                                              host=environ["MYSQL_HOST"],
+                                                              db=environ["MYSQL_DB"],
+                                                              user=environ["MYSQL_USER"],
+                                                              password=environ["MYSQL_PASSWORD"],
+                                                              autocommit=True,
+                                                              pool_name="mypool",
+                                                              )
+        self.__cnxpool = BoundedPool(cnxpool,
+                                     size=pool_size,
+                                     timeout=float(environ.get("MYSQL_POOL_TIMEOUT", 5)),
+                                     max_waiting=int(environ.get("MYSQL_POOL_MAX_WAITING", 100)),
+                                     retry_after=int(environ.get("MYSQL_POOL_RETRY_AFTER", 1)),
+                                     name="updater",
+                                     )
+
+    @property
+    def pool_stats(self) -> PoolStats:
+        return self.__cnxpool.stats
+
+    @property
+    def slow_queries(self) -> SlowQueryLog:
+        return self._slow_queries
 
     def _select_all(self, query: str, args: Iterable = ()) -> list[dict]:
         """
@@ -47,10 +87,14 @@ class DB:
         Raises:
             mysql.connector.Error
         """
-        with closing(self.__get_connection()) as cnx, closing(cnx.cursor(dictionary=True)) as cur:
+        name, start = caller_name(), perf_counter()
+        with self.__get_connection() as cnx, closing(cnx.cursor(dictionary=True)) as cur:
             cur.execute(query, args)
             res = cur.fetchall()
-            return res
+        elapsed = observe_query("updater", name, start, len(res))
+        if self._slow_queries.is_slow(elapsed):
+            self._log_slow_query(name, query, args, len(res), elapsed)
+        return res
 
     def _select_one(self, query: str, args: Iterable = ()) -> dict | None:
         """
@@ -66,10 +110,16 @@ class DB:
         Raises:
             mysql.connector.Error
         """
-        with closing(self.__get_connection()) as cnx, closing(cnx.cursor(dictionary=True)) as cur:
+        name, start = caller_name(), perf_counter()
+        with self.__get_connection() as cnx, closing(cnx.cursor(dictionary=True)) as cur:
             cur.execute(query, args)
-            res = cur.fetchone()
-            return res
+            # the rest of the result has to be read anyway before the connection is used again
+            rows = cur.fetchall()
+        res = rows[0] if rows else None
+        elapsed = observe_query("updater", name, start, res is not None)
+        if self._slow_queries.is_slow(elapsed):
+            self._log_slow_query(name, query, args, len(rows), elapsed)
+        return res
 
     def _execute(self, query: str, args: Iterable = ()) -> int:
         """
@@ -85,11 +135,15 @@ class DB:
         Returns:
             int: number of affected rows
         """
-        with closing(self.__get_connection()) as cnx, closing(cnx.cursor()) as cur:
+        name, start = caller_name(), perf_counter()
+        with self.__get_connection() as cnx, closing(cnx.cursor()) as cur:
             cur.execute(query, args)
             cnx.commit()
             rowcount = cur.rowcount
-            return rowcount
+        elapsed = observe_query("updater", name, start, rowcount)
+        if self._slow_queries.is_slow(elapsed):
+            self._log_slow_query(name, query, args, rowcount, elapsed)
+        return rowcount
 
     def _insert_many(self, query: str, seq_of_params: Iterable) -> int:
         """
@@ -105,23 +159,92 @@ class DB:
         Returns:
             int: number of affected rows
         """
-        with closing(self.__get_connection()) as cnx, closing(cnx.cursor()) as cur:
+        name, start = caller_name(), perf_counter()
+        seq_of_params = list(seq_of_params)
+        with self.__get_connection() as cnx, closing(cnx.cursor()) as cur:
             cur.executemany(query, seq_of_params)
             cnx.commit()
             rowcount = cur.rowcount
-            return rowcount
+        elapsed = observe_query("updater", name, start, rowcount)
+        if self._slow_queries.is_slow(elapsed):
+            # executemany sends one multi-row insert, its plan tells nothing
+            self._slow_queries.record(name, query, len(seq_of_params), rowcount, elapsed)
+        return rowcount
+
+    def _log_slow_query(self, name: str, query: str, args: Iterable, rows: int, elapsed: float) -> None:
+        """
+        Keeps the slow query run by DB method name together with its plan when it should be explained,
+        see SlowQueryLog. The plan is read in a separated connection and failure to read it is kept instead.
+        """
+        plan = None
+        if self._slow_queries.should_explain(name, query):
+            try:
+                with self.__get_connection() as cnx, closing(cnx.cursor(dictionary=True)) as cur:
+                    cur.execute(f"EXPLAIN {query}", args)
+                    plan = cur.fetchall()
+            except Exception as err:
+                plan = repr(err)
+        self._slow_queries.record(name, query, len(args), rows, elapsed, plan)
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Runs a block of queries in one transaction in separated connection.
+        The transaction is committed at the end of the block and rolled back on any error.
+        The whole transaction is timed as one query named after the calling method.
+
+        Yields:
+            dictionary cursor of the transaction connection
+
+        Raises:
+            mysql.connector.Error
+        """
+        # frames: _transaction, contextlib __enter__, calling method
+        name, start = caller_name(3), perf_counter()
+        with self.__get_connection() as cnx, closing(cnx.cursor(dictionary=True)) as cur:
+            cnx.start_transaction()
+            try:
+                yield cur
+            except BaseException:
+                cnx.rollback()
+                raise
+            cnx.commit()
+        observe_query("updater", name, start, 0)
+
+    @contextmanager
+    def _named_lock(self, name: str):
+        """
+        Holds MySQL named lock for the duration of the block if nobody else holds it,
+        so a job runs in one process at a time. The lock is held by a separated connection
+        and is released when the connection is closed too.
+
+        Yields:
+            bool: whether the lock has been acquired
+
+        Raises:
+            mysql.connector.Error
+        """
+        with self.__get_connection() as cnx, closing(cnx.cursor()) as cur:
+            cur.execute("SELECT GET_LOCK(%s, 0)", [name])
+            locked = cur.fetchall()[0][0] == 1
+            try:
+                yield locked
+            finally:
+                if locked:
+                    cur.execute("SELECT RELEASE_LOCK(%s)", [name])
+                    cur.fetchall()
 
     def __get_connection(self):
         """
-        Returns connection from pool
+        Returns context manager checking out connection from pool
 
         Returns:
-            mysql.connector.pooling.PooledMySQLConnection
+            context manager of mysql.connector.pooling.PooledMySQLConnection
 
         Raises:
-            mysql.connector.errors.PoolError
+            catalog.pool.PoolExhausted
         """
-        return self.__cnxpool.get_connection()
+        return self.__cnxpool.connection()
 
 
 class ProductCatalogDB(DB):
@@ -132,6 +255,8 @@ class ProductCatalogDB(DB):
         the external API url taken from env var the application configuration is not valid and app can not be started.
         """
         super().__init__()
+        # offer changes are logged for the change feed unless its retention is zero
+        self._change_log = int(environ.get("CHANGE_LOG_RETENTION", 3600)) > 0
 
         url = environ['OFFERS_API_BASE_URL']
         token_dict = self._select_access_token()
@@ -148,147 +273,407 @@ class ProductCatalogDB(DB):
     def access_token(self):
         return self._access_token
 
-    def insert_product(self, product: ProductNoId) -> int:
-        """
-        Inserts given product into product table.
+    @property
+    def service_id(self):
+        return self._service_id
 
-        raises:
-            HTTPException: Product of this name already exists
+    def select_due_products(self, limit: int, shards: list[int] = None, shards_count: int = None) -> dict[int, dict]:
         """
-        params = dict(product)
-        params |= dict(service_id=self._service_id)
-        insert = """INSERT INTO product (service_id, name, description) 
-                    VALUES (%(service_id)s, %(name)s, %(description)s) ON DUPLICATE KEY UPDATE id=id"""
-        rowcount = self._execute(insert, params)
-        if not rowcount == 1:
-            log.warning("Duplicit product name %s", product.name)
+        Returns up to limit products whose next refresh time has come, the most overdue first.
+        Products waiting in the registration outbox are left out, the offers service does not know them yet.
+        With shards given only products belonging to them are returned, product belongs to shard id % shards_count.
 
-        select = "SELECT id FROM product WHERE name=%(name)s AND description=%(description)s"
-        inserted_product = self._select_one(select, params)
-        if inserted_product:
-            log.info("Product %s successfully inserted under id %d", params, inserted_product["id"])
-            return inserted_product["id"]
-        else:
-            log.error("Product with name %s already exists with different description", product.name)
-            raise HTTPException(status_code=409, detail="Product of this name already exists")
+        Returns:
+            dict: maps product id to dict with its current refresh interval in seconds (interval_s),
+                  zero for never refreshed product, and digest of its last synced offers (offers_digest)
+        """
+        select = """SELECT product_id, interval_s, offers_digest FROM product_refresh
+                    WHERE next_refresh_at <= NOW()
+                        AND NOT EXISTS (SELECT 1 FROM product_registration WHERE product_id=product_refresh.product_id)"""
+        args = []
+        if shards is not None:
+            if not shards:
+                return {}
+            select += f" AND MOD(product_id, %s) IN ({places(shards)})"
+            args += [shards_count, *shards]
+        select += " ORDER BY next_refresh_at LIMIT %s"
+        rows = self._select_all(select, [*args, limit])
+        return {row.pop("product_id"): row for row in rows}
+
+    def select_products_refresh(self, product_ids: list[int]) -> dict[int, dict]:
+        """
+        Same as select_due_products but returns given products regardless of their next refresh time.
+        """
+        if not product_ids:
+            return {}
+        select = f"""SELECT product_id, interval_s, offers_digest FROM product_refresh
+                     WHERE product_id IN ({places(product_ids)})"""
+        rows = self._select_all(select, product_ids)
+        return {row.pop("product_id"): row for row in rows}
+
+    def update_refresh_schedule(self, intervals: dict[int, int], digests: dict[int, bytes] = None) -> None:
+        """
+        Sets new refresh intervals of given products and schedules their next refresh accordingly.
+        MySQL evaluates single table UPDATE assignments from left to right,
+        so next_refresh_at is computed from the new interval.
 
-    def select_product(self, id: int) -> dict:
+        Args:
+            intervals (dict): maps product id to its new refresh interval in seconds
+            digests   (dict): maps product id to digest of its just synced offers, see offers_digest
         """
-        Selects product of given id from DB.
+        for product_ids in chunks(list(intervals), 1000):
+            update = f"""UPDATE product_refresh
+                         SET interval_s=CASE product_id {" ".join(["WHEN %s THEN %s"] * len(product_ids))} END,
+                             next_refresh_at=NOW() + INTERVAL interval_s SECOND"""
+            args = [arg for product_id in product_ids for arg in (product_id, intervals[product_id])]
+            if digests:
+                update += f""", offers_digest=CASE product_id {" ".join(["WHEN %s THEN %s"] * len(product_ids))}
+                                              ELSE offers_digest END"""
+                args += [arg for product_id in product_ids for arg in (product_id, digests.get(product_id))]
+            update += f" WHERE product_id IN ({places(product_ids)})"
+            self._execute(update, args + product_ids)
 
-        raises:
-            HTTPException: Product not found
+    def insert_updater_shards(self, shards_count: int) -> None:
         """
-        select = "SELECT id, name, description FROM product WHERE id=%(id)s"
-        product = self._select_one(select, dict(id=id))
-        if product:
-            log.info("Selected product %s", product)
-            return product
-        else:
-            log.warning("Product %d not found", id)
-            raise HTTPException(status_code=404, detail="Product not found")
-
-    def update_product(self, id: int, product: ProductNoId) -> dict:
+        Makes sure the updater_shard table contains all shards.
         """
-        Update product of given id.
+        insert = f"INSERT IGNORE INTO updater_shard (shard) VALUES {row_places(range(shards_count), 1)}"
+        self._execute(insert, list(range(shards_count)))
 
-        raises:
-            HTTPException: Product not found
+    def heartbeat_updater_worker(self, worker: str, ttl: int) -> int:
         """
-        update = "UPDATE product SET name=%(name)s, description=%(description)s WHERE id=%(id)s"
-        params = dict(id=id, name=product.name, description=product.description)
-        rowcount = self._execute(update, params)
-        if rowcount == 1:
-            log.info("Product %d successfully updated", id)
-        else:
-            log.warning("Product %d not found", id)
-            raise HTTPException(status_code=404, detail="Product not found")
-        return params
+        Records heartbeat of given updater process, forgets processes with expired heartbeat
+        and returns number of live processes.
+        """
+        upsert = """INSERT INTO updater_worker (worker, heartbeat_at) VALUES (%(worker)s, NOW())
+                    ON DUPLICATE KEY UPDATE heartbeat_at=NOW()"""
+        self._execute(upsert, dict(worker=worker))
+        delete = "DELETE FROM updater_worker WHERE heartbeat_at < NOW() - INTERVAL %(ttl)s SECOND"
+        self._execute(delete, dict(ttl=ttl))
+        return self._select_one("SELECT count(*) AS workers FROM updater_worker")["workers"]
 
-    def delete_product(self, id: int) -> None:
+    def renew_updater_shards(self, worker: str, ttl: int) -> list[int]:
         """
-        Deletes product of given id from DB.
+        Extends leases of all shards owned by given updater process and returns them.
+        """
+        update = "UPDATE updater_shard SET lease_until=NOW() + INTERVAL %(ttl)s SECOND WHERE worker=%(worker)s"
+        self._execute(update, dict(worker=worker, ttl=ttl))
+        select = "SELECT shard FROM updater_shard WHERE worker=%(worker)s ORDER BY shard"
+        return [row["shard"] for row in self._select_all(select, dict(worker=worker))]
 
-        raises:
-            HTTPException: Product not found
+    def claim_updater_shards(self, worker: str, count: int, ttl: int) -> int:
         """
-        delete = "DELETE FROM product WHERE id=%(id)s"
-        rowcount = self._execute(delete, dict(id=id))
-        if rowcount == 1:
-            log.info("Product %d successfully deleted", id)
-        else:
-            log.warning("Product %d not found", id)
-            raise HTTPException(status_code=404, detail="Product not found")
+        Leases up to count shards with no owner or with expired lease to given updater process.
+        Returns number of claimed shards.
+        """
+        update = """UPDATE updater_shard SET worker=%(worker)s, lease_until=NOW() + INTERVAL %(ttl)s SECOND
+                    WHERE worker IS NULL OR lease_until < NOW() ORDER BY shard LIMIT %(count)s"""
+        return self._execute(update, dict(worker=worker, ttl=ttl, count=count))
 
-    def list_all_product_ids(self) -> list[int]:
+    def release_updater_shards(self, worker: str, shards: list[int]) -> None:
         """
-        Returns all product ids.
+        Releases given shards owned by given updater process.
         """
-        select = "SELECT JSON_ARRAYAGG(id) AS ids FROM product"
-        ids = self._select_one(select)["ids"]
-        return json.loads(ids) if ids else []
+        update = f"""UPDATE updater_shard SET worker=NULL, lease_until=NULL
+                     WHERE worker=%s AND shard IN ({places(shards)})"""
+        self._execute(update, [worker, *shards])
 
-    def insert_product_offers(self, product_id: int, offers: list[dict]) -> None:
+    def release_updater_worker(self, worker: str) -> None:
         """
-        Insert all given offers of specified product into DB.
-        If offer already exists updates the items_in_stock column.
+        Releases all shards and the heartbeat of given updater process.
         """
-        for offer in offers:
-            offer["product_id"] = product_id
+        self._execute("UPDATE updater_shard SET worker=NULL, lease_until=NULL WHERE worker=%(worker)s",
+                      dict(worker=worker))
+        self._execute("DELETE FROM updater_worker WHERE worker=%(worker)s", dict(worker=worker))
 
-        insert = """INSERT INTO offer (product_id, foreign_id, items_in_stock)
-                    VALUES (%(product_id)s, %(id)s, %(items_in_stock)s)
-                    ON DUPLICATE KEY UPDATE items_in_stock=VALUES(items_in_stock)"""
-        rowcount = self._insert_many(insert, offers)
-        log.debug("num of offers being inserted: %d, rowcount: %d", len(offers), rowcount)
+    def claim_registrations(self, limit: int, claim_ttl: int) -> list[dict]:
+        """
+        Claims up to limit products due for registration in the offers service, the longest waiting first.
+        Their next attempt is pushed claim_ttl seconds ahead, so other processes skip them meanwhile
+        and they are retried if this process dies. Rows claimed by a running transaction are skipped.
+
+        Returns:
+            list of dict: id, name and description of the products with number of attempts started (attempts)
+        """
+        with self._transaction() as cur:
+            select = """SELECT product_id, attempts FROM product_registration WHERE next_attempt_at <= NOW()
+                        ORDER BY next_attempt_at LIMIT %s FOR UPDATE SKIP LOCKED"""
+            cur.execute(select, [limit])
+            attempts = {row["product_id"]: row["attempts"] + 1 for row in cur.fetchall()}
+            if not attempts:
+                return []
+            product_ids = list(attempts)
+            update = f"""UPDATE product_registration
+                         SET attempts=attempts + 1, next_attempt_at=NOW() + INTERVAL %s SECOND
+                         WHERE product_id IN ({places(product_ids)})"""
+            cur.execute(update, [claim_ttl, *product_ids])
+            cur.execute(f"SELECT id, name, description FROM product WHERE id IN ({places(product_ids)})", product_ids)
+            return [dict(product, attempts=attempts[product["id"]]) for product in cur.fetchall()]
 
-    def delete_obsolete_product_offers(self, product_id: int, offers: list[dict]) -> None:
+    def delete_registrations(self, product_ids: list[int]) -> None:
         """
-        Deletes all offers of specified product except given offer ids.
+        Removes registered products from the outbox.
         """
-        ids = [offer["id"] for offer in offers]
-        delete = f"DELETE FROM offer WHERE product_id={product_id} AND foreign_id NOT IN ({places(ids)})"
-        rowcount = self._execute(delete, ids)
-        log.debug("%d offers deleted", rowcount)
+        for chunk in chunks(product_ids, 1000):
+            self._execute(f"DELETE FROM product_registration WHERE product_id IN ({places(chunk)})", chunk)
 
-    def select_product_offers(self, product_id: int, on_stock: bool = True) -> list[dict]:
+    def retry_registrations(self, delays: dict[int, float]) -> None:
         """
-        Returns offers of specified product. It takes the latest known price.
-        If a offer does not have any price return it anyway.
-        It is needed for the computation of prices to be inserted.
+        Schedules next registration attempt of given products.
+
+        Args:
+            delays (dict): maps product id to seconds to wait before the next attempt
         """
-        min_stock = 1 if on_stock else 0
-        select = """SELECT 
-                        o.id AS offer_id,
-                        o.product_id AS product_id,
-                        o.foreign_id AS foreign_id,
-                        p.price AS price,
-                        o.items_in_stock AS items_in_stock 
-                    FROM offer AS o LEFT JOIN price AS p ON o.id=p.offer_id
-                        AND o.product_id=%(product_id)s 
-                        AND p.id=(SELECT max(id) FROM price WHERE offer_id=o.id)
-                    WHERE o.items_in_stock >= %(min_stock)s"""
-        return self._select_all(select, dict(product_id=product_id, min_stock=min_stock))
+        for product_ids in chunks(list(delays), 1000):
+            update = f"""UPDATE product_registration
+                         SET next_attempt_at=NOW() + INTERVAL
+                             CASE product_id {" ".join(["WHEN %s THEN %s"] * len(product_ids))} END SECOND
+                         WHERE product_id IN ({places(product_ids)})"""
+            # at least a second, so a retried product is not claimed again by the same drain
+            args = [arg for product_id in product_ids for arg in (product_id, max(1, int(delays[product_id])))]
+            self._execute(update, args + product_ids)
 
     def insert_prices(self, prices: list) -> None:
         """
         Inserts given prices into price table.
+        The latest price of each offer in offer_current_price is updated by price_after_insert trigger.
         """
         insert = "INSERT INTO price (offer_id, price) VALUES (%(offer_id)s, %(price)s)"
         rowcount = self._insert_many(insert, prices)
         if rowcount > 0:
             log.debug("%d prices inserted", rowcount)
 
-    def select_offer_prices(self, offer_id: int, start: datetime.datetime, end: datetime.datetime) -> list[dict]:
-        """
-        Select prices for specified offer with times when they were applied.
-        """
-        start = datetime.date(year=2000, month=1, day=1).isoformat() if start is None else start
-        end = datetime.datetime.now().isoformat() if end is None else end
-        select = """SELECT price, created_at AS valid_from FROM price 
-                    WHERE offer_id=%(offer_id)s AND created_at > %(start)s AND created_at < %(end)s"""
-        params = dict(offer_id=offer_id, start=start, end=end)
-        return self._select_all(select, params)
+    def price_retention_lock(self):
+        """
+        Returns context manager holding the lock of the price retention job, see _named_lock.
+        """
+        return self._named_lock("price_retention")
+
+    def select_price_partitions(self) -> list[dict]:
+        """
+        Returns partitions of price table in their order, each as dict with name and bound,
+        the UNIX timestamp the partition ends at or None for the last MAXVALUE partition.
+        Not partitioned table has no partitions.
+        """
+        select = """SELECT PARTITION_NAME AS name, PARTITION_DESCRIPTION AS bound
+                    FROM information_schema.PARTITIONS
+                    WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME='price' AND PARTITION_NAME IS NOT NULL
+                    ORDER BY PARTITION_ORDINAL_POSITION"""
+        return [dict(name=row["name"], bound=None if row["bound"] == "MAXVALUE" else int(row["bound"]))
+                for row in self._select_all(select)]
+
+    def add_price_partitions(self, bounds: list[int]) -> None:
+        """
+        Splits partitions ending at given UNIX timestamps off the MAXVALUE partition pmax.
+        Each partition is named after the UTC day it ends at.
+        """
+        partitions = [f"PARTITION `p{datetime.datetime.fromtimestamp(bound, datetime.timezone.utc):%Y%m%d}` "
+                      f"VALUES LESS THAN ({bound})"
+                      for bound in bounds]
+        self._execute(f"""ALTER TABLE price REORGANIZE PARTITION pmax INTO (
+                              {", ".join(partitions)}, PARTITION pmax VALUES LESS THAN MAXVALUE)""")
+        log.info("%d price partitions added", len(bounds))
+
+    def rollup_price_partition(self, name: str, start: int, end: int) -> None:
+        """
+        Aggregates prices of given partition holding prices from start to end UNIX timestamp into hourly rollups
+        and the hourly rollups of the same time range into daily ones, in one transaction.
+        Partitions are aligned to UTC days, so no hour or day is split among partitions.
+        Prices of deleted offers are left out. Repeated rollup of the same partition overwrites the previous one.
+        """
+        with self._transaction() as cur:
+            insert = f"""INSERT INTO price_hourly (offer_id, hour, open, high, low, close, avg, count)
+                         SELECT
+                             p.offer_id,
+                             FROM_UNIXTIME(UNIX_TIMESTAMP(p.created_at) DIV 3600 * 3600) AS hour_start,
+                             CAST(SUBSTRING_INDEX(GROUP_CONCAT(p.price ORDER BY p.created_at, p.id), ',', 1)
+                                  AS SIGNED),
+                             max(p.price),
+                             min(p.price),
+                             CAST(SUBSTRING_INDEX(GROUP_CONCAT(p.price ORDER BY p.created_at DESC, p.id DESC), ',', 1)
+                                  AS SIGNED),
+                             avg(p.price),
+                             count(*)
+                         FROM price PARTITION (`{name}`) AS p JOIN offer AS o ON o.id=p.offer_id
+                         GROUP BY p.offer_id, hour_start
+                         ON DUPLICATE KEY UPDATE open=VALUES(open), high=VALUES(high), low=VALUES(low),
+                                                 close=VALUES(close), avg=VALUES(avg), count=VALUES(count)"""
+            cur.execute(insert)
+            log.debug("Partition %s rolled up into %d hourly prices", name, cur.rowcount)
+            insert = """INSERT INTO price_daily (offer_id, day, open, high, low, close, avg, count)
+                        SELECT
+                            offer_id,
+                            FROM_UNIXTIME(UNIX_TIMESTAMP(hour) DIV 86400 * 86400) AS day_start,
+                            CAST(SUBSTRING_INDEX(GROUP_CONCAT(open ORDER BY hour), ',', 1) AS SIGNED),
+                            max(high),
+                            min(low),
+                            CAST(SUBSTRING_INDEX(GROUP_CONCAT(close ORDER BY hour DESC), ',', 1) AS SIGNED),
+                            sum(avg * count) / sum(count),
+                            sum(count)
+                        FROM price_hourly
+                        WHERE hour >= FROM_UNIXTIME(%(start)s) AND hour < FROM_UNIXTIME(%(end)s)
+                        GROUP BY offer_id, day_start
+                        ON DUPLICATE KEY UPDATE open=VALUES(open), high=VALUES(high), low=VALUES(low),
+                                                close=VALUES(close), avg=VALUES(avg), count=VALUES(count)"""
+            cur.execute(insert, dict(start=start, end=end))
+            log.debug("Partition %s rolled up into %d daily prices", name, cur.rowcount)
+
+    def drop_price_partition(self, name: str) -> None:
+        self._execute(f"ALTER TABLE price DROP PARTITION `{name}`")
+        log.info("Price partition %s dropped", name)
+
+    def select_price_retention(self) -> dict:
+        """
+        Returns UNIX timestamps raw_since and hourly_since, the boundaries of price history resolutions.
+        Prices older than raw_since are read from hourly rollups, older than hourly_since from daily ones.
+        """
+        select = """SELECT UNIX_TIMESTAMP(raw_since) AS raw_since, UNIX_TIMESTAMP(hourly_since) AS hourly_since
+                    FROM price_retention WHERE id=1"""
+        return {name: int(value) for name, value in self._select_one(select).items()}
+
+    def update_price_retention(self, raw_since: int = None, hourly_since: int = None) -> None:
+        """
+        Moves given boundaries of price history resolutions, see select_price_retention.
+        """
+        update = """UPDATE price_retention
+                    SET raw_since=IFNULL(FROM_UNIXTIME(%(raw_since)s), raw_since),
+                        hourly_since=IFNULL(FROM_UNIXTIME(%(hourly_since)s), hourly_since)
+                    WHERE id=1"""
+        self._execute(update, dict(raw_since=raw_since, hourly_since=hourly_since))
+
+    def delete_hourly_prices(self, before: int, limit: int) -> int:
+        """
+        Deletes up to limit hourly rollups older than given UNIX timestamp and returns their number.
+        """
+        delete = "DELETE FROM price_hourly WHERE hour < FROM_UNIXTIME(%(before)s) LIMIT %(limit)s"
+        return self._execute(delete, dict(before=before, limit=limit))
+
+    def sync_offers(self, api_offers: dict[int, list[dict]]) -> tuple[set[int], dict[int, list[dict]]]:
+        """
+        Synchronizes offers of a batch of products with offers taken from API in one transaction,
+        so readers never see a half synced product:
+            - select actual offers of the batch with their latest prices
+            - compute the difference against API offers, see diff_offers
+            - upsert new offers and offers with changed stock
+            - delete obsolete offers
+            - insert prices of new offers and changed prices
+        Each step is one multi-row statement regardless of the batch size
+        and steps which would change nothing are skipped.
+        Transaction killed by a deadlock is retried.
+
+        Args:
+            api_offers (dict): maps product id to list of its offers from API
+
+        Returns:
+            tuple: set of ids of products with a new price and dict mapping product id to its current offers,
+                   dicts with offer_id, price and items_in_stock keys, see OffersSnapshot
+        """
+        for attempt in range(1, 4):
+            try:
+                return self._sync_offers(api_offers)
+            except mysql.connector.Error as err:
+                if err.errno != errorcode.ER_LOCK_DEADLOCK or attempt == 3:
+                    raise
+                log.warning("Deadlock while syncing offers, attempt %d", attempt)
+
+    def _sync_offers(self, api_offers: dict[int, list[dict]]) -> tuple[set[int], dict[int, list[dict]]]:
+        """
+        One attempt of sync_offers.
+        """
+        product_ids = list(api_offers)
+        with self._transaction() as cur:
+            select = f"""SELECT 
+                             o.id AS offer_id,
+                             o.product_id AS product_id,
+                             o.foreign_id AS foreign_id,
+                             cp.price AS price,
+                             o.items_in_stock AS items_in_stock
+                         FROM offer AS o LEFT JOIN offer_current_price AS cp ON o.id=cp.offer_id
+                         WHERE o.product_id IN ({places(product_ids)})"""
+            cur.execute(select, product_ids)
+            db_offers = {product_id: [] for product_id in product_ids}
+            for db_offer in cur.fetchall():
+                db_offers[db_offer["product_id"]].append(db_offer)
+
+            prices, offer_rows, new_offers, obsolete, changed = [], [], [], [], set()
+            new_offer_ids, repriced_ids, restocked = {}, set(), set()
+            diff_phase = UPDATER_PHASE.labels("diff")
+            for product_id, offers in api_offers.items():
+                with timed(diff_phase):
+                    diff = diff_offers(offers, db_offers[product_id])
+                if diff.prices or diff.new:
+                    changed.add(product_id)
+                prices += diff.prices
+                offer_rows += [(product_id, offer["id"], offer["items_in_stock"]) for offer in diff.stock + diff.new]
+                new_offers += [(product_id, offer["id"], offer["price"]) for offer in diff.new]
+                obsolete += diff.obsolete
+                repriced_ids |= {price["offer_id"] for price in diff.prices}
+                restocked |= {(product_id, offer["id"]) for offer in diff.stock}
+            obsolete_ids = [offer["offer_id"] for offer in obsolete]
+
+            if offer_rows:
+                insert = f"""INSERT INTO offer (product_id, foreign_id, items_in_stock)
+                             VALUES {row_places(offer_rows, 3)}
+                             ON DUPLICATE KEY UPDATE items_in_stock=VALUES(items_in_stock)"""
+                cur.execute(insert, [arg for row in offer_rows for arg in row])
+                log.debug("num of offers being upserted: %d, rowcount: %d", len(offer_rows), cur.rowcount)
+
+            if obsolete_ids:
+                delete = f"DELETE FROM offer WHERE id IN ({places(obsolete_ids)})"
+                cur.execute(delete, obsolete_ids)
+                log.debug("%d offers deleted", cur.rowcount)
+
+            if new_offers:
+                select = f"""SELECT id, product_id, foreign_id FROM offer
+                             WHERE (product_id, foreign_id) IN ({row_places(new_offers, 2)})"""
+                cur.execute(select, [arg for row in new_offers for arg in row[:2]])
+                new_offer_ids = {(row["product_id"], row["foreign_id"]): row["id"] for row in cur.fetchall()}
+                prices += [dict(offer_id=new_offer_ids[product_id, foreign_id], price=price)
+                           for product_id, foreign_id, price in new_offers]
+
+            if prices:
+                insert = f"INSERT INTO price (offer_id, price) VALUES {row_places(prices, 2)}"
+                cur.execute(insert, [arg for price in prices for arg in (price["offer_id"], price["price"])])
+                log.debug("%d prices inserted", cur.rowcount)
+
+            current, changes = {}, []
+            for product_id, offers in api_offers.items():
+                offer_ids = {db_offer["foreign_id"]: db_offer["offer_id"] for db_offer in db_offers[product_id]}
+                current[product_id] = []
+                for offer in offers:
+                    offer_id = offer_ids.get(offer["id"]) or new_offer_ids[product_id, offer["id"]]
+                    current[product_id].append(dict(offer_id=offer_id, price=offer["price"],
+                                                    items_in_stock=offer["items_in_stock"]))
+                    if offer["id"] not in offer_ids:
+                        kind = "new"
+                    elif offer_id in repriced_ids or (product_id, offer["id"]) in restocked:
+                        kind = "update"
+                    else:
+                        continue
+                    changes.append((product_id, offer_id, kind, offer["price"], offer["items_in_stock"]))
+            changes += [(offer["product_id"], offer["offer_id"], "removed", None, None) for offer in obsolete]
+            if changes and self._change_log:
+                self._log_changes(cur, changes)
+        return changed, current
+
+    @staticmethod
+    def _log_changes(cur, changes: list[tuple]) -> None:
+        """
+        Appends offer changes to change_log within the transaction making them. Their sequence numbers are taken
+        from change_sequence, whose row stays locked until the commit, so changes become visible
+        in the order of their sequence numbers and the change feed never skips a change committed late.
+
+        Args:
+            cur          : cursor of the transaction
+            changes (list): tuples of product_id, offer_id, kind, price and items_in_stock
+        """
+        cur.execute("UPDATE change_sequence SET seq=LAST_INSERT_ID(seq + %s) WHERE id=1", [len(changes)])
+        first = cur.lastrowid - len(changes) + 1
+        rows = [(first + i, *change) for i, change in enumerate(changes)]
+        for chunk in chunks(rows, 1000):
+            insert = f"""INSERT INTO change_log (id, product_id, offer_id, kind, price, items_in_stock)
+                         VALUES {row_places(chunk, 6)}"""
+            cur.execute(insert, [arg for row in chunk for arg in row])
 
     def _select_access_token(self) -> dict:
         """
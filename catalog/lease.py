@@ -0,0 +1,73 @@
+import os
+import math
+import uuid
+import socket
+import logging
+from time import monotonic
+
+from catalog.db import ProductCatalogDB
+
+
+log = logging.getLogger()
+
+
+class ShardLease:
+
+    def __init__(self, db: ProductCatalogDB, shards: int, ttl: int):
+        """
+        Splits products among all updater processes of all replicas.
+        Product belongs to shard id % shards. Each process periodically heartbeats into updater_worker table
+        and holds leases of its fair share of shards in updater_shard table. Lease not renewed within ttl seconds
+        expires, so shards of a crashed process are taken over by the others.
+
+        Args:
+            db    (ProductCatalogDB): DB used for the coordination
+            shards           (int) : number of shards, has to be the same in all processes
+            ttl              (int) : lease and heartbeat expiration in seconds
+        """
+        self._db = db
+        self._shards = shards
+        self._ttl = ttl
+        self._worker = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._renewed_at = 0.0
+        self._db.insert_updater_shards(shards)
+
+    @property
+    def shards(self) -> int:
+        return self._shards
+
+    def acquire(self) -> list[int]:
+        """
+        Renews owned leases and rebalances them to the fair share of shards: ceil(shards / live processes).
+        Extra shards are released, missing ones are claimed from shards with no owner or with expired lease.
+
+        Returns:
+            list of int: shards owned by this process
+        """
+        workers = self._db.heartbeat_updater_worker(self._worker, self._ttl)
+        fair_share = math.ceil(self._shards / max(workers, 1))
+        owned = self._db.renew_updater_shards(self._worker, self._ttl)
+        self._renewed_at = monotonic()
+        if len(owned) > fair_share:
+            self._db.release_updater_shards(self._worker, owned[fair_share:])
+            owned = owned[:fair_share]
+        elif len(owned) < fair_share:
+            self._db.claim_updater_shards(self._worker, fair_share - len(owned), self._ttl)
+            owned = self._db.renew_updater_shards(self._worker, self._ttl)
+        log.debug("Updater %s of %d processes owns shards %s", self._worker, workers, owned)
+        return owned
+
+    def keep_alive(self) -> None:
+        """
+        Renews owned leases if a third of ttl has passed since the last renewal.
+        Long sweeps call it so their shards are not taken over meanwhile.
+        """
+        if monotonic() - self._renewed_at > self._ttl / 3:
+            self._db.renew_updater_shards(self._worker, self._ttl)
+            self._renewed_at = monotonic()
+
+    def release(self) -> None:
+        """
+        Releases all owned shards and the heartbeat, so the other processes can take them over right away.
+        """
+        self._db.release_updater_worker(self._worker)
@@ -1,16 +1,43 @@
 import sys
+import asyncio
 import logging
+import threading
+from os import environ
 from datetime import datetime
+from contextlib import asynccontextmanager, nullcontext
 
-from fastapi import FastAPI, BackgroundTasks, status
-from fastapi_utils.tasks import repeat_every
+from fastapi import FastAPI, APIRouter, Request, Response, Query, Header, HTTPException, Depends, status
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from pydantic import BaseModel
 
 from catalog.db import ProductCatalogDB
+from catalog.aiodb import AsyncProductCatalogDB
 from catalog.offers import OffersApi
-from catalog.models import Product, ProductNoId, product_not_found_response, product_conflict_response
-from catalog.models import delete_response, list_of_offers, prices
-from catalog.common import compute_prices_to_insert, calculate_growth, cleanup_offers
+from catalog.updater import OffersUpdater, SWEEP_THREADS
+from catalog.lease import ShardLease
+from catalog.retention import PriceRetention
+from catalog.registration import RegistrationDrainer
+from catalog.changes import ChangeFeed
+from catalog.snapshot import OffersSnapshot
+from catalog.pool import PoolExhausted
+from catalog.models import Product, ProductNoId, BatchItemResult, product_not_found_response, product_conflict_response
+from catalog.models import delete_response, list_of_offers, prices, change_events, Bucket
+from catalog.metrics import MetricsMiddleware, PoolCollector, UPDATER_SWEEP, timed
+from catalog.profiling import Profiler, ProfilerMiddleware
+from catalog.common import calculate_growth, cleanup_offers, cleanup_prices, decode_cursor, next_cursor, to_ndjson
+from catalog.common import FastJSONResponse
+
+
+NDJSON = "application/x-ndjson"
+product_batch_size = int(environ.get("PRODUCT_BATCH_SIZE", 1000))
+offers_api_concurrency = int(environ.get("OFFERS_API_CONCURRENCY", 8))
+updater_tick = int(environ.get("UPDATER_TICK", 15))
+registration_poll = float(environ.get("REGISTRATION_POLL", 5))
+# profiles and slow queries expose code and SQL, they are served only when asked for
+diagnostics_enabled = bool(int(environ.get("DIAGNOSTICS", 0)))
+# served even before the services are ready
+PROBES = {"/healthz", "/readyz", "/metrics"}
 
 
 log = logging.getLogger()
@@ -20,56 +47,433 @@ stream_handler.setLevel(logging.DEBUG)
 log.addHandler(stream_handler)
 
 
+# created in background by start_services, so the server accepts connections right after start
+db: ProductCatalogDB = None
+adb: AsyncProductCatalogDB = None
+offers_api: OffersApi = None
+lease: ShardLease = None
+updater: OffersUpdater = None
+retention: PriceRetention = None
+registrations: RegistrationDrainer = None
+change_feed: ChangeFeed = None
+ready = asyncio.Event()
+# set by the product endpoints, wakes up the registration drainer
+registrations_due = asyncio.Event()
+# written through by the updater, read by the offers endpoint
+offers_snapshot = OffersSnapshot()
+profiler = Profiler()
+# set by POST /updater/profile, the next updater sweep is profiled
+profile_sweep = threading.Event()
+
+
+def create_services() -> None:
+    """
+    Connects to MySQL, checks the access token of the offers service and sets up the periodic updater,
+    the registration drainer and the price retention job. Blocking, it runs in a thread.
+    Services created by a previous failed attempt are kept.
+    """
+    global db, offers_api, lease, updater, retention, registrations
+    if db is None:
+        db = ProductCatalogDB()
+    if offers_api is None:
+        # registrations and the updater may call the offers API at once, each needs its own keep-alive connection
+        offers_api = OffersApi(db.access_token,
+                               pool_size=offers_api_concurrency + int(environ.get("UPDATER_CONCURRENCY", 8)))
+    updater_shards = int(environ.get("UPDATER_SHARDS", 32))
+    if lease is None and updater_shards:
+        lease = ShardLease(db, updater_shards, int(environ.get("UPDATER_LEASE_TTL", 300)))
+    if updater is None:
+        updater = OffersUpdater(db, offers_api, lease, offers_snapshot)
+    if retention is None:
+        retention = PriceRetention(db)
+    if registrations is None:
+        registrations = RegistrationDrainer(db, offers_api, updater)
+
+
+async def start_services() -> None:
+    """
+    Creates the services, retrying with backoff while MySQL or the offers service are unavailable,
+    and marks the application ready. Then runs the periodic updater, the first sweep right away,
+    and the price retention job whenever it is due.
+    """
+    global adb, change_feed
+    delay = 1
+    while not ready.is_set():
+        try:
+            await asyncio.to_thread(create_services)
+            if adb is None:
+                async_db = AsyncProductCatalogDB(db.service_id, offers_snapshot)
+                await async_db.connect()
+                adb = async_db
+                change_feed = ChangeFeed(adb)
+            ready.set()
+            log.info("Services ready")
+        except Exception as err:
+            log.error("Can not start services: %r, retrying in %d s", err, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    while True:
+        await asyncio.to_thread(update_offers)
+        await asyncio.to_thread(retention.run_due)
+        await asyncio.sleep(updater_tick)
+
+
+async def drain_registrations() -> None:
+    """
+    Registers products from the registration outbox as soon as the product endpoints insert some
+    and at least every REGISTRATION_POLL seconds, so retries and products inserted by other processes are picked up.
+    """
+    await ready.wait()
+    while True:
+        registrations_due.clear()
+        await asyncio.to_thread(registrations.run)
+        try:
+            await asyncio.wait_for(registrations_due.wait(), registration_poll)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def publish_changes() -> None:
+    """
+    Tails the change log and publishes offer changes to the change feed subscribers of this process.
+    """
+    await ready.wait()
+    await change_feed.run()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    tasks = [asyncio.create_task(start_services()), asyncio.create_task(drain_registrations()),
+             asyncio.create_task(publish_changes())]
+    yield
+    for task in tasks:
+        task.cancel()
+    if adb:
+        await adb.close()
+    if lease:
+        lease.release()
+
+
+async def require_ready(request: Request) -> None:
+    """
+    raises:
+        HTTPException: Service is starting
+    """
+    if not ready.is_set() and request.url.path not in PROBES:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Service is starting",
+                            headers={"Retry-After": "1"})
+
+
 app = FastAPI(title="Product aggregator microservice",
               description="REST API JSON Python microservice which allows users to browse a product catalog "
                           "and which automatically updates prices from the offer service.",
-              version="0.1.0",)
-db = ProductCatalogDB()
-offers_api = OffersApi(db.access_token)
+              version="0.1.0",
+              lifespan=lifespan,
+              dependencies=[Depends(require_ready)],)
+app.add_middleware(MetricsMiddleware)
+if diagnostics_enabled:
+    app.add_middleware(ProfilerMiddleware, profiler=profiler)
+
+
+def pools_stats() -> dict:
+    """
+    Returns PoolStats of the pools created so far.
+    """
+    stats = {}
+    if db:
+        stats["updater"] = db.pool_stats
+    if adb:
+        stats["api"] = adb.pool_stats
+        stats |= {f"replica:{host}": replica_stats for host, replica_stats in adb.replica_pool_stats.items()}
+    return stats
+
+
+PoolCollector(pools_stats).register()
+
+
+@app.get("/healthz")
+async def get_health() -> dict:
+    """
+    Liveness probe, the process serves requests.
+    """
+    return dict(status="ok")
+
+
+@app.get("/readyz", responses={503: dict(description="Service is starting")})
+async def get_ready() -> JSONResponse:
+    """
+    Readiness probe, DB connections and the access token are set up so the endpoints can serve requests.
+    """
+    if ready.is_set():
+        return JSONResponse(dict(status="ready"))
+    return JSONResponse(dict(status="starting"), status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+@app.exception_handler(PoolExhausted)
+async def pool_exhausted_handler(request: Request, err: PoolExhausted) -> JSONResponse:
+    log.warning("Request %s %s shed: %s", request.method, request.url.path, err)
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        content=dict(detail="Service overloaded, try again later"),
+                        headers={"Retry-After": str(err.retry_after)})
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics() -> Response:
+    """
+    Prometheus metrics of this process: route latency, DB query latency and rows, pool usage and updater timings.
+    """
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/pool/stats")
+async def get_pool_stats() -> dict:
+    """
+    Connection pool usage counters of the endpoints (api), of the read replicas (replica:host)
+    and of the periodic updater.
+    """
+    return {name: stats.as_dict() for name, stats in pools_stats().items()}
+
+
+@app.get("/updater/stats")
+async def get_updater_stats() -> dict:
+    """
+    Numbers of products fetched, skipped as unchanged, synced and failed by the periodic updater of this process.
+    """
+    return updater.stats()
+
+
+diagnostics = APIRouter(include_in_schema=False)
+
+
+@diagnostics.post("/updater/profile", status_code=status.HTTP_202_ACCEPTED)
+async def post_updater_profile() -> dict:
+    """
+    Profiles the next sweep of the periodic updater of this process, its thread and the fetch and sync pools.
+    The profile named updater sweep is listed at /profiles once the sweep starts.
+    """
+    profile_sweep.set()
+    return dict(status="scheduled")
+
+
+@diagnostics.get("/profiles")
+async def get_profiles() -> list[dict]:
+    """
+    Profiles of requests and updater sweeps kept by this process, the newest first, see PROFILE_HEADER,
+    PROFILE_SAMPLE_RATE and POST /updater/profile. Duration is null while the profile is running.
+    """
+    return profiler.profiles()
+
+
+@diagnostics.get("/profiles/{id}", response_class=PlainTextResponse)
+async def get_profile(id: int) -> PlainTextResponse:
+    """
+    Sampled stacks of the profile in collapsed format, one stack per line followed by its number of samples.
+    Load it to speedscope or render it by flamegraph.pl. Tasks waiting for something end with [await ...] frame.
+    """
+    profile = profiler.get(id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile.collapsed())
+
+
+@diagnostics.get("/db/slow-queries")
+async def get_slow_queries() -> dict:
+    """
+    Queries of the endpoints (api) and of the periodic updater which took SLOW_QUERY_THRESHOLD seconds or longer,
+    with the number of their arguments and rows and with query plan when SLOW_QUERY_EXPLAIN is set.
+    """
+    return dict(api=adb.slow_queries.entries(), updater=db.slow_queries.entries())
+
+
+if diagnostics_enabled:
+    app.include_router(diagnostics)
+
+
+@app.get("/offers-api/stats")
+async def get_offers_api_stats() -> dict:
+    """
+    Latency of the offers API calls and state of its circuit breaker.
+    """
+    return offers_api.stats()
+
+
+@app.get("/offers-snapshot/stats")
+async def get_offers_snapshot_stats() -> dict:
+    """
+    Hits, misses and number of products of the in-memory offers snapshot of this process.
+    """
+    return offers_snapshot.stats()
+
+
+@app.get("/registrations/stats")
+async def get_registrations_stats() -> dict:
+    """
+    Numbers of products registered in the offers service, scheduled for retry and rejected by this process.
+    """
+    return registrations.stats()
+
+
+@app.get("/changes/stats")
+async def get_changes_stats() -> dict:
+    """
+    Number of change feed subscribers of this process, of changes published to them and of subscribers overflowed.
+    """
+    return change_feed.broadcaster.stats()
+
+
+@app.get("/changes/stream", response_class=StreamingResponse, responses=change_events)
+async def get_changes_stream(product_id: list[int] = Query(None, description="products to follow, all when missing"),
+                             since: int = Query(None, description="id of the last event received"),
+                             last_event_id: int = Header(None)) -> StreamingResponse:
+    """
+    Server-sent events of offer changes made by the updater: new, update (price or stock) and removed.
+    Each event carries its sequence id. A reconnecting client sends the id of the last event it has received
+    in Last-Event-ID header or since param and gets the changes it has missed first, as long as they are kept,
+    see CHANGE_LOG_RETENTION. Event reset means they are not, the client has to read the offers again.
+    Event overflow ends the stream of a client not keeping up, it should reconnect right away.
+    """
+    product_ids = product_id or None
+    if product_ids:
+        check_batch_size(product_ids)
+    return StreamingResponse(change_feed.stream(product_ids, last_event_id if last_event_id is not None else since),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.get("/product/{id}", response_model=Product, responses=product_not_found_response)
-def get_product(id: int) -> dict:
-    return db.select_product(id)
+async def get_product(id: int) -> FastJSONResponse:
+    """
+    The product is read from DB or the product cache as is, response_model only documents it.
+    """
+    return FastJSONResponse(await adb.select_product(id))
 
 
 @app.post("/product", status_code=status.HTTP_201_CREATED, response_model=Product, responses=product_conflict_response)
-def post_product(product: ProductNoId, backgroud_tasks: BackgroundTasks) -> dict:
-    id = db.insert_product(product)
-    backgroud_tasks.add_task(register_product, product)
+async def post_product(product: ProductNoId) -> dict:
+    """
+    The product is registered in the offers service and gets its offers in background, see RegistrationDrainer.
+    """
+    id = await adb.insert_product(product)
+    registrations_due.set()
     product_dict = dict(product)
     product_dict["id"] = id
     return product_dict
 
 
+@app.post("/products/batch", response_model=list[BatchItemResult])
+async def post_products(products: list[ProductNoId]) -> list[dict]:
+    """
+    Inserts up to PRODUCT_BATCH_SIZE products at once. Returns result of each product in the given order,
+    see POST /product for the meaning of statuses. Inserted products are registered in the offers service
+    in batches in background.
+    """
+    check_batch_size(products)
+    results = await adb.insert_products(products)
+    registrations_due.set()
+    return results
+
+
+@app.get("/products", response_model=list[BatchItemResult])
+async def get_products(ids: str = Query(example="1,2,3", description="comma separated product ids")) -> list[dict]:
+    """
+    Returns up to PRODUCT_BATCH_SIZE products at once in the order of given ids, missing products get status 404.
+    """
+    try:
+        ids = [int(id) for id in ids.split(",")]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid product ids")
+    check_batch_size(ids)
+    return await adb.select_products(ids)
+
+
+def check_batch_size(items: list) -> None:
+    """
+    raises:
+        HTTPException: Too many items in one batch
+    """
+    if len(items) > product_batch_size:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"At most {product_batch_size} products can be processed at once")
+
+
 @app.put("/product/{id}", response_model=Product, responses=product_not_found_response)
-def put_product(id: int, product: ProductNoId) -> dict:
-    return db.update_product(id, product)
+async def put_product(id: int, product: ProductNoId) -> dict:
+    return await adb.update_product(id, product)
 
 
 @app.delete("/product/{id}", responses=delete_response)
-def delete_product(id: int):
-    db.delete_product(id)
+async def delete_product(id: int):
+    await adb.delete_product(id)
 
 
 @app.get("/product/{id}/offers", responses=list_of_offers)
-def get_product_offers(id: int, on_stock: bool = True) -> list[dict]:
-    # select_product_offers function returns more than API caller= should see - we have to clean the returned data
-    return cleanup_offers(db.select_product_offers(id, on_stock))
+async def get_product_offers(id: int, on_stock: bool = True,
+                             limit: int = Query(None, ge=1), cursor: str = None, accept: str = Header(None)):
+    """
+    Offers are ordered by offer id. With limit set at most limit offers are returned and the cursor
+    of the next page is sent in X-Next-Cursor header. With Accept: application/x-ndjson header
+    all offers are streamed as newline delimited JSON straight from DB.
+    """
+    after = parse_cursor(cursor, (int,))
+    if accept and NDJSON in accept:
+        chunks = adb.stream_product_offers(id, on_stock, after)
+        return StreamingResponse((to_ndjson(cleanup_offers(offers)) async for offers in chunks), media_type=NDJSON)
+
+    # served from the in-memory offers snapshot which keeps priced offers only
+    offers = await adb.select_product_offers(id, on_stock, after, limit)
+    headers = {}
+    if next_page := next_cursor(offers, limit, ("offer_id",)):
+        headers["X-Next-Cursor"] = next_page
+    return FastJSONResponse(offers, headers=headers)
 
 
 @app.get("/offer/{id}/prices", responses=prices)
-def get_offer_prices(id: int, start: datetime = None, end: datetime = None) -> dict:
-    prices = db.select_offer_prices(id, start, end)
-    growth = calculate_growth(prices)
-    return dict(prices=prices, growth=growth)
+async def get_offer_prices(id: int, start: datetime = None, end: datetime = None,
+                           bucket: Bucket = None, limit: int = Query(None, ge=1), cursor: str = None,
+                           accept: str = Header(None)):
+    """
+    Prices are ordered by time. With limit set at most limit prices are returned, growth is computed for them
+    and the cursor of the next page is sent in X-Next-Cursor header. With Accept: application/x-ndjson header
+    all prices are streamed as newline delimited JSON without growth.
+    Aggregated prices (bucket) are neither paginated nor streamed.
+    """
+    if bucket:
+        prices = await adb.select_offer_price_buckets(id, start, end, bucket)
+        return dict(prices=prices, growth=calculate_growth(prices, "open", "close"))
+
+    after = parse_cursor(cursor, (str, int))
+    if accept and NDJSON in accept:
+        chunks = adb.stream_offer_prices(id, start, end, after)
+        return StreamingResponse((to_ndjson(cleanup_prices(prices)) async for prices in chunks), media_type=NDJSON)
+
+    # (id, price, valid_from) tuples, the output dicts are the only ones built
+    rows = await adb.select_offer_prices(id, start, end, after, limit)
+    headers = {}
+    if next_page := next_cursor(rows, limit, (2, 0)):
+        headers["X-Next-Cursor"] = next_page
+    prices = [dict(price=price, valid_from=valid_from) for _, price, valid_from in rows]
+    return FastJSONResponse(dict(prices=prices, growth=calculate_growth(rows, 1, 1)), headers=headers)
+
+
+def parse_cursor(cursor: str | None, types: tuple) -> list | None:
+    """
+    Decodes cursor query param of an endpoint whose pagination key consists of values of given types.
+
+    raises:
+        HTTPException: Invalid cursor
+    """
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor, types)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 
-@app.on_event("startup")
-@repeat_every(seconds=60)
 def update_offers():
     """
-    Periodic task to update all offers.
+    Periodic task to update offers of products due for refresh, runs every UPDATER_TICK seconds.
     """
     log.debug("updating offers")
     try:
@@ -81,24 +485,11 @@ def update_offers():
 
 def _update_offers():
     """
-    First we have to list all products.
-    Then for each product:
-        - get new offers from API
-        - insert new offers into DB, update stock
-        - delete obsolete offers
-        - get all actual product offers
-        - compute prices to be inserted into DB by comparing actual product offers with offers from API
-        - insert computed prices into DB
-    """
-    product_ids = db.list_all_product_ids()
-    for product_id in product_ids:
-        api_offers = offers_api.get_offers(product_id)
-        db.insert_product_offers(product_id, api_offers)
-        db.delete_obsolete_product_offers(product_id, api_offers)
-        db_offers = db.select_product_offers(product_id)
-        prices_to_insert = compute_prices_to_insert(api_offers, db_offers)
-        db.insert_prices(prices_to_insert)
-
-
-def register_product(product: Product):
-    offers_api.register_product(product)
+    First we have to list products due for refresh.
+    Then the offers of many products are fetched concurrently and written into DB as they arrive.
+    See OffersUpdater for details. The sweep is profiled when asked for by POST /updater/profile.
+    """
+    profiled = profile_sweep.is_set()
+    profile_sweep.clear()
+    with timed(UPDATER_SWEEP), profiler.profile_threads("updater sweep", SWEEP_THREADS) if profiled else nullcontext():
+        updater.update_due()
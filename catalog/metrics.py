@@ -0,0 +1,110 @@
+import sys
+from time import perf_counter
+from contextlib import contextmanager
+from typing import Callable
+
+from prometheus_client import Histogram, Counter, CollectorRegistry, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Latency of HTTP requests until the response is sent",
+                            ["method", "route", "status"])
+QUERY_LATENCY = Histogram("db_query_duration_seconds", "Latency of DB queries including the connection checkout",
+                          ["layer", "query"])
+QUERY_ROWS = Counter("db_query_rows", "Rows fetched or affected by DB queries", ["layer", "query"])
+POOL_WAIT = Histogram("db_pool_wait_seconds", "Time waited for a free pooled DB connection", ["pool"],
+                      buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10))
+UPDATER_SWEEP = Histogram("updater_sweep_duration_seconds", "Duration of one periodic offers update sweep",
+                          buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+UPDATER_PHASE = Histogram("updater_phase_duration_seconds",
+                          "Duration of offers update phases: fetch of one product, diff of one product, "
+                          "sync of one batch", ["phase"])
+
+
+def caller_name(depth: int = 2) -> str:
+    """
+    Returns name of the function calling the function which calls caller_name,
+    i.e. name of the DB method running a query through one of the DB primitives.
+    """
+    return sys._getframe(depth).f_code.co_name
+
+
+def observe_query(layer: str, query: str, start: float, rows: int) -> float:
+    """
+    Records latency of a query started at perf_counter time start and number of its rows.
+    Returns the latency in seconds.
+    """
+    elapsed = perf_counter() - start
+    QUERY_LATENCY.labels(layer, query).observe(elapsed)
+    if rows > 0:
+        QUERY_ROWS.labels(layer, query).inc(rows)
+    return elapsed
+
+
+@contextmanager
+def timed(histogram: Histogram):
+    """
+    Observes duration of the block in given histogram (child).
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(perf_counter() - start)
+
+
+class PoolCollector:
+
+    def __init__(self, pools: Callable[[], dict]):
+        """
+        Exports connection pool counters as gauges at scrape time.
+
+        Args:
+            pools (Callable): returns dict mapping pool name to its catalog.pool.PoolStats,
+                              pools not created yet are left out
+        """
+        self._pools = pools
+
+    def collect(self):
+        gauges = {name: GaugeMetricFamily(f"db_pool_{name}", f"Connection pool {name.replace('_', ' ')}",
+                                          labels=["pool"])
+                  for name in ("size", "in_use", "waiting", "utilization", "timeouts", "rejected")}
+        for pool, stats in self._pools().items():
+            for name, value in stats.as_dict().items():
+                if name in gauges:
+                    gauges[name].add_metric([pool], value)
+        yield from gauges.values()
+
+    def register(self, registry: CollectorRegistry = REGISTRY) -> "PoolCollector":
+        registry.register(self)
+        return self
+
+
+class MetricsMiddleware:
+
+    def __init__(self, app):
+        """
+        ASGI middleware observing latency of each HTTP request labeled by its route template,
+        so /product/1 and /product/2 share one series. Streamed responses are timed until their last chunk.
+        """
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(scope["method"], route.path if route else "unmatched", status) \
+                .observe(perf_counter() - start)
@@ -1,3 +1,5 @@
+from enum import Enum
+
 from pydantic import BaseModel, Field
 
 
@@ -10,6 +12,23 @@ class Product(ProductNoId):
     id: int = Field(example=42)
 
 
+class BatchItemResult(BaseModel):
+    status: int = Field(example=201, description="HTTP status of the item, e.g. 201, 404 or 409")
+    product: Product | None = None
+    detail: str | None = Field(default=None, example="Product of this name already exists")
+
+
+class Bucket(str, Enum):
+    minute = "minute"
+    hour = "hour"
+    day = "day"
+    week = "week"
+
+
+# bucket length and alignment in seconds, unix epoch is Thursday so weeks are shifted to start on Monday
+bucket_seconds = {Bucket.minute: (60, 0), Bucket.hour: (3600, 0), Bucket.day: (86400, 0), Bucket.week: (604800, 345600)}
+
+
 product_not_found_response = {404: {"content": {"application/json": {"example": dict(detail="Product not found")}}}}
 product_conflict_response = {409: {"content": {"application/json": {"example": dict(detail="Product of this name already exists")}}}}
 delete_response = {200: {"content": {"application/json": {"example": ""}}},
@@ -18,5 +37,11 @@ delete_response = {200: {"content": {"application/json": {"example": ""}}},
 list_of_offers = {200: {"content": {"application/json": {"example": [dict(offer_id=11, product_id=23, price=17, items_in_stock=4),
                                                                      dict(offer_id=14, product_id=23, price=16, items_in_stock=27),
                                                                      dict(offer_id=27, product_id=23, price=15, items_in_stock=1)]}}}}
-prices = {200: {"content": {"application/json": {"example": {"prices": [14, 15, 10, 13, 12], "growth": -14.29}}}}}
-
+prices = {200: {"content": {"application/json": {"examples": {
+    "raw": {"value": {"prices": [{"price": 14, "valid_from": "2022-07-01T10:00:00"},
+                                 {"price": 12, "valid_from": "2022-07-01T10:01:00"}], "growth": -14.29}},
+    "bucket": {"value": {"prices": [{"valid_from": "2022-07-01T10:00:00", "open": 14, "high": 15, "low": 10,
+                                     "close": 12, "avg": 12.8, "count": 5}], "growth": -14.29}},
+}}}}}
+change_events = {200: {"content": {"text/event-stream": {"example": 'id: 1042\nevent: update\ndata: {"product_id":23,"offer_id":11,'
+                                                                   '"price":17,"items_in_stock":4,"created_at":"2022-07-01T10:00:00"}\n\n'}}}}
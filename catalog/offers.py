@@ -1,8 +1,12 @@
 from os import environ
+from time import monotonic, sleep
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 import logging
 
 from catalog.models import Product
+from catalog.resilience import TokenBucket, CircuitBreaker, CircuitOpen, LatencyStats, backoff_delay
 
 
 log = logging.getLogger()
@@ -10,28 +14,119 @@ log = logging.getLogger()
 
 class OffersApi:
 
-    def __init__(self, access_token: str):
+    def __init__(self, access_token: str, pool_size: int = 10):
         """
-        Takes base url from env var and creates session with given access token.
+        Takes base url and resilience settings from env vars and creates session with given access token.
+        The session keeps up to pool_size connections alive, callers beyond that wait for a free one.
+
+        OFFERS_API_CONNECT_TIMEOUT and OFFERS_API_READ_TIMEOUT bound each call in seconds.
+        OFFERS_API_RETRIES is the number of retries of a call failed by a connection error, timeout, 429 or 5xx,
+        retries wait for jittered exponential backoff starting at OFFERS_API_BACKOFF up to OFFERS_API_BACKOFF_MAX
+        seconds or for Retry-After sent by the API.
+        OFFERS_API_RATE limits calls per second of the whole process, 0 disables it, OFFERS_API_BURST is the
+        number of calls made at once after a quiet period.
+        After OFFERS_API_BREAKER_THRESHOLD consecutive failed calls no call is made for
+        OFFERS_API_BREAKER_RESET seconds.
         """
         self._base_url = environ["OFFERS_API_BASE_URL"]
+        self._timeout = (float(environ.get("OFFERS_API_CONNECT_TIMEOUT", 3.05)),
+                         float(environ.get("OFFERS_API_READ_TIMEOUT", 10)))
+        self._retries = int(environ.get("OFFERS_API_RETRIES", 3))
+        self._backoff = float(environ.get("OFFERS_API_BACKOFF", 0.5))
+        self._backoff_max = float(environ.get("OFFERS_API_BACKOFF_MAX", 10))
+        self._rate_limiter = TokenBucket(float(environ.get("OFFERS_API_RATE", 50)),
+                                         int(environ.get("OFFERS_API_BURST", pool_size)))
+        self._breaker = CircuitBreaker(int(environ.get("OFFERS_API_BREAKER_THRESHOLD", 5)),
+                                       float(environ.get("OFFERS_API_BREAKER_RESET", 30)))
+        self._latency = LatencyStats()
         self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
         self._session.headers.update(dict(Bearer=access_token))
 
+    def stats(self) -> dict:
+        """
+        Returns latency of the calls made and state of the circuit breaker.
+        """
+        return dict(latency=self._latency.as_dict(), circuit=self._breaker.state)
+
     def register_product(self, product: Product) -> None:
         """
         Registers given product in external offers API.
         """
-        response = self._session.post(url=f"{self._base_url}/products/register", json=dict(product))
-        response.raise_for_status()
+        self._request("POST", "/products/register", json=dict(product))
+
+    def register_products(self, products: list[Product], concurrency: int) -> dict[int, Exception]:
+        """
+        Registers given products in external offers API concurrently over the shared session.
+        Failed registrations are logged, the rest of the products is registered anyway.
+
+        Returns:
+            dict: maps id of each product which failed to register to its error
+        """
+        def register(product: Product) -> Exception | None:
+            try:
+                self.register_product(product)
+                return None
+            except (requests.RequestException, CircuitOpen) as err:
+                log.error("Can not register product %s: %r", product, err)
+                return err
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="offers-register") as pool:
+            errors = {product.id: error for product, error in zip(products, pool.map(register, products)) if error}
+        log.info("%d products registered, %d failed", len(products) - len(errors), len(errors))
+        return errors
 
     def get_offers(self, id: int) -> list[dict]:
         """
         Gets offers for registered product from external offers API.
         """
-        response = self._session.get(url=f"{self._base_url}/products/{id}/offers")
-        response.raise_for_status()
-        return response.json()
+        return self._request("GET", f"/products/{id}/offers").json()
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Makes the call with timeouts, rate limit, retries and circuit breaker.
+        Connection errors, timeouts, 429 and 5xx are retried and count as failures for the circuit breaker,
+        other error statuses are raised right away.
+
+        Raises:
+            requests.RequestException
+            CircuitOpen
+        """
+        for attempt in range(self._retries + 1):
+            self._breaker.check()
+            self._rate_limiter.acquire()
+            retry_after = 0.0
+            start = monotonic()
+            try:
+                response = self._session.request(method, f"{self._base_url}{path}", timeout=self._timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                self._latency.record(monotonic() - start, error=True)
+                error = err
+            else:
+                self._latency.record(monotonic() - start, error=not response.ok)
+                if response.status_code != 429 and response.status_code < 500:
+                    self._breaker.record_success()
+                    response.raise_for_status()
+                    return response
+                error = requests.HTTPError(f"{response.status_code} for {method} {path}", response=response)
+                retry_after = _retry_after(response)
+            self._breaker.record_failure()
+            if attempt < self._retries:
+                log.warning("Offers API %s %s failed: %r, retry %d", method, path, error, attempt + 1)
+                sleep(max(backoff_delay(attempt, self._backoff, self._backoff_max), retry_after))
+        raise error
+
+
+def _retry_after(response: requests.Response) -> float:
+    """
+    Returns seconds of Retry-After header, 0 when missing or given as a date.
+    """
+    try:
+        return float(response.headers.get("Retry-After", 0))
+    except ValueError:
+        return 0.0
 
 
 def get_access_token() -> str:
@@ -40,7 +135,9 @@ def get_access_token() -> str:
     It is not a part of OffersApi class because it needs to be called before OfferApi instance creation.
     """
     log.debug("Requesting new access token")
-    response = requests.post(url=f"{environ['OFFERS_API_BASE_URL']}/auth")
+    response = requests.post(url=f"{environ['OFFERS_API_BASE_URL']}/auth",
+                             timeout=(float(environ.get("OFFERS_API_CONNECT_TIMEOUT", 3.05)),
+                                      float(environ.get("OFFERS_API_READ_TIMEOUT", 10))))
     response.raise_for_status()
     access_token = response.json()["access_token"]
     log.debug("New access token %s received", access_token)
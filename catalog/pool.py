@@ -0,0 +1,182 @@
+import asyncio
+import threading
+from time import monotonic
+from contextlib import contextmanager, asynccontextmanager
+
+from catalog.metrics import POOL_WAIT
+
+
+class PoolExhausted(Exception):
+    """
+    No DB connection could be acquired in time or too many callers are already waiting for one.
+    """
+    def __init__(self, msg: str, retry_after: int):
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+
+class PoolStats:
+
+    def __init__(self, size: int):
+        """
+        Counters describing connection pool usage.
+        """
+        self.size = size
+        self.in_use = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def record_wait(self, wait_time: float) -> None:
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def as_dict(self) -> dict:
+        """
+        Returns the counters together with derived utilization and average wait time.
+        """
+        stats = dict(vars(self))
+        stats["utilization"] = self.in_use / self.size
+        stats["wait_time_avg"] = self.wait_time_total / self.acquired if self.acquired else 0.0
+        return stats
+
+
+class BoundedPool:
+
+    def __init__(self, pool, size: int, timeout: float, max_waiting: int, retry_after: int, name: str = "db"):
+        """
+        Wraps mysql.connector connection pool so callers wait for a free connection
+        instead of getting PoolError immediately.
+
+        Args:
+            pool                 : object with get_connection method returning connection of size sized pool
+            size           (int) : max number of connections checked out at once
+            timeout      (float) : max time in seconds a caller waits for a connection
+            max_waiting    (int) : max number of waiting callers, others are rejected right away
+            retry_after    (int) : seconds suggested to rejected callers
+            name           (str) : pool label of the exported wait time metric
+        """
+        self._pool = pool
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._timeout = timeout
+        self._max_waiting = max_waiting
+        self._retry_after = retry_after
+        self.stats = PoolStats(size)
+        self._wait_time = POOL_WAIT.labels(name)
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks out a connection for the duration of the block.
+
+        Raises:
+            PoolExhausted
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self.stats.waiting >= self._max_waiting:
+                    self.stats.rejected += 1
+                    raise PoolExhausted("Too many requests waiting for DB connection", self._retry_after)
+                self.stats.waiting += 1
+                self.stats.peak_waiting = max(self.stats.peak_waiting, self.stats.waiting)
+            start = monotonic()
+            acquired = self._slots.acquire(timeout=self._timeout)
+            wait_time = monotonic() - start
+            self._wait_time.observe(wait_time)
+            with self._lock:
+                self.stats.waiting -= 1
+                self.stats.record_wait(wait_time)
+                if not acquired:
+                    self.stats.timeouts += 1
+            if not acquired:
+                raise PoolExhausted("Timeout while waiting for DB connection", self._retry_after)
+        else:
+            self._wait_time.observe(0)
+
+        with self._lock:
+            self.stats.acquired += 1
+            self.stats.in_use += 1
+        try:
+            cnx = self._pool.get_connection()
+            try:
+                yield cnx
+            finally:
+                cnx.close()
+        finally:
+            with self._lock:
+                self.stats.in_use -= 1
+            self._slots.release()
+
+
+class AsyncBoundedPool:
+
+    def __init__(self, pool, size: int, timeout: float, max_waiting: int, retry_after: int, name: str = "db"):
+        """
+        Asyncio counterpart of BoundedPool wrapping aiomysql pool.
+        The pool itself waits for a free connection forever, this wrapper bounds the wait and the queue.
+
+        Args:
+            pool                 : object with acquire method returning connection of size sized pool
+            size           (int) : max number of connections checked out at once
+            timeout      (float) : max time in seconds a caller waits for a connection
+            max_waiting    (int) : max number of waiting callers, others are rejected right away
+            retry_after    (int) : seconds suggested to rejected callers
+            name           (str) : pool label of the exported wait time metric
+        """
+        self._pool = pool
+        self._slots = asyncio.Semaphore(size)
+        self._timeout = timeout
+        self._max_waiting = max_waiting
+        self._retry_after = retry_after
+        self.stats = PoolStats(size)
+        self._wait_time = POOL_WAIT.labels(name)
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        Checks out a connection for the duration of the block.
+
+        Raises:
+            PoolExhausted
+        """
+        if self._slots.locked():
+            if self.stats.waiting >= self._max_waiting:
+                self.stats.rejected += 1
+                raise PoolExhausted("Too many requests waiting for DB connection", self._retry_after)
+            self.stats.waiting += 1
+            self.stats.peak_waiting = max(self.stats.peak_waiting, self.stats.waiting)
+            start = monotonic()
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self._timeout)
+            except asyncio.TimeoutError:
+                self.stats.timeouts += 1
+                raise PoolExhausted("Timeout while waiting for DB connection", self._retry_after)
+            finally:
+                wait_time = monotonic() - start
+                self._wait_time.observe(wait_time)
+                self.stats.waiting -= 1
+                self.stats.record_wait(wait_time)
+        else:
+            self._wait_time.observe(0)
+            await self._slots.acquire()
+
+        self.stats.acquired += 1
+        self.stats.in_use += 1
+        try:
+            async with self._pool.acquire() as cnx:
+                yield cnx
+        finally:
+            self.stats.in_use -= 1
+            self._slots.release()
+
+    async def close(self) -> None:
+        """
+        Closes all connections of the wrapped pool.
+        """
+        self._pool.close()
+        await self._pool.wait_closed()
@@ -0,0 +1,362 @@
+import re
+import sys
+import random
+import asyncio
+import logging
+import threading
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+from os import environ
+from time import monotonic, perf_counter, sleep, time
+from typing import Callable, Iterable
+
+
+log = logging.getLogger()
+
+
+# statements MySQL can explain
+EXPLAINABLE = re.compile(r"\s*(SELECT|WITH|INSERT|REPLACE|UPDATE|DELETE)\b", re.IGNORECASE)
+# longest SQL text kept in the slow query log, lists of placeholders make queries long
+MAX_SQL_LENGTH = 2000
+# tasks of the profiled request, tasks created by them are profiled too, see Profiler.profile_request
+_request_tasks: ContextVar[set | None] = ContextVar("request_tasks", default=None)
+# frame and awaited object attributes of coroutines, async generators and generators
+COROUTINE_ATTRS = (("cr_frame", "cr_await"), ("ag_frame", "ag_await"), ("gi_frame", "gi_yieldfrom"))
+
+
+class SlowQueryLog:
+
+    def __init__(self, layer: str):
+        """
+        Keeps the last SLOW_QUERY_LOG_SIZE queries of the DB layer which took SLOW_QUERY_THRESHOLD seconds
+        or longer, 0 threshold disables the log. With SLOW_QUERY_EXPLAIN set to 1 the query plan of a slow
+        query is captured too, at most once per SLOW_QUERY_EXPLAIN_INTERVAL seconds for each DB method.
+        Only the number of query arguments is kept, never their values.
+        """
+        self._layer = layer
+        self.threshold = float(environ.get("SLOW_QUERY_THRESHOLD", 1))
+        self._explain = bool(int(environ.get("SLOW_QUERY_EXPLAIN", 0)))
+        self._explain_interval = float(environ.get("SLOW_QUERY_EXPLAIN_INTERVAL", 300))
+        self._entries = deque(maxlen=int(environ.get("SLOW_QUERY_LOG_SIZE", 100)))
+        self._explained = {}
+        self._lock = threading.Lock()
+
+    def is_slow(self, elapsed: float) -> bool:
+        return 0 < self.threshold <= elapsed
+
+    def should_explain(self, name: str, query: str) -> bool:
+        """
+        Returns whether plan of the slow query run by DB method name should be captured now.
+        """
+        if not self._explain or not EXPLAINABLE.match(query):
+            return False
+        now = monotonic()
+        with self._lock:
+            if now - self._explained.get(name, -self._explain_interval) < self._explain_interval:
+                return False
+            self._explained[name] = now
+        return True
+
+    def record(self, name: str, query: str, args_count: int, rows: int, elapsed: float, plan=None) -> None:
+        """
+        Logs the slow query and keeps it for entries.
+
+        Args:
+            name        (str): name of the DB method running the query
+            query       (str): SQL text
+            args_count  (int): number of query arguments, or of rows of executemany
+            rows        (int): number of rows fetched or affected
+            elapsed   (float): seconds the query took including the connection checkout
+            plan             : rows of EXPLAIN of the query or error message of it
+        """
+        sql = " ".join(query.split())[:MAX_SQL_LENGTH]
+        log.warning("Slow %s query %s took %.3f s, %d rows: %s", self._layer, name, elapsed, rows, sql)
+        entry = dict(at=time(), query=name, sql=sql, args=args_count, rows=rows, duration=elapsed)
+        if plan is not None:
+            entry["plan"] = plan
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self) -> list[dict]:
+        """
+        Returns the kept slow queries, the oldest first.
+        """
+        with self._lock:
+            return list(self._entries)
+
+
+def frame_name(frame) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+def thread_stack(frame, stop=None) -> list[str]:
+    """
+    Returns names of the frames of a running thread from the outermost one down to given frame.
+    With stop frame given the stack starts at it.
+    """
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        if frame is stop:
+            break
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+def coroutine_stack(coro) -> list[str]:
+    """
+    Returns names of the frames of a suspended coroutine from it down to the coroutine awaited at the bottom,
+    followed by the type of the object it waits for, e.g. [await FutureIter] of a pending socket read.
+    """
+    names = []
+    while coro is not None:
+        for frame_attr, await_attr in COROUTINE_ATTRS:
+            if hasattr(coro, frame_attr):
+                break
+        else:
+            names.append(f"[await {type(coro).__name__}]")
+            break
+        frame = getattr(coro, frame_attr)
+        if frame is None:
+            break
+        names.append(frame_name(frame))
+        coro = getattr(coro, await_attr)
+    return names
+
+
+class Profile:
+
+    def __init__(self, id: int, name: str):
+        """
+        Stacks sampled while something ran, counted in the collapsed format of flamegraph.pl,
+        which speedscope and most other flame graph viewers read as well.
+        """
+        self.id = id
+        self.name = name
+        self.started = time()
+        self.duration = None
+        self.samples = Counter()
+
+    def add(self, stack: list[str]) -> None:
+        if stack:
+            self.samples[";".join(stack)] += 1
+
+    def collapsed(self) -> str:
+        """
+        Returns one line per distinct stack: frames separated by semicolons, space and number of its samples.
+        """
+        return "".join(f"{stack} {samples}\n" for stack, samples in self.samples.most_common())
+
+    def summary(self) -> dict:
+        return dict(id=self.id, name=self.name, started=self.started, duration=self.duration,
+                    samples=sum(self.samples.values()))
+
+
+class StackSampler:
+
+    def __init__(self, interval: float):
+        """
+        Samples stacks of all running profiles every interval seconds from one daemon thread,
+        which runs only while some profile is running.
+        """
+        self._interval = interval
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, profile: Profile, sample: Callable[[dict], Iterable[list[str]]]) -> None:
+        """
+        Starts sampling into the profile. sample gets current frames of all threads, see sys._current_frames,
+        and returns the stacks to count.
+        """
+        with self._lock:
+            self._profiles[profile] = sample
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+
+    def stop(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.pop(profile, None)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._profiles:
+                    self._thread = None
+                    return
+                profiles = list(self._profiles.items())
+            frames = sys._current_frames()
+            for profile, sample in profiles:
+                try:
+                    for stack in sample(frames):
+                        profile.add(stack)
+                except Exception as err:
+                    # frames and coroutines change under the sampler, a broken sample is just left out
+                    log.debug("Can not sample profile %d: %r", profile.id, err)
+            del frames
+            sleep(self._interval)
+
+
+def sample_tasks(loop: asyncio.AbstractEventLoop, thread_id: int, tasks: set) -> Callable[[dict], list[list[str]]]:
+    """
+    Returns sample function of StackSampler counting wall clock time of the asyncio tasks running in the loop
+    of given thread. The task running at the moment is sampled from the thread stack, the others
+    from their suspended coroutines, so time spent waiting for the DB or the pool is sampled as well.
+    """
+    def sample(frames: dict) -> list[list[str]]:
+        current = asyncio.current_task(loop)
+        stacks = []
+        for task in list(tasks):
+            if task.done():
+                continue
+            coro = task.get_coro()
+            if task is current:
+                stacks.append(thread_stack(frames.get(thread_id), coro.cr_frame))
+            else:
+                stacks.append(coroutine_stack(coro))
+        return stacks
+    return sample
+
+
+def sample_threads(thread_ids: set[int], prefix: str) -> Callable[[dict], list[list[str]]]:
+    """
+    Returns sample function of StackSampler counting stacks of given threads and of threads whose name
+    starts with prefix, e.g. the thread pools of a sweep. Each stack starts with the thread name
+    without the number of the pool thread.
+    """
+    def sample(frames: dict) -> list[list[str]]:
+        stacks = []
+        for thread in threading.enumerate():
+            if thread.ident in frames and (thread.ident in thread_ids or thread.name.startswith(prefix)):
+                stacks.append([re.sub(r"_\d+$", "", thread.name), *thread_stack(frames[thread.ident])])
+        return stacks
+    return sample
+
+
+class Profiler:
+
+    def __init__(self):
+        """
+        Samples stacks every PROFILE_INTERVAL seconds of requests asking for it by X-Profile: 1 header
+        when PROFILE_HEADER is 1, of PROFILE_SAMPLE_RATE fraction of all requests and of updater sweeps
+        on demand. Keeps the last PROFILE_KEEP profiles.
+        """
+        self._header = bool(int(environ.get("PROFILE_HEADER", 0)))
+        self._sample_rate = float(environ.get("PROFILE_SAMPLE_RATE", 0))
+        self._sampler = StackSampler(float(environ.get("PROFILE_INTERVAL", 0.005)))
+        self._profiles = OrderedDict()
+        self._keep = int(environ.get("PROFILE_KEEP", 100))
+        self._ids = count(1)
+        self._lock = threading.Lock()
+
+    def wants(self, headers: Iterable[tuple[bytes, bytes]]) -> bool:
+        """
+        Returns whether the request with given raw ASGI headers is profiled.
+        """
+        if self._header and (b"x-profile", b"1") in headers:
+            return True
+        return self._sample_rate > 0 and random.random() < self._sample_rate
+
+    def get(self, id: int) -> Profile | None:
+        with self._lock:
+            return self._profiles.get(id)
+
+    def profiles(self) -> list[dict]:
+        """
+        Returns summaries of the kept profiles, the newest first.
+        """
+        with self._lock:
+            return [profile.summary() for profile in reversed(self._profiles.values())]
+
+    @contextmanager
+    def profile_request(self, name: str):
+        """
+        Profiles the current asyncio task and the tasks it creates for the duration of the block,
+        e.g. the body of a streamed response. Must be entered in the task handling the request.
+
+        Yields:
+            Profile: filled in while the block runs
+        """
+        loop = asyncio.get_running_loop()
+        if not isinstance(loop.get_task_factory(), TaskFactory):
+            loop.set_task_factory(TaskFactory(loop.get_task_factory()))
+        tasks = {asyncio.current_task()}
+        token = _request_tasks.set(tasks)
+        try:
+            with self._profile(name, sample_tasks(loop, threading.get_ident(), tasks)) as profile:
+                yield profile
+        finally:
+            _request_tasks.reset(token)
+
+    @contextmanager
+    def profile_threads(self, name: str, prefix: str):
+        """
+        Profiles the current thread and the threads whose name starts with prefix for the duration of the block.
+
+        Yields:
+            Profile: filled in while the block runs
+        """
+        with self._profile(name, sample_threads({threading.get_ident()}, prefix)) as profile:
+            yield profile
+
+    @contextmanager
+    def _profile(self, name: str, sample: Callable[[dict], Iterable[list[str]]]):
+        with self._lock:
+            profile = Profile(next(self._ids), name)
+            self._profiles[profile.id] = profile
+            while len(self._profiles) > self._keep:
+                self._profiles.popitem(last=False)
+        start = perf_counter()
+        self._sampler.start(profile, sample)
+        try:
+            yield profile
+        finally:
+            self._sampler.stop(profile)
+            profile.duration = perf_counter() - start
+
+
+class TaskFactory:
+
+    def __init__(self, factory: Callable = None):
+        """
+        Task factory of the event loop adding tasks created by a profiled request to its profile,
+        see Profiler.profile_request. Wraps the factory installed before, if any.
+        """
+        self._factory = factory
+
+    def __call__(self, loop: asyncio.AbstractEventLoop, coro, **kwargs) -> asyncio.Task:
+        if self._factory is None:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        else:
+            task = self._factory(loop, coro, **kwargs)
+        tasks = _request_tasks.get()
+        if tasks is not None:
+            tasks.add(task)
+        return task
+
+
+class ProfilerMiddleware:
+
+    def __init__(self, app, profiler: Profiler):
+        """
+        ASGI middleware profiling requests picked by the profiler. The id of the profile is sent
+        in X-Profile-Id response header, the profile is then available at /profiles/{id}.
+        """
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.wants(scope["headers"]):
+            return await self.app(scope, receive, send)
+
+        with self.profiler.profile_request(f"{scope['method']} {scope['path']}") as profile:
+            async def send_profile_id(message):
+                if message["type"] == "http.response.start":
+                    message["headers"] = [*message.get("headers", []), (b"x-profile-id", str(profile.id).encode())]
+                await send(message)
+
+            await self.app(scope, receive, send_profile_id)
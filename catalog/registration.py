@@ -0,0 +1,102 @@
+import logging
+from os import environ
+
+import requests
+
+from catalog.db import ProductCatalogDB
+from catalog.offers import OffersApi
+from catalog.updater import OffersUpdater
+from catalog.models import Product
+from catalog.resilience import backoff_delay
+
+
+log = logging.getLogger()
+
+
+def error_status(error: Exception) -> int | None:
+    """
+    Returns HTTP status of the offers API response which caused the error, None for other errors.
+    """
+    response = getattr(error, "response", None)
+    return response.status_code if isinstance(error, requests.HTTPError) and response is not None else None
+
+
+class RegistrationDrainer:
+
+    def __init__(self, db: ProductCatalogDB, offers_api: OffersApi, updater: OffersUpdater = None):
+        """
+        Registers products waiting in the product_registration outbox in the offers service.
+        Products get into the outbox by a trigger in the same transaction they are inserted in,
+        so no registration is lost when the process dies or the offers service is down.
+
+        REGISTRATION_BATCH_SIZE products are claimed at once and registered by up to OFFERS_API_CONCURRENCY calls
+        at once. A claimed batch not finished within REGISTRATION_CLAIM_TTL seconds is claimed again.
+        Failed registrations are retried after jittered exponential backoff starting at REGISTRATION_BACKOFF
+        up to REGISTRATION_BACKOFF_MAX seconds, products rejected by the offers service by a 4xx status are dropped.
+        With updater given offers of registered products are fetched right away, after the running step
+        of a sweep has finished, see OffersUpdater.update_products. Sweeps skip products in the outbox,
+        so registered products leave it only after that and their offers are not fetched before registration.
+        """
+        self._db = db
+        self._offers_api = offers_api
+        self._updater = updater
+        self._batch_size = int(environ.get("REGISTRATION_BATCH_SIZE", 100))
+        self._concurrency = int(environ.get("OFFERS_API_CONCURRENCY", 8))
+        self._claim_ttl = int(environ.get("REGISTRATION_CLAIM_TTL", 60))
+        self._backoff = float(environ.get("REGISTRATION_BACKOFF", 1))
+        self._backoff_max = float(environ.get("REGISTRATION_BACKOFF_MAX", 300))
+        self._stats = dict(registered=0, retried=0, rejected=0)
+
+    def run(self) -> None:
+        """
+        Drains the outbox, errors are logged.
+        """
+        try:
+            self.drain()
+        except Exception as err:
+            log.error("Product registration failed: %r", err)
+
+    def drain(self) -> int:
+        """
+        Registers claimed batches until no product is due for registration.
+        Returns number of products processed.
+        """
+        processed = 0
+        while products := self._db.claim_registrations(self._batch_size, self._claim_ttl):
+            self._register(products)
+            processed += len(products)
+            if len(products) < self._batch_size:
+                break
+        return processed
+
+    def stats(self) -> dict:
+        """
+        Returns numbers of products registered, scheduled for retry and rejected by the offers service since start.
+        """
+        return dict(self._stats)
+
+    def _register(self, products: list[dict]) -> None:
+        errors = self._offers_api.register_products([Product(id=product["id"], name=product["name"],
+                                                             description=product["description"])
+                                                     for product in products], self._concurrency)
+        registered, rejected, retries = [], [], {}
+        for product in products:
+            error = errors.get(product["id"])
+            status = error_status(error) if error else None
+            # conflict means an earlier attempt got through but was not recorded
+            if error is None or status == 409:
+                registered.append(product["id"])
+            elif status is not None and 400 <= status < 500 and status != 429:
+                log.error("Product %d rejected by offers service: %r", product["id"], error)
+                rejected.append(product["id"])
+            else:
+                retries[product["id"]] = backoff_delay(product["attempts"] - 1, self._backoff, self._backoff_max)
+
+        if retries:
+            self._db.retry_registrations(retries)
+        if self._updater and registered:
+            self._updater.update_products(registered)
+        self._db.delete_registrations(registered + rejected)
+        self._stats["registered"] += len(registered)
+        self._stats["retried"] += len(retries)
+        self._stats["rejected"] += len(rejected)
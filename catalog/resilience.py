@@ -0,0 +1,144 @@
+import random
+import threading
+from collections import deque
+from time import monotonic, sleep
+
+
+class CircuitOpen(Exception):
+    """
+    Call was not made because the circuit breaker is open.
+    """
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    Returns exponential backoff delay with full jitter for given zero based retry attempt,
+    i.e. random number between 0 and min(cap, base * 2 ** attempt).
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: int):
+        """
+        Limits the rate of calls shared by all threads.
+
+        Args:
+            rate  (float): tokens added per second, 0 disables the limit
+            burst   (int): max number of tokens, i.e. calls made at once after a quiet period
+        """
+        self._rate = rate
+        self._burst = max(burst, 1)
+        self._tokens = float(self._burst)
+        self._updated_at = monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Takes one token, blocks until it is available.
+        """
+        if self._rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._tokens = min(self._burst, self._tokens + (now - self._updated_at) * self._rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate
+            sleep(wait)
+
+
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        """
+        Stops calling failing upstream for a while.
+        After failure_threshold consecutive failures the circuit opens and calls fail fast with CircuitOpen.
+        When reset_timeout seconds pass, a single trial call is let through. Its success closes the circuit,
+        its failure opens it again.
+
+        Args:
+            failure_threshold   (int): consecutive failures opening the circuit
+            reset_timeout     (float): seconds the circuit stays open before the trial call
+        """
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._trial or monotonic() - self._opened_at >= self._reset_timeout:
+                return "half-open"
+            return "open"
+
+    def check(self) -> None:
+        """
+        Lets the call through or raises CircuitOpen.
+
+        Raises:
+            CircuitOpen
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if not self._trial and monotonic() - self._opened_at >= self._reset_timeout:
+                self._trial = True
+                return
+            raise CircuitOpen("Circuit breaker is open")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self._failure_threshold:
+                self._opened_at = monotonic()
+                self._trial = False
+
+
+class LatencyStats:
+
+    def __init__(self, window: int = 1000):
+        """
+        Thread safe latency counters. Percentiles are computed from the last window calls.
+        """
+        self._samples = deque(maxlen=window)
+        self._count = 0
+        self._errors = 0
+        self._total = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, error: bool = False) -> None:
+        with self._lock:
+            self._samples.append(latency)
+            self._count += 1
+            self._errors += error
+            self._total += latency
+            self._max = max(self._max, latency)
+
+    def as_dict(self) -> dict:
+        """
+        Returns number of calls and failed calls, average, max, p50 and p99 latency in seconds.
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+            stats = dict(count=self._count, errors=self._errors, max=self._max,
+                         avg=self._total / self._count if self._count else 0.0)
+        stats["p50"] = samples[int(0.5 * (len(samples) - 1))] if samples else 0.0
+        stats["p99"] = samples[int(0.99 * (len(samples) - 1))] if samples else 0.0
+        return stats
@@ -0,0 +1,126 @@
+import time
+import logging
+from os import environ
+
+from catalog.db import ProductCatalogDB
+
+
+log = logging.getLogger()
+
+
+DAY = 86400
+
+
+def partitions_to_add(last_bound: int, now: float, ahead: int) -> list[int]:
+    """
+    Returns bounds of daily partitions to split off the MAXVALUE partition, so partitions exist
+    for the next ahead days. The first new partition starts at the last bound and may span more days
+    when the job has not run for a while.
+
+    Args:
+        last_bound  (int): bound of the last partition before the MAXVALUE one
+        now       (float): current UNIX timestamp
+        ahead       (int): number of days to prepare partitions for
+    """
+    today = int(now) // DAY * DAY
+    first = max(last_bound // DAY * DAY + DAY, today + DAY)
+    return list(range(first, today + (ahead + 1) * DAY + 1, DAY))
+
+
+def expired_partitions(partitions: list[dict], cutoff: int) -> list[dict]:
+    """
+    Returns partitions ending at or before cutoff UNIX timestamp, each extended by start,
+    the bound of the previous partition or 0 for the first one.
+    """
+    expired = []
+    start = 0
+    for partition in partitions:
+        if partition["bound"] is None or partition["bound"] > cutoff:
+            break
+        expired.append(dict(partition, start=start))
+        start = partition["bound"]
+    return expired
+
+
+class PriceRetention:
+
+    def __init__(self, db: ProductCatalogDB):
+        """
+        Keeps the price history bounded. Table price is range partitioned by day of created_at.
+        Each run, at most once per PRICE_RETENTION_INTERVAL seconds:
+            - splits daily partitions for the next PRICE_PARTITIONS_AHEAD days off the MAXVALUE partition
+            - rolls partitions older than PRICE_RAW_DAYS days up into hourly and daily rollups, moves the raw_since
+              boundary the readers switch to rollups at and drops the partitions
+            - moves the hourly_since boundary PRICE_HOURLY_DAYS days back and deletes older hourly rollups,
+              daily rollups are kept forever
+        PRICE_RAW_DAYS or PRICE_HOURLY_DAYS set to 0 keeps the resolution forever.
+        Only one process runs the job at a time, see price_retention_lock.
+        """
+        self._db = db
+        self._raw_days = int(environ.get("PRICE_RAW_DAYS", 30))
+        self._hourly_days = int(environ.get("PRICE_HOURLY_DAYS", 365))
+        self._ahead = int(environ.get("PRICE_PARTITIONS_AHEAD", 7))
+        self._interval = float(environ.get("PRICE_RETENTION_INTERVAL", 3600))
+        self._delete_batch = 10000
+        self._run_at = 0.0
+
+    def run_due(self) -> None:
+        """
+        Runs the job if PRICE_RETENTION_INTERVAL seconds have passed since the last run.
+        """
+        if time.monotonic() < self._run_at:
+            return
+        self._run_at = time.monotonic() + self._interval
+        try:
+            self.run()
+        except Exception as err:
+            log.error("Price retention failed: %r", err)
+
+    def run(self, now: float = None) -> None:
+        now = time.time() if now is None else now
+        with self._db.price_retention_lock() as locked:
+            if not locked:
+                log.debug("Price retention is run by another process")
+                return
+            partitions = self._db.select_price_partitions()
+            if not partitions:
+                log.warning("Table price is not partitioned, run migration 007_price_retention.sql")
+                return
+            today = int(now) // DAY * DAY
+            self._add_partitions(partitions, now)
+            if self._raw_days:
+                self._expire_raw(partitions, today - self._raw_days * DAY)
+            if self._hourly_days:
+                self._expire_hourly(today - max(self._hourly_days, self._raw_days) * DAY)
+
+    def _add_partitions(self, partitions: list[dict], now: float) -> None:
+        bounds = [partition["bound"] for partition in partitions if partition["bound"] is not None]
+        new_bounds = partitions_to_add(max(bounds, default=0), now, self._ahead)
+        if new_bounds:
+            self._db.add_price_partitions(new_bounds)
+
+    def _expire_raw(self, partitions: list[dict], cutoff: int) -> None:
+        """
+        Rolls up and drops partitions ending before cutoff. The boundary is moved before the drop,
+        so readers never look for raw prices which are not there anymore.
+        """
+        for partition in expired_partitions(partitions, cutoff):
+            self._db.rollup_price_partition(partition["name"], partition["start"], partition["bound"])
+            self._db.update_price_retention(raw_since=partition["bound"])
+            self._db.drop_price_partition(partition["name"])
+
+    def _expire_hourly(self, cutoff: int) -> None:
+        """
+        Deletes hourly rollups older than cutoff, their days are already rolled up into daily rollups.
+        """
+        retention = self._db.select_price_retention()
+        cutoff = min(cutoff, retention["raw_since"])
+        if cutoff <= retention["hourly_since"]:
+            return
+        self._db.update_price_retention(hourly_since=cutoff)
+        deleted = 0
+        while (rowcount := self._db.delete_hourly_prices(cutoff, self._delete_batch)) > 0:
+            deleted += rowcount
+            if rowcount < self._delete_batch:
+                break
+        log.info("%d hourly prices deleted", deleted)
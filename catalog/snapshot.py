@@ -0,0 +1,66 @@
+from array import array
+from bisect import bisect_right
+from os import environ
+
+from catalog.cache import LRUCache
+
+
+class ProductOffers:
+
+    __slots__ = ("product_id", "ids", "prices", "stocks")
+
+    def __init__(self, product_id: int, offers: list[dict]):
+        """
+        Immutable snapshot of the priced offers of one product, kept in parallel arrays of 64-bit ints
+        ordered by offer id instead of one dict per offer. Offers without price are left out
+        as the API never shows them.
+
+        Args:
+            product_id   (int): id of the product
+            offers      (list): dicts with offer_id, price and items_in_stock keys
+        """
+        priced = sorted((offer for offer in offers if offer["price"]), key=lambda offer: offer["offer_id"])
+        self.product_id = product_id
+        self.ids = array("q", [offer["offer_id"] for offer in priced])
+        self.prices = array("q", [offer["price"] for offer in priced])
+        self.stocks = array("q", [offer["items_in_stock"] for offer in priced])
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def select(self, on_stock: bool = True, after: list = None, limit: int = None) -> list[dict]:
+        """
+        Returns offers the same way as the offers endpoint does, ordered by offer id.
+        With limit set at most limit offers following the offer id in after key are returned.
+        """
+        min_stock = 1 if on_stock else 0
+        offers = []
+        for i in range(bisect_right(self.ids, after[0]) if after else 0, len(self.ids)):
+            if self.stocks[i] < min_stock:
+                continue
+            offers.append(dict(offer_id=self.ids[i], product_id=self.product_id,
+                               price=self.prices[i], items_in_stock=self.stocks[i]))
+            if limit and len(offers) == limit:
+                break
+        return offers
+
+
+class OffersSnapshot(LRUCache):
+
+    def __init__(self):
+        """
+        Current priced offers of up to OFFERS_SNAPSHOT_SIZE products, each kept for at most
+        OFFERS_SNAPSHOT_TTL seconds, 0 size disables the snapshot. Written through by the updater of this process
+        after each synced batch and filled from DB on a miss. The offers of a product are replaced at once
+        by a new ProductOffers, so readers never see a half updated product.
+        Products changed by other processes are dropped by the change feed every process runs,
+        see AsyncProductCatalogDB.invalidate_product_offers.
+        """
+        super().__init__(maxsize=int(environ.get("OFFERS_SNAPSHOT_SIZE", 100000)),
+                         ttl=float(environ.get("OFFERS_SNAPSHOT_TTL", 30)))
+
+    def put(self, product_id: int, offers: list[dict]) -> None:
+        """
+        Replaces offers of the product by the given current ones.
+        """
+        self.set(product_id, ProductOffers(product_id, offers))
@@ -0,0 +1,171 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os import environ
+
+from catalog.db import ProductCatalogDB, chunks
+from catalog.offers import OffersApi
+from catalog.lease import ShardLease
+from catalog.snapshot import OffersSnapshot
+from catalog.common import next_refresh_interval, offers_digest
+from catalog.metrics import UPDATER_PHASE, timed
+
+
+log = logging.getLogger()
+
+
+# name prefix of the fetch and sync threads of due sweeps, targeted updates run in other threads
+SWEEP_THREADS = "offers-sweep-"
+
+
+class OffersUpdater:
+
+    def __init__(self, db: ProductCatalogDB, offers_api: OffersApi, lease: ShardLease = None,
+                 offers_snapshot: OffersSnapshot = None):
+        """
+        Takes the concurrency limits from env vars.
+        With lease given only products of shards leased by this process are updated,
+        so multiple processes split the products among themselves.
+        With offers snapshot given the offers of each synced product are written through into it.
+
+        UPDATER_CONCURRENCY limits the number of offers API calls running at once.
+        UPDATER_DB_WORKERS limits the number of batches being written into DB at once,
+        it must not exceed the size of the ProductCatalogDB connection pool.
+        UPDATER_BATCH_SIZE is the number of products synchronized in one DB transaction.
+        UPDATER_MAX_DUE is the max number of products updated in one sweep.
+        REFRESH_MIN_INTERVAL and REFRESH_MAX_INTERVAL bound the refresh interval of a product in seconds.
+        """
+        self._db = db
+        self._offers_api = offers_api
+        self._lease = lease
+        self._offers_snapshot = offers_snapshot
+        self._concurrency = int(environ.get("UPDATER_CONCURRENCY", 8))
+        self._db_workers = int(environ.get("UPDATER_DB_WORKERS", 2))
+        self._batch_size = int(environ.get("UPDATER_BATCH_SIZE", 100))
+        self._max_due = int(environ.get("UPDATER_MAX_DUE", 10000))
+        self._min_interval = int(environ.get("REFRESH_MIN_INTERVAL", 30))
+        self._max_interval = int(environ.get("REFRESH_MAX_INTERVAL", 3600))
+        self._stats = dict(fetched=0, skipped=0, synced=0, failed=0)
+        self._stats_lock = threading.Lock()
+        # steps of the periodic sweep and targeted updates run in different threads, one at a time
+        self._update_lock = threading.Lock()
+
+    def update_due(self) -> None:
+        """
+        Updates offers of products whose next refresh time has come, see select_due_products.
+        With lease only products of leased shards are updated.
+
+        Offers of up to UPDATER_CONCURRENCY products are fetched from the offers API at once.
+        Fetched offers are collected into batches and as soon as a batch is full it is handed over
+        to the DB workers, so fetching and writing overlap.
+        Products whose offers payload has the same digest as the last synced one skip the DB sync.
+        Each synced batch gets its refresh intervals adapted to whether the prices have changed.
+        Products whose offers could not be fetched or synced or were skipped are rescheduled as unchanged,
+        so they back off.
+        Failure of one product or batch is logged and does not stop the rest of the sweep.
+
+        The sweep runs in steps of UPDATER_DB_WORKERS batches, each holding the update lock,
+        so targeted updates wait for one step only, see update_products.
+        """
+        if self._lease:
+            due = self._db.select_due_products(self._max_due, self._lease.acquire(), self._lease.shards)
+        else:
+            due = self._db.select_due_products(self._max_due)
+        for step in chunks(list(due), self._batch_size * self._db_workers):
+            with self._update_lock:
+                self._update({product_id: due[product_id] for product_id in step}, SWEEP_THREADS)
+
+    def update_products(self, product_ids: list[int]) -> None:
+        """
+        Updates offers of given products right away regardless of their refresh schedule and of the shard lease,
+        e.g. of products just registered in the offers service. Waits for the running step of a sweep to finish,
+        so the DB workers of both never compete for the connection pool nor sync the same product at once.
+        See update_due.
+        """
+        with self._update_lock:
+            self._update(self._db.select_products_refresh(product_ids), "offers-targeted-")
+
+    def _update(self, due: dict[int, dict], threads: str) -> None:
+        """
+        Fetches and syncs offers of given products, see update_due. Has to be called with the update lock held.
+
+        Args:
+            due     (dict): maps product id to its refresh interval and offers digest, see select_due_products
+            threads  (str): name prefix of the fetch and sync threads, so profiles tell sweeps from other updates
+        """
+        failed, skipped, digests = {}, {}, {}
+        with ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix=f"{threads}fetch") as fetch_pool, \
+                ThreadPoolExecutor(max_workers=self._db_workers, thread_name_prefix=f"{threads}sync") as db_pool:
+            fetches = {fetch_pool.submit(self._fetch_offers, product_id): product_id for product_id in due}
+            syncs = {}
+            batch = {}
+            for future in as_completed(fetches):
+                product_id = fetches[future]
+                if self._lease:
+                    self._lease.keep_alive()
+                try:
+                    api_offers = future.result()
+                except Exception as err:
+                    failed[product_id] = self._next_interval(due[product_id]["interval_s"], False)
+                    log.error("Can not fetch offers of product %d: %r", product_id, err)
+                    continue
+                digests[product_id] = offers_digest(api_offers)
+                if digests[product_id] == due[product_id]["offers_digest"]:
+                    skipped[product_id] = self._next_interval(due[product_id]["interval_s"], False)
+                    continue
+                batch[product_id] = api_offers
+                if len(batch) >= self._batch_size:
+                    syncs[db_pool.submit(self._sync_batch, batch, due, digests)] = batch
+                    batch = {}
+            if batch:
+                syncs[db_pool.submit(self._sync_batch, batch, due, digests)] = batch
+
+            failed_syncs = {}
+            for future in as_completed(syncs):
+                try:
+                    future.result()
+                except Exception as err:
+                    failed_syncs |= {product_id: self._next_interval(due[product_id]["interval_s"], False)
+                                     for product_id in syncs[future]}
+                    log.error("Can not update offers of products %s: %r", list(syncs[future]), err)
+
+        self._db.update_refresh_schedule(failed | skipped | failed_syncs)
+        synced = len(due) - len(failed) - len(skipped) - len(failed_syncs)
+        with self._stats_lock:
+            self._stats["fetched"] += len(due) - len(failed)
+            self._stats["skipped"] += len(skipped)
+            self._stats["synced"] += synced
+            self._stats["failed"] += len(failed) + len(failed_syncs)
+        log.debug("%d products synced, %d unchanged skipped, %d failed",
+                  synced, len(skipped), len(failed) + len(failed_syncs))
+
+    def stats(self) -> dict:
+        """
+        Returns numbers of products fetched, skipped as unchanged, synced and failed since start
+        and the ratio of fetched products which skipped the DB sync.
+        """
+        stats = dict(self._stats)
+        stats["skip_ratio"] = stats["skipped"] / stats["fetched"] if stats["fetched"] else 0.0
+        return stats
+
+    def _fetch_offers(self, product_id: int) -> list[dict]:
+        with timed(UPDATER_PHASE.labels("fetch")):
+            return self._offers_api.get_offers(product_id)
+
+    def _sync_batch(self, api_offers: dict[int, list[dict]], due: dict[int, dict], digests: dict[int, bytes]) -> None:
+        """
+        Syncs offers of the batch, adapts refresh intervals of its products and stores digests of the synced offers.
+        The offers snapshot gets the committed offers.
+        """
+        with timed(UPDATER_PHASE.labels("sync")):
+            changed, current = self._db.sync_offers(api_offers)
+        if self._offers_snapshot is not None:
+            for product_id, offers in current.items():
+                self._offers_snapshot.put(product_id, offers)
+        self._db.update_refresh_schedule({product_id: self._next_interval(due[product_id]["interval_s"],
+                                                                          product_id in changed)
+                                          for product_id in api_offers},
+                                         {product_id: digests[product_id] for product_id in api_offers})
+
+    def _next_interval(self, interval: int, changed: bool) -> int:
+        return next_refresh_interval(interval, changed, self._min_interval, self._max_interval)
@@ -34,6 +34,138 @@ CREATE TABLE `price` (
     `offer_id` INT UNSIGNED NOT NULL COMMENT 'multiple prices belongs to unique offer',
     `price` INT NOT NULL COMMENT 'price of the offer, a unit should be specified, lets say it is EUR, I think it should be FLOAT but the given data model says INT',
     `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT 'price creation time',
-    PRIMARY KEY (`id`),
+    PRIMARY KEY (`id`, `created_at`),
+    KEY `offer_created` (`offer_id`, `created_at`)
+) COMMENT='offer prices, partitioned by day of created_at, partitioned tables can not have foreign keys so prices of deleted offers are left until their partition is dropped'
+PARTITION BY RANGE (UNIX_TIMESTAMP(`created_at`)) (
+    -- daily partitions are split from pmax ahead of time by the price retention job, see catalog.retention
+    PARTITION `p0` VALUES LESS THAN (946684800),
+    PARTITION `pmax` VALUES LESS THAN MAXVALUE
+);
+
+CREATE TABLE `price_hourly` (
+    `offer_id` INT UNSIGNED NOT NULL,
+    `hour` TIMESTAMP NOT NULL COMMENT 'start of the hour',
+    `open` INT NOT NULL COMMENT 'first price of the hour',
+    `high` INT NOT NULL,
+    `low` INT NOT NULL,
+    `close` INT NOT NULL COMMENT 'last price of the hour',
+    `avg` DOUBLE NOT NULL,
+    `count` INT UNSIGNED NOT NULL COMMENT 'number of prices of the hour',
+    PRIMARY KEY (`offer_id`, `hour`),
+    KEY (`hour`),
+    FOREIGN KEY (`offer_id`) REFERENCES `offer`(`id`) ON DELETE CASCADE
+) COMMENT='hourly rollup of prices older than the raw price retention window';
+
+CREATE TABLE `price_daily` (
+    `offer_id` INT UNSIGNED NOT NULL,
+    `day` TIMESTAMP NOT NULL COMMENT 'start of the UTC day',
+    `open` INT NOT NULL COMMENT 'first price of the day',
+    `high` INT NOT NULL,
+    `low` INT NOT NULL,
+    `close` INT NOT NULL COMMENT 'last price of the day',
+    `avg` DOUBLE NOT NULL,
+    `count` INT UNSIGNED NOT NULL COMMENT 'number of prices of the day',
+    PRIMARY KEY (`offer_id`, `day`),
     FOREIGN KEY (`offer_id`) REFERENCES `offer`(`id`) ON DELETE CASCADE
-) COMMENT='offer prices';
\ No newline at end of file
+) COMMENT='daily rollup of prices, kept forever';
+
+CREATE TABLE `price_retention` (
+    `id` TINYINT UNSIGNED NOT NULL,
+    `raw_since` TIMESTAMP NOT NULL COMMENT 'raw prices older than this were rolled up and dropped',
+    `hourly_since` TIMESTAMP NOT NULL COMMENT 'hourly rollups older than this were deleted',
+    PRIMARY KEY (`id`)
+) COMMENT='single row with the boundaries of price history resolutions';
+
+INSERT INTO `price_retention` (`id`, `raw_since`, `hourly_since`) VALUES (1, FROM_UNIXTIME(1), FROM_UNIXTIME(1));
+
+CREATE TABLE `offer_current_price` (
+    `offer_id` INT UNSIGNED NOT NULL,
+    `price_id` INT UNSIGNED NOT NULL COMMENT 'id of the latest price of the offer',
+    `price` INT NOT NULL COMMENT 'latest price of the offer',
+    PRIMARY KEY (`offer_id`),
+    FOREIGN KEY (`offer_id`) REFERENCES `offer`(`id`) ON DELETE CASCADE
+) COMMENT='latest price of each offer, maintained by price_after_insert trigger';
+
+CREATE TRIGGER `price_after_insert` AFTER INSERT ON `price` FOR EACH ROW
+    INSERT INTO `offer_current_price` (`offer_id`, `price_id`, `price`)
+    VALUES (NEW.`offer_id`, NEW.`id`, NEW.`price`)
+    ON DUPLICATE KEY UPDATE
+        `price`=IF(VALUES(`price_id`) > `price_id`, VALUES(`price`), `price`),
+        `price_id`=GREATEST(`price_id`, VALUES(`price_id`));
+
+CREATE TABLE `cache_version` (
+    `name` VARCHAR(32) NOT NULL COMMENT 'name of the cached entity',
+    `version` BIGINT UNSIGNED NOT NULL DEFAULT 0 COMMENT 'bumped on every change of the entity',
+    PRIMARY KEY (`name`)
+) COMMENT='version counters used for invalidation of in-process caches across processes';
+
+INSERT INTO `cache_version` (`name`) VALUES ('product');
+
+CREATE TABLE `updater_worker` (
+    `worker` VARCHAR(100) NOT NULL COMMENT 'host:pid:random id of updater process',
+    `heartbeat_at` TIMESTAMP NOT NULL COMMENT 'last heartbeat of the process',
+    PRIMARY KEY (`worker`)
+) COMMENT='live updater processes';
+
+CREATE TABLE `updater_shard` (
+    `shard` INT UNSIGNED NOT NULL COMMENT 'product belongs to shard id % number of shards',
+    `worker` VARCHAR(100) NULL COMMENT 'updater process holding the lease',
+    `lease_until` TIMESTAMP NULL COMMENT 'lease expiration',
+    PRIMARY KEY (`shard`),
+    KEY (`worker`)
+) COMMENT='leases of product shards updated by updater processes';
+
+CREATE TABLE `product_refresh` (
+    `product_id` INT UNSIGNED NOT NULL,
+    `interval_s` INT UNSIGNED NOT NULL COMMENT 'current refresh interval in seconds, 0 for never refreshed product',
+    `next_refresh_at` TIMESTAMP NOT NULL COMMENT 'time of the next offers refresh',
+    `offers_digest` BINARY(16) NULL COMMENT 'digest of the last synced offers payload, NULL for never synced product',
+    PRIMARY KEY (`product_id`),
+    KEY (`next_refresh_at`),
+    FOREIGN KEY (`product_id`) REFERENCES `product`(`id`) ON DELETE CASCADE
+) COMMENT='offers refresh schedule of products, rows are created by product_after_insert trigger';
+
+CREATE TRIGGER `product_after_insert` AFTER INSERT ON `product` FOR EACH ROW
+    INSERT INTO `product_refresh` (`product_id`, `interval_s`, `next_refresh_at`) VALUES (NEW.`id`, 0, NOW());
+
+CREATE TABLE `product_registration` (
+    `product_id` INT UNSIGNED NOT NULL,
+    `attempts` INT UNSIGNED NOT NULL DEFAULT 0 COMMENT 'number of registration attempts started so far',
+    `next_attempt_at` TIMESTAMP NOT NULL COMMENT 'time of the next attempt, pushed ahead while an attempt runs',
+    PRIMARY KEY (`product_id`),
+    KEY (`next_attempt_at`),
+    FOREIGN KEY (`product_id`) REFERENCES `product`(`id`) ON DELETE CASCADE
+) COMMENT='products not registered in the offers service yet, rows are created by product_after_insert_registration trigger';
+
+CREATE TRIGGER `product_after_insert_registration` AFTER INSERT ON `product` FOR EACH ROW FOLLOWS `product_after_insert`
+    INSERT INTO `product_registration` (`product_id`, `next_attempt_at`) VALUES (NEW.`id`, NOW());
+
+CREATE TRIGGER `product_after_update` AFTER UPDATE ON `product` FOR EACH ROW
+    UPDATE `cache_version` SET `version`=`version` + 1
+    WHERE `name`='product'
+      AND (BINARY NEW.`name` <> BINARY OLD.`name` OR BINARY NEW.`description` <> BINARY OLD.`description`);
+
+CREATE TRIGGER `product_after_delete` AFTER DELETE ON `product` FOR EACH ROW
+    UPDATE `cache_version` SET `version`=`version` + 1 WHERE `name`='product';
+
+CREATE TABLE `change_sequence` (
+    `id` TINYINT UNSIGNED NOT NULL,
+    `seq` BIGINT UNSIGNED NOT NULL COMMENT 'sequence number of the last logged change',
+    PRIMARY KEY (`id`)
+) COMMENT='single row counter of change_log sequence numbers, locked by each logging transaction until its commit';
+
+INSERT INTO `change_sequence` (`id`, `seq`) VALUES (1, 0);
+
+CREATE TABLE `change_log` (
+    `id` BIGINT UNSIGNED NOT NULL COMMENT 'sequence number taken from change_sequence',
+    `product_id` INT UNSIGNED NOT NULL,
+    `offer_id` INT UNSIGNED NOT NULL,
+    `kind` ENUM('new', 'update', 'removed') NOT NULL,
+    `price` INT NULL COMMENT 'current price, NULL for removed offer',
+    `items_in_stock` INT NULL COMMENT 'current number of items in stock, NULL for removed offer',
+    `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (`id`),
+    KEY (`product_id`, `id`),
+    KEY (`created_at`)
+) COMMENT='offer changes made by the updater, read by the change feed, trimmed after CHANGE_LOG_RETENTION seconds';
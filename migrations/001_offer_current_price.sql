@@ -0,0 +1,27 @@
+-- Materializes the latest price of each offer so offer reads do not need the correlated max(id) subquery.
+
+USE product_catalog_db;
+
+CREATE TABLE `offer_current_price` (
+    `offer_id` INT UNSIGNED NOT NULL,
+    `price_id` INT UNSIGNED NOT NULL COMMENT 'id of the latest price of the offer',
+    `price` INT NOT NULL COMMENT 'latest price of the offer',
+    PRIMARY KEY (`offer_id`),
+    FOREIGN KEY (`offer_id`) REFERENCES `offer`(`id`) ON DELETE CASCADE
+) COMMENT='latest price of each offer, maintained by price_after_insert trigger';
+
+CREATE TRIGGER `price_after_insert` AFTER INSERT ON `price` FOR EACH ROW
+    INSERT INTO `offer_current_price` (`offer_id`, `price_id`, `price`)
+    VALUES (NEW.`offer_id`, NEW.`id`, NEW.`price`)
+    ON DUPLICATE KEY UPDATE
+        `price`=IF(VALUES(`price_id`) > `price_id`, VALUES(`price`), `price`),
+        `price_id`=GREATEST(`price_id`, VALUES(`price_id`));
+
+-- backfill, prices inserted meanwhile by the trigger win thanks to the price_id comparison
+INSERT INTO `offer_current_price` (`offer_id`, `price_id`, `price`)
+    SELECT p.`offer_id`, p.`id`, p.`price`
+    FROM `price` AS p JOIN (SELECT `offer_id`, max(`id`) AS `id` FROM `price` GROUP BY `offer_id`) AS latest
+        ON p.`id`=latest.`id`
+    ON DUPLICATE KEY UPDATE
+        `price`=IF(VALUES(`price_id`) > `offer_current_price`.`price_id`, VALUES(`price`), `offer_current_price`.`price`),
+        `price_id`=GREATEST(`offer_current_price`.`price_id`, VALUES(`price_id`));
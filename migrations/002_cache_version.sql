@@ -0,0 +1,11 @@
+-- Shared version counter used for invalidation of product caches across application processes.
+
+USE product_catalog_db;
+
+CREATE TABLE `cache_version` (
+    `name` VARCHAR(32) NOT NULL COMMENT 'name of the cached entity',
+    `version` BIGINT UNSIGNED NOT NULL DEFAULT 0 COMMENT 'bumped on every change of the entity',
+    PRIMARY KEY (`name`)
+) COMMENT='version counters used for invalidation of in-process caches across processes';
+
+INSERT IGNORE INTO `cache_version` (`name`) VALUES ('product');
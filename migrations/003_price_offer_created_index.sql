@@ -0,0 +1,5 @@
+-- Composite index for price history range scans and time bucket aggregation of one offer.
+
+USE product_catalog_db;
+
+ALTER TABLE `price` ADD KEY `offer_created` (`offer_id`, `created_at`);
@@ -0,0 +1,17 @@
+-- Lease based split of products among updater processes.
+
+USE product_catalog_db;
+
+CREATE TABLE `updater_worker` (
+    `worker` VARCHAR(100) NOT NULL COMMENT 'host:pid:random id of updater process',
+    `heartbeat_at` TIMESTAMP NOT NULL COMMENT 'last heartbeat of the process',
+    PRIMARY KEY (`worker`)
+) COMMENT='live updater processes';
+
+CREATE TABLE `updater_shard` (
+    `shard` INT UNSIGNED NOT NULL COMMENT 'product belongs to shard id % number of shards',
+    `worker` VARCHAR(100) NULL COMMENT 'updater process holding the lease',
+    `lease_until` TIMESTAMP NULL COMMENT 'lease expiration',
+    PRIMARY KEY (`shard`),
+    KEY (`worker`)
+) COMMENT='leases of product shards updated by updater processes';
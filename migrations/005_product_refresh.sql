@@ -0,0 +1,17 @@
+-- Adaptive per product offers refresh schedule.
+
+USE product_catalog_db;
+
+CREATE TABLE `product_refresh` (
+    `product_id` INT UNSIGNED NOT NULL,
+    `interval_s` INT UNSIGNED NOT NULL COMMENT 'current refresh interval in seconds, 0 for never refreshed product',
+    `next_refresh_at` TIMESTAMP NOT NULL COMMENT 'time of the next offers refresh',
+    PRIMARY KEY (`product_id`),
+    KEY (`next_refresh_at`),
+    FOREIGN KEY (`product_id`) REFERENCES `product`(`id`) ON DELETE CASCADE
+) COMMENT='offers refresh schedule of products, rows are created by product_after_insert trigger';
+
+CREATE TRIGGER `product_after_insert` AFTER INSERT ON `product` FOR EACH ROW
+    INSERT INTO `product_refresh` (`product_id`, `interval_s`, `next_refresh_at`) VALUES (NEW.`id`, 0, NOW());
+
+INSERT IGNORE INTO `product_refresh` (`product_id`, `interval_s`, `next_refresh_at`) SELECT `id`, 0, NOW() FROM `product`;
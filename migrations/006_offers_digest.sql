@@ -0,0 +1,7 @@
+-- Digest of the last synced offers payload, unchanged payloads skip the DB sync.
+
+USE product_catalog_db;
+
+ALTER TABLE `product_refresh`
+    ADD COLUMN `offers_digest` BINARY(16) NULL COMMENT 'digest of the last synced offers payload, NULL for never synced product'
+    AFTER `next_refresh_at`;
@@ -0,0 +1,52 @@
+-- Time partitioning of prices with hourly and daily rollups of old prices, see catalog.retention.
+
+USE product_catalog_db;
+
+-- partitioned tables can not have foreign keys and the partitioning column has to be part of the primary key
+ALTER TABLE `price` DROP FOREIGN KEY `price_ibfk_1`;
+ALTER TABLE `price` DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `created_at`),
+    COMMENT='offer prices, partitioned by day of created_at, partitioned tables can not have foreign keys so prices of deleted offers are left until their partition is dropped';
+
+-- existing prices stay in p0 ending at the start of the current UTC day, the retention job splits pmax later on
+SET @partition = CONCAT('ALTER TABLE `price` PARTITION BY RANGE (UNIX_TIMESTAMP(`created_at`)) (',
+                        'PARTITION `p0` VALUES LESS THAN (', UNIX_TIMESTAMP() DIV 86400 * 86400, '), ',
+                        'PARTITION `pmax` VALUES LESS THAN MAXVALUE)');
+PREPARE partition_price FROM @partition;
+EXECUTE partition_price;
+DEALLOCATE PREPARE partition_price;
+
+CREATE TABLE `price_hourly` (
+    `offer_id` INT UNSIGNED NOT NULL,
+    `hour` TIMESTAMP NOT NULL COMMENT 'start of the hour',
+    `open` INT NOT NULL COMMENT 'first price of the hour',
+    `high` INT NOT NULL,
+    `low` INT NOT NULL,
+    `close` INT NOT NULL COMMENT 'last price of the hour',
+    `avg` DOUBLE NOT NULL,
+    `count` INT UNSIGNED NOT NULL COMMENT 'number of prices of the hour',
+    PRIMARY KEY (`offer_id`, `hour`),
+    KEY (`hour`),
+    FOREIGN KEY (`offer_id`) REFERENCES `offer`(`id`) ON DELETE CASCADE
+) COMMENT='hourly rollup of prices older than the raw price retention window';
+
+CREATE TABLE `price_daily` (
+    `offer_id` INT UNSIGNED NOT NULL,
+    `day` TIMESTAMP NOT NULL COMMENT 'start of the UTC day',
+    `open` INT NOT NULL COMMENT 'first price of the day',
+    `high` INT NOT NULL,
+    `low` INT NOT NULL,
+    `close` INT NOT NULL COMMENT 'last price of the day',
+    `avg` DOUBLE NOT NULL,
+    `count` INT UNSIGNED NOT NULL COMMENT 'number of prices of the day',
+    PRIMARY KEY (`offer_id`, `day`),
+    FOREIGN KEY (`offer_id`) REFERENCES `offer`(`id`) ON DELETE CASCADE
+) COMMENT='daily rollup of prices, kept forever';
+
+CREATE TABLE `price_retention` (
+    `id` TINYINT UNSIGNED NOT NULL,
+    `raw_since` TIMESTAMP NOT NULL COMMENT 'raw prices older than this were rolled up and dropped',
+    `hourly_since` TIMESTAMP NOT NULL COMMENT 'hourly rollups older than this were deleted',
+    PRIMARY KEY (`id`)
+) COMMENT='single row with the boundaries of price history resolutions';
+
+INSERT INTO `price_retention` (`id`, `raw_since`, `hourly_since`) VALUES (1, FROM_UNIXTIME(1), FROM_UNIXTIME(1));
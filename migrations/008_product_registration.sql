@@ -0,0 +1,15 @@
+-- Outbox of products waiting for registration in the offers service, filled in the transaction inserting the product.
+
+USE product_catalog_db;
+
+CREATE TABLE `product_registration` (
+    `product_id` INT UNSIGNED NOT NULL,
+    `attempts` INT UNSIGNED NOT NULL DEFAULT 0 COMMENT 'number of registration attempts started so far',
+    `next_attempt_at` TIMESTAMP NOT NULL COMMENT 'time of the next attempt, pushed ahead while an attempt runs',
+    PRIMARY KEY (`product_id`),
+    KEY (`next_attempt_at`),
+    FOREIGN KEY (`product_id`) REFERENCES `product`(`id`) ON DELETE CASCADE
+) COMMENT='products not registered in the offers service yet, rows are created by product_after_insert_registration trigger';
+
+CREATE TRIGGER `product_after_insert_registration` AFTER INSERT ON `product` FOR EACH ROW FOLLOWS `product_after_insert`
+    INSERT INTO `product_registration` (`product_id`, `next_attempt_at`) VALUES (NEW.`id`, NOW());
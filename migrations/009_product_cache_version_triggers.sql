@@ -0,0 +1,11 @@
+-- Product changes bump the product cache version in the statement changing the product, no extra round trip.
+
+USE product_catalog_db;
+
+CREATE TRIGGER `product_after_update` AFTER UPDATE ON `product` FOR EACH ROW
+    UPDATE `cache_version` SET `version`=`version` + 1
+    WHERE `name`='product'
+      AND (BINARY NEW.`name` <> BINARY OLD.`name` OR BINARY NEW.`description` <> BINARY OLD.`description`);
+
+CREATE TRIGGER `product_after_delete` AFTER DELETE ON `product` FOR EACH ROW
+    UPDATE `cache_version` SET `version`=`version` + 1 WHERE `name`='product';
@@ -0,0 +1,24 @@
+-- Log of offer changes streamed to subscribers of the change feed.
+
+USE product_catalog_db;
+
+CREATE TABLE `change_sequence` (
+    `id` TINYINT UNSIGNED NOT NULL,
+    `seq` BIGINT UNSIGNED NOT NULL COMMENT 'sequence number of the last logged change',
+    PRIMARY KEY (`id`)
+) COMMENT='single row counter of change_log sequence numbers, locked by each logging transaction until its commit';
+
+INSERT INTO `change_sequence` (`id`, `seq`) VALUES (1, 0);
+
+CREATE TABLE `change_log` (
+    `id` BIGINT UNSIGNED NOT NULL COMMENT 'sequence number taken from change_sequence',
+    `product_id` INT UNSIGNED NOT NULL,
+    `offer_id` INT UNSIGNED NOT NULL,
+    `kind` ENUM('new', 'update', 'removed') NOT NULL,
+    `price` INT NULL COMMENT 'current price, NULL for removed offer',
+    `items_in_stock` INT NULL COMMENT 'current number of items in stock, NULL for removed offer',
+    `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (`id`),
+    KEY (`product_id`, `id`),
+    KEY (`created_at`)
+) COMMENT='offer changes made by the updater, read by the change feed, trimmed after CHANGE_LOG_RETENTION seconds';
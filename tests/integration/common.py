@@ -20,6 +20,9 @@ def insert_into_db(query_list):
 def clear_db():
     cursor = db_cnx.cursor()
     cursor.execute('DELETE FROM product')
+    # price is partitioned so it has no foreign key cascading the delete
+    cursor.execute('DELETE FROM price')
+    cursor.execute('UPDATE price_retention SET raw_since=FROM_UNIXTIME(1), hourly_since=FROM_UNIXTIME(1)')
     db_cnx.commit()
 
 
@@ -0,0 +1,27 @@
+import requests
+
+from common import insert_into_db, clear_db, BASE_URL
+
+
+def teardown_function():
+    clear_db()
+
+
+def test_post_batch():
+    insert_into_db(["INSERT INTO product (service_id, name, description) VALUES (1, 'rum', 'different description')", ])
+    products = [dict(name="pivo", description="Velkopopovicky Kozel"), dict(name="rum", description="Bozkov")]
+    response = requests.post(url=f"{BASE_URL}/products/batch", json=products)
+    assert response.status_code == 200
+    inserted, conflict = response.json()
+    assert inserted["status"] == 201
+    assert type(inserted["product"].pop("id")) is int
+    assert inserted["product"] == products[0]
+    assert conflict == dict(status=409, product=None, detail="Product of this name already exists")
+
+
+def test_get_batch():
+    insert_into_db(["INSERT INTO product (id, service_id, name, description) VALUES (42, 1, 'pivo', 'Kozel')", ])
+    response = requests.get(url=f"{BASE_URL}/products", params=dict(ids="42,43"))
+    assert response.status_code == 200
+    assert response.json() == [dict(status=200, product=dict(id=42, name="pivo", description="Kozel"), detail=None),
+                               dict(status=404, product=None, detail="Product not found")]
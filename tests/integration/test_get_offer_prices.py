@@ -38,3 +38,69 @@ def test_success_time_frame():
     assert response.status_code == 200
     prices = [dict(price=17, valid_from='2022-01-02T00:00:00'), dict(price=14, valid_from='2022-01-03T00:00:00')]
     assert response.json() == dict(prices=prices, growth=-17.65)
+
+
+def test_success_week_buckets():
+    sqls = ["INSERT INTO product VALUES (42, 1, 'name', 'description')",
+            "INSERT INTO offer VALUES (7, 42, 11, 5)",
+            "INSERT INTO price (offer_id, price, created_at) "
+            "VALUES (7, 13, '2022-01-01'), (7, 17, '2022-01-02'), (7, 14, '2022-01-03'), (7, 11, '2022-01-04')"]
+    insert_into_db(sqls)
+    response = requests.get(url=f"{BASE_URL}/offer/7/prices", params=dict(bucket="week"))
+    assert response.status_code == 200
+    prices = [dict(valid_from='2021-12-27T00:00:00', open=13, high=17, low=13, close=17, avg=15.0, count=2),
+              dict(valid_from='2022-01-03T00:00:00', open=14, high=14, low=11, close=11, avg=12.5, count=2)]
+    assert response.json() == dict(prices=prices, growth=-15.38)
+
+
+def test_success_pagination():
+    sqls = ["INSERT INTO product VALUES (42, 1, 'name', 'description')",
+            "INSERT INTO offer VALUES (7, 42, 11, 5)",
+            "INSERT INTO price (offer_id, price, created_at) "
+            "VALUES (7, 13, '2022-01-01'), (7, 17, '2022-01-02'), (7, 14, '2022-01-03'), (7, 11, '2022-01-04')"]
+    insert_into_db(sqls)
+    response = requests.get(url=f"{BASE_URL}/offer/7/prices", params=dict(limit=3))
+    assert response.status_code == 200
+    prices = [dict(price=13, valid_from='2022-01-01T00:00:00'),
+              dict(price=17, valid_from='2022-01-02T00:00:00'),
+              dict(price=14, valid_from='2022-01-03T00:00:00')]
+    assert response.json() == dict(prices=prices, growth=7.69)
+
+    params = dict(limit=3, cursor=response.headers["X-Next-Cursor"])
+    response = requests.get(url=f"{BASE_URL}/offer/7/prices", params=params)
+    assert response.status_code == 200
+    assert response.json() == dict(prices=[dict(price=11, valid_from='2022-01-04T00:00:00')], growth=0.0)
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_success_ndjson():
+    sqls = ["INSERT INTO product VALUES (42, 1, 'name', 'description')",
+            "INSERT INTO offer VALUES (7, 42, 11, 5)",
+            "INSERT INTO price (offer_id, price, created_at) VALUES (7, 13, '2022-01-01'), (7, 17, '2022-01-02')"]
+    insert_into_db(sqls)
+    response = requests.get(url=f"{BASE_URL}/offer/7/prices", headers=dict(Accept="application/x-ndjson"))
+    assert response.status_code == 200
+    assert response.text == ('{"price":13,"valid_from":"2022-01-01T00:00:00"}\n'
+                             '{"price":17,"valid_from":"2022-01-02T00:00:00"}\n')
+
+
+def test_success_rollups():
+    sqls = ["INSERT INTO product VALUES (42, 1, 'name', 'description')",
+            "INSERT INTO offer VALUES (7, 42, 11, 5)",
+            "INSERT INTO price_daily VALUES (7, '2021-12-31', 10, 12, 9, 12, 11.0, 3)",
+            "INSERT INTO price_hourly VALUES (7, '2022-01-01 05:00', 13, 15, 13, 15, 14.0, 2)",
+            "INSERT INTO price (offer_id, price, created_at) VALUES (7, 14, '2022-01-03'), (7, 11, '2022-01-04')",
+            "UPDATE price_retention SET raw_since='2022-01-02', hourly_since='2022-01-01'"]
+    insert_into_db(sqls)
+    response = requests.get(url=f"{BASE_URL}/offer/7/prices")
+    assert response.status_code == 200
+    prices = [dict(price=10, valid_from='2021-12-31T00:00:00'),
+              dict(price=13, valid_from='2022-01-01T05:00:00'),
+              dict(price=14, valid_from='2022-01-03T00:00:00'),
+              dict(price=11, valid_from='2022-01-04T00:00:00')]
+    assert response.json() == dict(prices=prices, growth=10.0)
+
+    response = requests.get(url=f"{BASE_URL}/offer/7/prices", params=dict(bucket="week"))
+    prices = [dict(valid_from='2021-12-27T00:00:00', open=10, high=15, low=9, close=15, avg=12.2, count=5),
+              dict(valid_from='2022-01-03T00:00:00', open=14, high=14, low=11, close=11, avg=12.5, count=2)]
+    assert response.json() == dict(prices=prices, growth=10.0)
@@ -0,0 +1,285 @@
+import os
+import sys
+import time
+import asyncio
+from pathlib import Path
+from contextlib import asynccontextmanager
+
+import pymysql
+from fastapi import HTTPException
+
+sys.path.append(str(Path(os.path.dirname(__file__)).parents[1]))
+
+from catalog.aiodb import AsyncProductCatalogDB
+from catalog.models import ProductNoId
+
+
+class FakeTransactionCursor:
+    lastrowid = 0
+
+    def __init__(self, db):
+        self._db = db
+
+    async def execute(self, query, args=()):
+        self._db.queries.append(query)
+        self._db.args.append(args)
+        if query.startswith("UPDATE change_sequence"):
+            self.lastrowid = 100 + args[0]
+        return 1
+
+    async def fetchall(self):
+        return [(11,), (12,)]
+
+
+class FakeAsyncProductCatalogDB(AsyncProductCatalogDB):
+    def __init__(self):
+        super().__init__(service_id=1)
+        self.queries = []
+        self.args = []
+
+    @asynccontextmanager
+    async def _transaction(self):
+        yield FakeTransactionCursor(self)
+
+    async def _select_one(self, query, args=(), primary=False):
+        if "cache_version" in query:
+            return dict(version=1)
+        self.queries.append(query)
+        return dict(id=args["id"], name="pivo", description="Kozel")
+
+    async def _execute(self, query, args=()):
+        self.queries.append(query)
+        return 1
+
+    async def _insert(self, query, args=()):
+        self.queries.append(query)
+        return 0 if args["name"] == "taken" else 7
+
+
+def test_select_product_is_cached():
+    adb = FakeAsyncProductCatalogDB()
+    assert asyncio.run(adb.select_product(42)) == dict(id=42, name="pivo", description="Kozel")
+    assert asyncio.run(adb.select_product(42)) == dict(id=42, name="pivo", description="Kozel")
+    assert len(adb.queries) == 1
+    assert adb.product_cache.stats() == dict(hits=1, misses=1, size=1)
+
+
+def test_insert_product_takes_one_round_trip_and_caches_stored_product():
+    adb = FakeAsyncProductCatalogDB()
+    asyncio.run(adb.select_product(7))
+    # the same product already stored, differing in case only
+    assert asyncio.run(adb.insert_product(ProductNoId(name="PIVO", description="kozel"))) == 7
+    assert len(adb.queries) == 2
+    assert asyncio.run(adb.select_product(7)) == dict(id=7, name="pivo", description="Kozel")
+    try:
+        asyncio.run(adb.insert_product(ProductNoId(name="taken", description="Kozel")))
+        assert False, "conflict expected"
+    except HTTPException as err:
+        assert err.status_code == 409
+
+
+class BatchDB(FakeAsyncProductCatalogDB):
+    async def _select_all(self, query, args=(), primary=False):
+        self.args.append(args)
+        # the DB finds the stored product by its name and compares descriptions by the column collation
+        return [dict(i=0, id=7, name="pivo", description="Kozel", same=1),
+                dict(i=1, id=7, name="pivo", description="Kozel", same=1),
+                dict(i=2, id=8, name="rum", description="Božkov", same=0)]
+
+
+def test_insert_products_lets_db_compare_products():
+    adb = BatchDB()
+    products = [ProductNoId(name="pivo", description="Kozel"), ProductNoId(name="PIVO", description="kozel"),
+                ProductNoId(name="rum", description="Bozkov")]
+    results = asyncio.run(adb.insert_products(products))
+    assert adb.args[-1] == [0, "Kozel", "pivo", 1, "kozel", "PIVO", 2, "Bozkov", "rum"]
+    assert results[0] == results[1] == dict(status=201, product=dict(id=7, name="pivo", description="Kozel"))
+    assert results[2]["status"] == 409
+    assert adb.product_cache.get(8) is None
+
+
+def test_update_product_updates_cache():
+    adb = FakeAsyncProductCatalogDB()
+    asyncio.run(adb.select_product(42))
+    asyncio.run(adb.update_product(42, ProductNoId(name="rum", description="Božkov")))
+    assert asyncio.run(adb.select_product(42)) == dict(id=42, name="rum", description="Božkov")
+
+
+def test_delete_product_invalidates_cache():
+    adb = FakeAsyncProductCatalogDB()
+    asyncio.run(adb.select_product(42))
+    asyncio.run(adb.delete_product(42))
+    asyncio.run(adb.select_product(42))
+    assert adb.product_cache.stats()["misses"] == 2
+
+
+class FakeOffersDB(FakeAsyncProductCatalogDB):
+    async def _select_all(self, query, args=(), primary=False):
+        self.queries.append(query)
+        return [dict(offer_id=2, product_id=42, foreign_id=12, price=11, items_in_stock=0),
+                dict(offer_id=1, product_id=42, foreign_id=11, price=17, items_in_stock=5),
+                dict(offer_id=3, product_id=42, foreign_id=13, price=None, items_in_stock=3)]
+
+
+def test_select_product_offers_fills_snapshot():
+    adb = FakeOffersDB()
+    assert asyncio.run(adb.select_product_offers(42)) == [dict(offer_id=1, product_id=42, price=17, items_in_stock=5)]
+    assert asyncio.run(adb.select_product_offers(42, on_stock=False)) == [
+        dict(offer_id=1, product_id=42, price=17, items_in_stock=5),
+        dict(offer_id=2, product_id=42, price=11, items_in_stock=0)]
+    assert len(adb.queries) == 1
+    asyncio.run(adb.delete_product(42))
+    assert adb.offers_snapshot.get(42) is None
+
+
+def test_delete_product_logs_removed_offers():
+    adb = FakeAsyncProductCatalogDB()
+    asyncio.run(adb.delete_product(42))
+    assert adb.queries[1] == "DELETE FROM product WHERE id=%s"
+    assert adb.args[2] == [2]
+    assert adb.args[3] == [101, 42, 11, "removed", 102, 42, 12, "removed"]
+
+
+class PrimaryOffersDB(FakeAsyncProductCatalogDB):
+    def __init__(self):
+        super().__init__()
+        self.primary = []
+        self.on_select = None
+
+    async def _select_all(self, query, args=(), primary=False):
+        self.primary.append(primary)
+        if self.on_select:
+            self.on_select()
+        return [dict(offer_id=1, product_id=42, foreign_id=11, price=17, items_in_stock=5)]
+
+
+def test_offers_invalidated_by_change_feed_are_read_from_primary(monkeypatch):
+    monkeypatch.setenv("MYSQL_REPLICA_MAX_LAG", "5")
+    adb = PrimaryOffersDB()
+    asyncio.run(adb.select_product_offers(42))
+    adb.invalidate_product_offers({42})
+    assert adb.offers_snapshot.get(42) is None
+    asyncio.run(adb.select_product_offers(42))
+    asyncio.run(adb.select_product_offers(42))
+    assert adb.primary == [False, True]
+
+
+def test_offers_invalidated_while_loading_do_not_fill_snapshot():
+    adb = PrimaryOffersDB()
+    adb.on_select = lambda: adb.invalidate_product_offers([42])
+    assert len(asyncio.run(adb.select_product_offers(42))) == 1
+    assert adb.offers_snapshot.get(42) is None
+
+
+class FakeCursor:
+    def __init__(self, pool):
+        self._pool = pool
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def execute(self, query, args=()):
+        if self._pool.error:
+            raise pymysql.err.OperationalError(2003, "Can't connect")
+        self._pool.queries.append(query)
+
+    async def fetchone(self):
+        if self._pool.queries[-1] == "SHOW REPLICA STATUS":
+            return dict(Seconds_Behind_Source=self._pool.lag)
+        return dict(pool=self._pool.name)
+
+    async def fetchall(self):
+        return [dict(pool=self._pool.name)]
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self._pool = pool
+
+    def cursor(self, *args):
+        return FakeCursor(self._pool)
+
+
+class FakePool:
+    def __init__(self, name, lag=0, error=False):
+        self.name, self.lag, self.error, self.queries = name, lag, error, []
+
+    @asynccontextmanager
+    async def connection(self):
+        yield FakeConnection(self)
+
+
+def replicated_db(*replicas):
+    adb = AsyncProductCatalogDB(service_id=1)
+    adb._pool = FakePool("primary")
+    adb._replica_hosts = [replica.name for replica in replicas]
+    adb._replicas = list(replicas)
+    adb._replica_healthy = [True] * len(replicas)
+    return adb
+
+
+def test_reads_are_spread_over_replicas():
+    adb = replicated_db(FakePool("r1"), FakePool("r2"))
+    pools = [asyncio.run(adb._select_one("SELECT 1"))["pool"] for _ in range(4)]
+    assert sorted(pools) == ["r1", "r1", "r2", "r2"]
+    assert asyncio.run(adb._select_one("SELECT 1", primary=True))["pool"] == "primary"
+
+
+def test_lagging_replica_is_left_out():
+    adb = replicated_db(FakePool("r1", lag=60), FakePool("r2", lag=None))
+    assert asyncio.run(adb._select_one("SELECT 1"))["pool"] == "primary"
+
+
+def test_failed_replica_read_falls_back_to_primary():
+    adb = replicated_db(FakePool("r1"))
+    adb._replica_checked_at = time.monotonic()
+    adb._replicas[0].error = True
+    assert asyncio.run(adb._select_one("SELECT 1"))["pool"] == "primary"
+    adb._replicas[0].error = False
+    assert asyncio.run(adb._select_one("SELECT 1"))["pool"] == "primary"
+
+
+def test_slow_query_is_kept_with_plan_read_from_primary(monkeypatch):
+    monkeypatch.setenv("SLOW_QUERY_THRESHOLD", "0.000001")
+    monkeypatch.setenv("SLOW_QUERY_EXPLAIN", "1")
+    adb = replicated_db(FakePool("r1"))
+    adb._replica_checked_at = time.monotonic()
+
+    async def select_something(arg):
+        return await adb._select_one("SELECT %s", [arg])
+
+    asyncio.run(select_something(1))
+    asyncio.run(select_something(2))
+    assert adb._pool.queries == ["EXPLAIN SELECT %s"]
+    first, second = adb.slow_queries.entries()
+    assert first["query"] == second["query"] == "select_something"
+    assert first["sql"] == "SELECT %s" and first["args"] == 1 and first["rows"] == 1
+    assert first["plan"] == [dict(pool="primary")] and "plan" not in second
+
+
+class VersionedDB(AsyncProductCatalogDB):
+    def __init__(self):
+        super().__init__(service_id=1)
+        self.version = 1
+        self.reads = []
+
+    async def _select_one(self, query, args=(), primary=False):
+        self.reads.append((query.split()[1], primary))
+        if "cache_version" in query:
+            return dict(version=self.version)
+        return dict(id=args["id"], name="pivo", description="Kozel")
+
+
+def test_product_cache_version_is_read_from_primary_and_reload_too(monkeypatch):
+    monkeypatch.setenv("PRODUCT_CACHE_VERSION_CHECK", "0.000001")
+    monkeypatch.setenv("MYSQL_REPLICA_MAX_LAG", "0.05")
+    adb = VersionedDB()
+    asyncio.run(adb.select_product(42))
+    assert adb.reads == [("version", True), ("id,", True)]
+    time.sleep(0.06)
+    adb.reads.clear()
+    asyncio.run(adb.select_product(43))
+    assert adb.reads == [("version", True), ("id,", False)]
@@ -0,0 +1,56 @@
+import os
+import sys
+from pathlib import Path
+from unittest import mock
+
+sys.path.append(str(Path(os.path.dirname(__file__)).parents[1]))
+
+from catalog.cache import LRUCache
+
+
+def test_get_set():
+    cache = LRUCache(maxsize=2, ttl=60)
+    assert cache.get(1) is None
+    cache.set(1, "a")
+    assert cache.get(1) == "a"
+    assert cache.stats() == dict(hits=1, misses=1, size=1)
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    cache.get(1)
+    cache.set(3, "c")
+    assert cache.get(2) is None
+    assert cache.get(1) == "a"
+    assert cache.get(3) == "c"
+
+
+def test_expires_entries():
+    cache = LRUCache(maxsize=2, ttl=10)
+    with mock.patch("catalog.cache.monotonic", return_value=100):
+        cache.set(1, "a")
+    with mock.patch("catalog.cache.monotonic", return_value=111):
+        assert cache.get(1) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_add_keeps_cached_value():
+    cache = LRUCache(maxsize=2, ttl=60)
+    assert cache.add(1, "a") == "a"
+    assert cache.add(1, "b") == "a"
+    assert cache.get(1) == "a"
+
+
+def test_invalidate():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set(1, "a")
+    cache.invalidate(1)
+    assert cache.get(1) is None
+
+
+def test_disabled():
+    cache = LRUCache(maxsize=0, ttl=60)
+    cache.set(1, "a")
+    assert cache.get(1) is None
@@ -0,0 +1,81 @@
+import os
+import sys
+import asyncio
+from pathlib import Path
+
+sys.path.append(str(Path(os.path.dirname(__file__)).parents[1]))
+
+from catalog.changes import ChangeBroadcaster, ChangeFeed
+
+
+def change(id: int, product_id: int = 1) -> dict:
+    return dict(id=id, product_id=product_id, offer_id=10, kind="update", price=id, items_in_stock=1)
+
+
+class FakeAsyncDB:
+    def __init__(self, changes, first_id=1):
+        self.changes = changes
+        self.first_id = first_id
+        self.invalidated = []
+
+    def invalidate_product_offers(self, product_ids):
+        self.invalidated.append(product_ids)
+
+    async def select_change_bounds(self):
+        return dict(first_id=self.first_id, last_id=self.changes[-1]["id"] if self.changes else 0)
+
+    async def select_changes(self, after, limit, product_ids=None, primary=False):
+        return [c for c in self.changes if c["id"] > after and (not product_ids or c["product_id"] in product_ids)][:limit]
+
+
+def test_broadcaster_filters_by_product_and_overflows():
+    async def run():
+        broadcaster = ChangeBroadcaster(buffer=2)
+        everything, product_2 = broadcaster.subscribe(), broadcaster.subscribe([2])
+        broadcaster.publish([change(1, 1), change(2, 2), change(3, 2)])
+        assert [(await everything.get(1))["id"], (await everything.get(1))["id"]] == [1, 2]
+        assert await everything.get(1) is None
+        assert [(await product_2.get(1))["id"], (await product_2.get(1))["id"]] == [2, 3]
+        assert broadcaster.stats() == dict(published=3, overflowed=1, subscriptions=2)
+        broadcaster.unsubscribe(everything)
+        broadcaster.unsubscribe(product_2)
+        assert broadcaster.stats()["subscriptions"] == 0
+
+    asyncio.run(run())
+
+
+def test_poll_invalidates_offers_of_changed_products():
+    async def run():
+        db = FakeAsyncDB([change(1)])
+        feed = ChangeFeed(db)
+        await feed.poll()
+        db.changes += [change(2, 1), change(3, 2), change(4, 2)]
+        await feed.poll()
+        return db.invalidated
+
+    assert asyncio.run(run()) == [{1, 2}]
+
+
+def test_stream_resumes_and_skips_changes_already_sent():
+    async def run():
+        feed = ChangeFeed(FakeAsyncDB([change(1), change(2), change(3, 2), change(4)]))
+        stream = feed.stream([1], last_id=1)
+        assert (await anext(stream)).startswith(b"id: 2\nevent: update\n")
+        assert (await anext(stream)).startswith(b"id: 4\n")
+        feed.broadcaster.publish([change(4), change(5)])
+        assert (await anext(stream)).startswith(b"id: 5\n")
+        await stream.aclose()
+        assert feed.broadcaster.stats()["subscriptions"] == 0
+
+    asyncio.run(run())
+
+
+def test_stream_resets_when_changes_are_gone():
+    async def run():
+        feed = ChangeFeed(FakeAsyncDB([change(5)], first_id=5))
+        stream = feed.stream(last_id=2)
+        assert await anext(stream) == b'event: reset\ndata: {"first_id":5}\n\n'
+        assert (await anext(stream)).startswith(b"id: 5\n")
+        await stream.aclose()
+
+    asyncio.run(run())
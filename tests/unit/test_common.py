@@ -1,10 +1,15 @@
 import os
 import sys
 from pathlib import Path
+from datetime import datetime
+
+import pytest
 
 sys.path.append(str(Path(os.path.dirname(__file__)).parents[1]))
 
-from catalog.common import calculate_growth, compute_prices_to_insert, cleanup_offers
+from catalog.common import calculate_growth, compute_prices_to_insert, cleanup_offers, diff_offers
+from catalog.common import decode_cursor, encode_cursor, next_cursor, to_ndjson, next_refresh_interval, offers_digest
+from catalog.common import FastJSONResponse, to_json
 
 
 def test_cleanup_offers():
@@ -32,3 +37,93 @@ def test_compute_prices_to_insert():
     prices_to_insert = [dict(offer_id=23, price=11), dict(offer_id=25, price=13)]
     assert compute_prices_to_insert(api_offers, db_offers) == prices_to_insert
 
+
+def test_diff_offers():
+    api_offers = [dict(id=1, price=11, items_in_stock=5),
+                  dict(id=2, price=12, items_in_stock=3),
+                  dict(id=3, price=13, items_in_stock=1),
+                  dict(id=4, price=14, items_in_stock=8)]
+    db_offers = [dict(offer_id=23, foreign_id=1, price=10, items_in_stock=5),
+                 dict(offer_id=24, foreign_id=2, price=12, items_in_stock=2),
+                 dict(offer_id=25, foreign_id=3, price=13, items_in_stock=1),
+                 dict(offer_id=26, foreign_id=5, price=15, items_in_stock=1)]
+    diff = diff_offers(api_offers, db_offers)
+    assert diff.prices == [dict(offer_id=23, price=11)]
+    assert diff.stock == [dict(id=2, price=12, items_in_stock=3)]
+    assert diff.new == [dict(id=4, price=14, items_in_stock=8)]
+    assert diff.obsolete == [dict(offer_id=26, foreign_id=5, price=15, items_in_stock=1)]
+
+
+def test_calculate_growth_of_buckets():
+    buckets = [dict(open=13, close=17), dict(open=17, close=11)]
+    assert calculate_growth(buckets, "open", "close") == -15.38
+
+
+def test_calculate_growth_of_rows():
+    rows = [(1, 13, datetime(2022, 1, 1)), (2, 11, datetime(2022, 1, 2))]
+    assert calculate_growth(rows, 1, 1) == -15.38
+
+
+def test_cursor_round_trip():
+    records = [dict(valid_from=datetime(2022, 1, 1), id=3), dict(valid_from=datetime(2022, 1, 2), id=4)]
+    cursor = next_cursor(records, 2, ("valid_from", "id"))
+    assert decode_cursor(cursor, (str, int)) == ["2022-01-02T00:00:00", 4]
+
+
+def test_cursor_of_rows():
+    rows = [(3, 10, datetime(2022, 1, 1)), (4, 11, datetime(2022, 1, 2, 0, 0, 0, 5))]
+    assert decode_cursor(next_cursor(rows, 2, (2, 0)), (str, int)) == ["2022-01-02T00:00:00.000005", 4]
+
+
+def test_next_cursor_last_page():
+    assert next_cursor([dict(id=1)], 2, ("id",)) is None
+    assert next_cursor([dict(id=1)], None, ("id",)) is None
+
+
+def test_decode_invalid_cursor():
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor", (int,))
+
+
+@pytest.mark.parametrize("key", [{"id": 1}, [], [1, 2], ["1"], [1.5], [True], [None]])
+def test_decode_cursor_of_wrong_shape(key):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(key), (int,))
+
+
+@pytest.mark.parametrize("key", [["2022-01-02T00:00:00"], [4, "2022-01-02T00:00:00"], ["2022-01-02T00:00:00", "4"]])
+def test_decode_price_cursor_of_wrong_shape(key):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(key), (str, int))
+
+
+def test_to_ndjson():
+    records = [dict(price=1, valid_from=datetime(2022, 1, 1)), dict(price=2, valid_from=datetime(2022, 1, 2))]
+    assert to_ndjson(records) == (b'{"price":1,"valid_from":"2022-01-01T00:00:00"}\n'
+                                  b'{"price":2,"valid_from":"2022-01-02T00:00:00"}\n')
+
+
+def test_to_json_matches_fastapi_encoding():
+    prices = dict(prices=[dict(price=1, valid_from=datetime(2022, 1, 1)),
+                          dict(price=2, valid_from=datetime(2022, 1, 2, 10, 30, 0, 120))], growth=100.0)
+    assert to_json(prices) == (b'{"prices":[{"price":1,"valid_from":"2022-01-01T00:00:00"},'
+                               b'{"price":2,"valid_from":"2022-01-02T10:30:00.000120"}],"growth":100.0}')
+    response = FastJSONResponse(dict(id=1, name="sekačka"), headers={"X-Next-Cursor": "abc"})
+    assert response.body == '{"id":1,"name":"sekačka"}'.encode()
+    assert response.headers["content-type"] == "application/json"
+    assert response.headers["x-next-cursor"] == "abc"
+
+
+def test_next_refresh_interval():
+    assert next_refresh_interval(0, False, 30, 3600) == 30
+    assert next_refresh_interval(100, True, 30, 3600) == 50
+    assert next_refresh_interval(40, True, 30, 3600) == 30
+    assert next_refresh_interval(100, False, 30, 3600) == 150
+    assert next_refresh_interval(3000, False, 30, 3600) == 3600
+
+
+def test_offers_digest_ignores_order():
+    offers = [dict(id=1, price=11, items_in_stock=5), dict(id=2, price=12, items_in_stock=3)]
+    reordered = [dict(items_in_stock=3, price=12, id=2), dict(id=1, price=11, items_in_stock=5)]
+    assert offers_digest(offers) == offers_digest(reordered)
+    assert offers_digest(offers) != offers_digest([dict(id=1, price=10, items_in_stock=5), offers[1]])
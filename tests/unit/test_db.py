@@ -0,0 +1,15 @@
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(os.path.dirname(__file__)).parents[1]))
+
+from catalog.db import places, row_places
+
+
+def test_places():
+    assert places([1, 2, 3]) == "%s,%s,%s"
+
+
+def test_row_places():
+    assert row_places([(1, 2), (3, 4), (5, 6)], 2) == "(%s,%s),(%s,%s),(%s,%s)"
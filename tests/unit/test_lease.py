@@ -0,0 +1,66 @@
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(os.path.dirname(__file__)).parents[1]))
+
+from catalog.lease import ShardLease
+
+
+class FakeDB:
+    """
+    In memory model of updater_worker and updater_shard tables with no lease expiration.
+    """
+    def __init__(self):
+        self.workers = set()
+        self.shards = {}
+
+    def insert_updater_shards(self, shards_count):
+        for shard in range(shards_count):
+            self.shards.setdefault(shard, None)
+
+    def heartbeat_updater_worker(self, worker, ttl):
+        self.workers.add(worker)
+        return len(self.workers)
+
+    def renew_updater_shards(self, worker, ttl):
+        return sorted(shard for shard, owner in self.shards.items() if owner == worker)
+
+    def claim_updater_shards(self, worker, count, ttl):
+        free = sorted(shard for shard, owner in self.shards.items() if owner is None)[:count]
+        for shard in free:
+            self.shards[shard] = worker
+        return len(free)
+
+    def release_updater_shards(self, worker, shards):
+        for shard in shards:
+            self.shards[shard] = None
+
+    def release_updater_worker(self, worker):
+        self.workers.discard(worker)
+        self.release_updater_shards(worker, self.renew_updater_shards(worker, 0))
+
+
+def test_single_worker_owns_all_shards():
+    lease = ShardLease(FakeDB(), shards=4, ttl=60)
+    assert lease.acquire() == [0, 1, 2, 3]
+
+
+def test_workers_split_shards_without_duplicates():
+    db = FakeDB()
+    first, second = ShardLease(db, shards=5, ttl=60), ShardLease(db, shards=5, ttl=60)
+    assert first.acquire() == [0, 1, 2, 3, 4]
+    assert second.acquire() == []
+    assert first.acquire() == [0, 1, 2]
+    assert second.acquire() == [3, 4]
+
+
+def test_released_shards_are_taken_over():
+    db = FakeDB()
+    first, second = ShardLease(db, shards=4, ttl=60), ShardLease(db, shards=4, ttl=60)
+    first.acquire()
+    second.acquire()
+    first.acquire()
+    second.acquire()
+    first.release()
+    assert second.acquire() == [0, 1, 2, 3]
@@ -0,0 +1,35 @@
+import os
+import sys
+from pathlib import Path
+
+from prometheus_client import CollectorRegistry
+
+sys.path.append(str(Path(os.path.dirname(__file__)).parents[1]))
+
+from catalog.metrics import PoolCollector, caller_name
+from catalog.pool import PoolStats
+
+
+def primitive():
+    return caller_name()
+
+
+def select_something():
+    return primitive()
+
+
+def test_caller_name_is_name_of_db_method():
+    assert select_something() == "select_something"
+
+
+def test_pool_collector_exports_current_pools():
+    stats = PoolStats(4)
+    stats.in_use = 1
+    pools = dict(updater=stats)
+
+    registry = CollectorRegistry()
+    PoolCollector(lambda: pools).register(registry)
+    assert registry.get_sample_value("db_pool_utilization", dict(pool="updater")) == 0.25
+    assert registry.get_sample_value("db_pool_size", dict(pool="api")) is None
+    pools["api"] = PoolStats(20)
+    assert registry.get_sample_value("db_pool_size", dict(pool="api")) == 20
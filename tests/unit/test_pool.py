@@ -0,0 +1,93 @@
+import os
+import sys
+import asyncio
+import threading
+from pathlib import Path
+from contextlib import asynccontextmanager
+
+import pytest
+
+sys.path.append(str(Path(os.path.dirname(__file__)).parents[1]))
+
+from catalog.pool import BoundedPool, AsyncBoundedPool, PoolExhausted
+
+
+class FakeConnection:
+    def close(self):
+        pass
+
+
+class FakePool:
+    def get_connection(self):
+        return FakeConnection()
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield FakeConnection()
+
+
+def test_connection_is_returned():
+    pool = BoundedPool(FakePool(), size=1, timeout=0.01, max_waiting=1, retry_after=1)
+    with pool.connection():
+        assert pool.stats.in_use == 1
+    with pool.connection():
+        pass
+    assert pool.stats.as_dict()["acquired"] == 2
+    assert pool.stats.in_use == 0
+
+
+def test_timeout():
+    pool = BoundedPool(FakePool(), size=1, timeout=0.01, max_waiting=1, retry_after=3)
+    with pool.connection():
+        with pytest.raises(PoolExhausted) as err:
+            with pool.connection():
+                pass
+    assert err.value.retry_after == 3
+    assert pool.stats.timeouts == 1
+
+
+def test_rejects_when_queue_is_full():
+    pool = BoundedPool(FakePool(), size=1, timeout=1, max_waiting=1, retry_after=1)
+    release = threading.Event()
+
+    def hold():
+        with pool.connection():
+            release.wait()
+
+    def wait():
+        with pool.connection():
+            pass
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    while pool.stats.in_use == 0:
+        pass
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    while pool.stats.waiting == 0:
+        pass
+    with pytest.raises(PoolExhausted):
+        with pool.connection():
+            pass
+    release.set()
+    holder.join()
+    waiter.join()
+    assert pool.stats.rejected == 1
+    assert pool.stats.acquired == 2
+
+
+def test_async_timeout_and_rejection():
+    async def run():
+        pool = AsyncBoundedPool(FakePool(), size=1, timeout=0.05, max_waiting=1, retry_after=1)
+        async with pool.connection():
+            waiter = asyncio.create_task(pool.connection().__aenter__())
+            await asyncio.sleep(0)
+            with pytest.raises(PoolExhausted):
+                async with pool.connection():
+                    pass
+            with pytest.raises(PoolExhausted):
+                await waiter
+        return pool.stats
+
+    stats = asyncio.run(run())
+    assert (stats.rejected, stats.timeouts, stats.in_use, stats.waiting) == (1, 1, 0, 0)
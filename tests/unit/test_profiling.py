@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+from pathlib import Path
+
+sys.path.append(str(Path(os.path.dirname(__file__)).parents[1]))
+
+from catalog.profiling import Profile, Profiler, SlowQueryLog, coroutine_stack
+
+
+def test_slow_query_log_keeps_queries_over_threshold_and_explains_each_method_once(monkeypatch):
+    monkeypatch.setenv("SLOW_QUERY_THRESHOLD", "0.5")
+    monkeypatch.setenv("SLOW_QUERY_EXPLAIN", "1")
+    monkeypatch.setenv("SLOW_QUERY_LOG_SIZE", "2")
+    slow_queries = SlowQueryLog("api")
+    assert not slow_queries.is_slow(0.1)
+    assert slow_queries.is_slow(0.5)
+
+    assert slow_queries.should_explain("select_product", " SELECT * FROM product")
+    assert not slow_queries.should_explain("select_product", "SELECT * FROM product")
+    assert not slow_queries.should_explain("add_price_partitions", "ALTER TABLE price ADD PARTITION")
+
+    for i in range(3):
+        slow_queries.record("select_product", "SELECT *\n  FROM product WHERE id=%s", 1, i, 0.5 + i, plan=[])
+    entries = slow_queries.entries()
+    assert [entry["rows"] for entry in entries] == [1, 2]
+    assert entries[0]["sql"] == "SELECT * FROM product WHERE id=%s"
+    assert entries[0]["args"] == 1 and entries[0]["plan"] == []
+
+
+def test_zero_threshold_disables_slow_query_log(monkeypatch):
+    monkeypatch.setenv("SLOW_QUERY_THRESHOLD", "0")
+    assert not SlowQueryLog("api").is_slow(100)
+
+
+async def wait_for(event: asyncio.Event):
+    await event.wait()
+
+
+def test_coroutine_stack_ends_with_awaited_object():
+    async def run():
+        event = asyncio.Event()
+        task = asyncio.create_task(wait_for(event))
+        await asyncio.sleep(0)
+        stack = coroutine_stack(task.get_coro())
+        event.set()
+        await task
+        return stack
+
+    stack = asyncio.run(run())
+    assert stack[0] == f"{__name__}:wait_for"
+    assert stack[1] == "asyncio.locks:wait"
+    assert stack[-1].startswith("[await ")
+
+
+def test_profile_collapsed_stacks():
+    profile = Profile(1, "GET /product/1")
+    profile.add(["main:get_product", "aiodb:select_product"])
+    profile.add(["main:get_product", "aiodb:select_product"])
+    profile.add(["main:get_product"])
+    profile.add([])
+    assert profile.collapsed() == "main:get_product;aiodb:select_product 2\nmain:get_product 1\n"
+    assert profile.summary()["samples"] == 3
+
+
+def test_request_profile_samples_the_request_and_its_tasks(monkeypatch):
+    monkeypatch.setenv("PROFILE_INTERVAL", "0.001")
+    monkeypatch.setenv("PROFILE_HEADER", "1")
+    profiler = Profiler()
+    assert profiler.wants([(b"x-profile", b"1")])
+    assert not profiler.wants([(b"accept", b"*/*")])
+
+    async def child():
+        await asyncio.sleep(0.05)
+
+    async def request():
+        with profiler.profile_request("GET /") as profile:
+            await asyncio.create_task(child())
+            # busy on the event loop thread
+            end = time.perf_counter() + 0.05
+            while time.perf_counter() < end:
+                pass
+        return profile
+
+    profile = asyncio.run(request())
+    assert profile.duration >= 0.1
+    assert profiler.get(profile.id) is profile
+    assert profiler.profiles()[0]["name"] == "GET /"
+    stacks = profile.collapsed()
+    assert f"{__name__}:request;[await " in stacks
+    assert f"{__name__}:child;asyncio.tasks:sleep;[await " in stacks
+    # running on the event loop thread, the stack starts at the request coroutine
+    assert f"\n{__name__}:request " in "\n" + stacks
+
+
+def test_thread_profile_samples_threads_by_name_prefix(monkeypatch):
+    monkeypatch.setenv("PROFILE_INTERVAL", "0.001")
+    monkeypatch.setenv("PROFILE_KEEP", "1")
+    profiler = Profiler()
+
+    def sync_batch():
+        time.sleep(0.05)
+
+    with profiler.profile_threads("updater sweep", "offers-sweep-") as profile:
+        worker = threading.Thread(target=sync_batch, name="offers-sweep-sync_0")
+        other = threading.Thread(target=sync_batch, name="offers-register_0")
+        worker.start()
+        other.start()
+        worker.join()
+        other.join()
+    with profiler.profile_threads("updater sweep", "offers-sweep-") as last:
+        pass
+
+    assert "offers-sweep-sync;threading:_bootstrap" in profile.collapsed()
+    assert "offers-register" not in profile.collapsed()
+    assert f"{__name__}:sync_batch" in profile.collapsed()
+    assert profiler.get(profile.id) is None and profiler.get(last.id) is last
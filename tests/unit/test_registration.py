@@ -0,0 +1,83 @@
+import os
+import sys
+from pathlib import Path
+
+import requests
+
+sys.path.append(str(Path(os.path.dirname(__file__)).parents[1]))
+
+from catalog.registration import RegistrationDrainer
+
+
+def http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status}", response=response)
+
+
+class FakeDB:
+    def __init__(self, products):
+        self.outbox = products
+        self.deleted = []
+        self.retries = {}
+
+    def claim_registrations(self, limit, claim_ttl):
+        claimed, self.outbox = self.outbox[:limit], self.outbox[limit:]
+        return claimed
+
+    def delete_registrations(self, product_ids):
+        self.deleted += product_ids
+
+    def retry_registrations(self, delays):
+        self.retries |= delays
+
+
+class FakeOffersApi:
+    errors = {2: http_error(503), 3: http_error(400), 4: http_error(409), 5: ConnectionError("reset")}
+
+    def register_products(self, products, concurrency):
+        return {product.id: self.errors[product.id] for product in products if product.id in self.errors}
+
+
+class FakeUpdater:
+    def __init__(self, db=None):
+        self.updated = []
+        self.deleted_before = []
+        self._db = db
+
+    def update_products(self, product_ids):
+        self.updated += product_ids
+        if self._db:
+            self.deleted_before += self._db.deleted
+
+
+def product(id: int, attempts: int = 1) -> dict:
+    return dict(id=id, name=f"product {id}", description="", attempts=attempts)
+
+
+def test_drain_registers_in_batches_and_fetches_offers(monkeypatch):
+    monkeypatch.setenv("REGISTRATION_BATCH_SIZE", "2")
+    db, updater = FakeDB([product(1), product(6), product(7)]), FakeUpdater()
+    assert RegistrationDrainer(db, FakeOffersApi(), updater).drain() == 3
+    assert db.deleted == [1, 6, 7]
+    assert updater.updated == [1, 6, 7]
+
+
+def test_failed_registrations_are_retried_or_dropped():
+    db, updater = FakeDB([product(1), product(2), product(3), product(4), product(5, attempts=3)]), FakeUpdater()
+    drainer = RegistrationDrainer(db, FakeOffersApi(), updater)
+    drainer.drain()
+    # conflict is an earlier registration which got through, other 4xx are rejections
+    assert db.deleted == [1, 4, 3]
+    assert updater.updated == [1, 4]
+    assert list(db.retries) == [2, 5]
+    assert db.retries[2] <= 1 and db.retries[5] <= 4
+    assert drainer.stats() == dict(registered=2, retried=2, rejected=1)
+
+
+def test_registered_products_leave_outbox_after_their_offers_are_fetched():
+    db = FakeDB([product(1), product(3)])
+    updater = FakeUpdater(db)
+    RegistrationDrainer(db, FakeOffersApi(), updater).drain()
+    assert updater.updated == [1] and updater.deleted_before == []
+    assert db.deleted == [1, 3]
@@ -0,0 +1,57 @@
+import os
+import sys
+from time import monotonic, sleep
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(os.path.dirname(__file__)).parents[1]))
+
+from catalog.resilience import TokenBucket, CircuitBreaker, CircuitOpen, LatencyStats, backoff_delay
+
+
+def test_backoff_delay_is_capped():
+    assert all(0 <= backoff_delay(attempt, 0.5, 2) <= min(2, 0.5 * 2 ** attempt) for attempt in range(10))
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=100, burst=2)
+    start = monotonic()
+    for _ in range(4):
+        bucket.acquire()
+    # burst of two is immediate, the other two wait for 10 ms each
+    assert monotonic() - start >= 0.015
+
+
+def test_circuit_breaker_opens_and_recovers():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.01)
+    breaker.record_failure()
+    breaker.check()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    sleep(0.01)
+    breaker.check()
+    # only a single trial call is let through
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.check()
+
+
+def test_circuit_breaker_reopens_after_failed_trial():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=0.01)
+    for _ in range(5):
+        breaker.record_failure()
+    sleep(0.01)
+    breaker.check()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_latency_stats():
+    stats = LatencyStats()
+    for latency in range(1, 101):
+        stats.record(latency / 100, error=latency > 98)
+    assert stats.as_dict() == dict(count=100, errors=2, max=1.0, avg=pytest.approx(0.505), p50=0.5, p99=0.99)
@@ -0,0 +1,78 @@
+import os
+import sys
+from pathlib import Path
+from contextlib import contextmanager
+
+sys.path.append(str(Path(os.path.dirname(__file__)).parents[1]))
+
+from catalog.retention import PriceRetention, partitions_to_add, expired_partitions, DAY
+
+
+NOW = 20000 * DAY + 3600
+
+
+def test_partitions_to_add_prepares_days_ahead():
+    assert partitions_to_add(946684800, NOW, 2) == [20001 * DAY, 20002 * DAY, 20003 * DAY]
+    assert partitions_to_add(20002 * DAY, NOW, 2) == [20003 * DAY]
+    assert partitions_to_add(20003 * DAY, NOW, 2) == []
+
+
+def test_expired_partitions():
+    partitions = [dict(name="p0", bound=DAY), dict(name="p2", bound=2 * DAY), dict(name="p3", bound=3 * DAY),
+                  dict(name="pmax", bound=None)]
+    assert expired_partitions(partitions, 2 * DAY) == [dict(name="p0", bound=DAY, start=0),
+                                                       dict(name="p2", bound=2 * DAY, start=DAY)]
+    assert expired_partitions(partitions[-1:], 10 * DAY) == []
+
+
+class FakeDB:
+    def __init__(self, partitions):
+        self.partitions = partitions
+        self.retention = dict(raw_since=1, hourly_since=1)
+        self.calls = []
+        self.hourly = 15000
+
+    @contextmanager
+    def price_retention_lock(self):
+        yield True
+
+    def select_price_partitions(self):
+        return self.partitions
+
+    def add_price_partitions(self, bounds):
+        self.calls.append(("add", bounds))
+
+    def rollup_price_partition(self, name, start, end):
+        self.calls.append(("rollup", name, start, end))
+
+    def update_price_retention(self, raw_since=None, hourly_since=None):
+        self.calls.append(("retention", raw_since, hourly_since))
+        self.retention["raw_since"] = raw_since or self.retention["raw_since"]
+        self.retention["hourly_since"] = hourly_since or self.retention["hourly_since"]
+
+    def drop_price_partition(self, name):
+        self.calls.append(("drop", name))
+
+    def select_price_retention(self):
+        return dict(self.retention)
+
+    def delete_hourly_prices(self, before, limit):
+        deleted = min(limit, self.hourly)
+        self.hourly -= deleted
+        return deleted
+
+
+def test_run_rolls_up_before_drop_and_expires_hourly(monkeypatch):
+    monkeypatch.setenv("PRICE_RAW_DAYS", "2")
+    monkeypatch.setenv("PRICE_HOURLY_DAYS", "1")
+    monkeypatch.setenv("PRICE_PARTITIONS_AHEAD", "1")
+    db = FakeDB([dict(name="p19997", bound=19997 * DAY), dict(name="p19999", bound=19999 * DAY),
+                 dict(name="pmax", bound=None)])
+    PriceRetention(db).run(NOW)
+    assert db.calls == [("add", [20001 * DAY, 20002 * DAY]),
+                        ("rollup", "p19997", 0, 19997 * DAY),
+                        ("retention", 19997 * DAY, None),
+                        ("drop", "p19997"),
+                        # hourly rollups are kept at least as long as raw prices
+                        ("retention", None, 19997 * DAY)]
+    assert db.hourly == 0
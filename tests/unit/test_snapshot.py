@@ -0,0 +1,37 @@
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(os.path.dirname(__file__)).parents[1]))
+
+from catalog.snapshot import ProductOffers, OffersSnapshot
+
+
+OFFERS = [dict(offer_id=3, price=30, items_in_stock=0),
+          dict(offer_id=1, price=10, items_in_stock=5),
+          dict(offer_id=4, price=None, items_in_stock=2),
+          dict(offer_id=2, price=20, items_in_stock=1)]
+
+
+def test_select_skips_unpriced_and_filters_stock():
+    offers = ProductOffers(7, OFFERS)
+    assert len(offers) == 3
+    assert offers.select() == [dict(offer_id=1, product_id=7, price=10, items_in_stock=5),
+                               dict(offer_id=2, product_id=7, price=20, items_in_stock=1)]
+    assert [offer["offer_id"] for offer in offers.select(on_stock=False)] == [1, 2, 3]
+
+
+def test_select_page():
+    offers = ProductOffers(7, OFFERS)
+    assert [offer["offer_id"] for offer in offers.select(False, limit=2)] == [1, 2]
+    assert [offer["offer_id"] for offer in offers.select(False, after=[2], limit=2)] == [3]
+    assert offers.select(True, after=[2]) == []
+
+
+def test_put_replaces_offers():
+    snapshot = OffersSnapshot()
+    snapshot.put(7, OFFERS)
+    first = snapshot.get(7)
+    snapshot.put(7, OFFERS[:1])
+    assert len(first) == 3
+    assert snapshot.get(7).select(False) == [dict(offer_id=3, product_id=7, price=30, items_in_stock=0)]
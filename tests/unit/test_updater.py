@@ -0,0 +1,136 @@
+import os
+import sys
+import threading
+from pathlib import Path
+
+sys.path.append(str(Path(os.path.dirname(__file__)).parents[1]))
+
+from catalog.updater import OffersUpdater
+from catalog.common import offers_digest
+from catalog.snapshot import OffersSnapshot
+
+
+class FakeDB:
+    def __init__(self, due):
+        self.due = due
+        self.synced = {}
+        self.intervals = {}
+
+    def select_due_products(self, limit):
+        return self.due
+
+    def select_products_refresh(self, product_ids):
+        return {product_id: self.due[product_id] for product_id in product_ids}
+
+    def sync_offers(self, api_offers):
+        self.synced |= api_offers
+        current = {product_id: [dict(offer_id=product_id * 10 + offer["id"], price=offer["price"],
+                                     items_in_stock=offer["items_in_stock"]) for offer in offers]
+                   for product_id, offers in api_offers.items()}
+        return {3}, current
+
+    def update_refresh_schedule(self, intervals, digests=None):
+        self.intervals |= intervals
+
+
+class FakeOffersApi:
+    def get_offers(self, id):
+        if id == 2:
+            raise RuntimeError("upstream down")
+        return [dict(id=1, price=id * 100, items_in_stock=1)]
+
+
+def due(**intervals):
+    return {int(id[1:]): dict(interval_s=interval, offers_digest=None) for id, interval in intervals.items()}
+
+
+def test_update_due_skips_failed_product():
+    db = FakeDB(due(p1=0, p2=100, p3=100))
+    OffersUpdater(db, FakeOffersApi()).update_due()
+    assert db.synced == {1: [dict(id=1, price=100, items_in_stock=1)],
+                         3: [dict(id=1, price=300, items_in_stock=1)]}
+
+
+def test_update_due_adapts_intervals():
+    db = FakeDB(due(p1=0, p2=100, p3=100, p4=100))
+    OffersUpdater(db, FakeOffersApi()).update_due()
+    # new product starts at min interval, changed one halves, failed and unchanged ones back off
+    assert db.intervals == {1: 30, 2: 150, 3: 50, 4: 150}
+
+
+def test_update_due_skips_unchanged_offers():
+    db = FakeDB(due(p1=100, p3=100))
+    db.due[1]["offers_digest"] = offers_digest([dict(id=1, price=100, items_in_stock=1)])
+    updater = OffersUpdater(db, FakeOffersApi())
+    updater.update_due()
+    assert list(db.synced) == [3]
+    assert db.intervals == {1: 150, 3: 50}
+    assert updater.stats() == dict(fetched=2, skipped=1, synced=1, failed=0, skip_ratio=0.5)
+
+
+def test_update_due_writes_offers_snapshot():
+    db = FakeDB(due(p1=100, p2=100))
+    snapshot = OffersSnapshot()
+    OffersUpdater(db, FakeOffersApi(), offers_snapshot=snapshot).update_due()
+    assert snapshot.get(1).select() == [dict(offer_id=11, product_id=1, price=100, items_in_stock=1)]
+    assert snapshot.get(2) is None
+
+
+def test_update_products_ignores_schedule():
+    db = FakeDB(due(p1=100, p3=100))
+    OffersUpdater(db, FakeOffersApi()).update_products([3])
+    assert list(db.synced) == [3]
+    assert db.intervals == {3: 50}
+
+
+class FailingSyncDB(FakeDB):
+    def sync_offers(self, api_offers):
+        raise RuntimeError("deadlock")
+
+
+def test_failed_sync_backs_off():
+    db = FailingSyncDB(due(p1=100, p3=100))
+    updater = OffersUpdater(db, FakeOffersApi())
+    updater.update_due()
+    assert db.intervals == {1: 150, 3: 150}
+    assert updater.stats()["failed"] == 2
+
+
+class BlockingOffersApi(FakeOffersApi):
+    def __init__(self):
+        self.running, self.release, self.calls = threading.Event(), threading.Event(), []
+
+    def get_offers(self, id):
+        self.calls.append(id)
+        if id == 1:
+            self.running.set()
+            self.release.wait(5)
+        return super().get_offers(id)
+
+
+def test_update_products_waits_for_running_sweep():
+    api = BlockingOffersApi()
+    db = FakeDB(due(p1=100, p3=100))
+    db.select_due_products = lambda limit: due(p1=100)
+    updater = OffersUpdater(db, api)
+    sweep = threading.Thread(target=updater.update_due)
+    sweep.start()
+    api.running.wait(5)
+    targeted = threading.Thread(target=updater.update_products, args=([3],))
+    targeted.start()
+    targeted.join(0.1)
+    assert targeted.is_alive() and api.calls == [1]
+    api.release.set()
+    sweep.join(5)
+    targeted.join(5)
+    assert api.calls == [1, 3]
+
+
+def test_update_due_runs_in_steps_of_db_worker_batches(monkeypatch):
+    monkeypatch.setenv("UPDATER_BATCH_SIZE", "1")
+    monkeypatch.setenv("UPDATER_DB_WORKERS", "2")
+    updater = OffersUpdater(FakeDB(due(p1=0, p3=0, p4=0)), FakeOffersApi())
+    steps = []
+    updater._update = lambda due, threads: steps.append((list(due), updater._update_lock.locked()))
+    updater.update_due()
+    assert steps == [([1, 3], True), ([4], True)]